@@ -0,0 +1,105 @@
+'''
+Import time benchmark
+
+Description : Times _import pylumerical_ in fresh interpreters, as each job
+wrapper of a sweep pays it, and checks that the import prints nothing and
+leaves the heavy optional dependencies (numpy, pandas, multiprocessing)
+unimported until their features are used (see _LazyModule_).
+
+    python benchmarks/importtime.py --repeat 20 --output importtime.json
+    python benchmarks/importtime.py --compare importtime.json --tolerance 0.25
+
+Exits with status 1 when a heavy module is imported, the import prints
+anything, or (with --compare) the median import is slower than the saved one
+by more than the tolerance, so the benchmark can gate CI.
+'''
+
+from __future__ import division, print_function
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+HEAVY = ('numpy', 'pandas', 'multiprocessing')  # imported only when first needed
+
+PROBE = '''
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.time()
+import pylumerical
+seconds = time.time() - start
+sys.stderr.write(json.dumps([seconds, sorted(m for m in {heavy!r} if m in sys.modules)]))
+'''
+
+
+def importonce(python=sys.executable):
+    '''
+    Returns (seconds, heavy modules imported, text printed) of importing
+    pylumerical in a new _python_ interpreter
+    '''
+    probe = PROBE.format(root=os.path.dirname(here), heavy=HEAVY)
+    environment = dict((key, value) for key, value in os.environ.items()
+                       if key != 'PYTHONDONTWRITEBYTECODE')
+    process = subprocess.Popen([python, '-c', probe], stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, env=environment)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError("import pylumerical failed :\n" + stderr.decode())
+
+    seconds, heavy = json.loads(stderr.decode().strip().splitlines()[-1])
+    return seconds, heavy, stdout.decode()
+
+
+def benchmark(repeat=10, python=sys.executable):
+    '''
+    Returns {'median', 'min', 'max'} seconds of _repeat_ imports, the heavy
+    modules imported and anything printed
+    '''
+    importonce(python)  # leaves compiled bytecode behind, as an installed package has
+    runs = [importonce(python) for n in range(repeat)]
+    seconds = sorted(run[0] for run in runs)
+    timings = {'median': seconds[len(seconds) // 2], 'min': seconds[0], 'max': seconds[-1]}
+    heavy = sorted(set(module for run in runs for module in run[1]))
+    printed = "".join(run[2] for run in runs)
+    return timings, heavy, printed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=10, help="fresh interpreters timed")
+    parser.add_argument('--python', default=sys.executable, help="interpreter to time")
+    parser.add_argument('--output', help="write the timings to this json file")
+    parser.add_argument('--compare', help="json file of timings to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    options = parser.parse_args()
+
+    timings, heavy, printed = benchmark(options.repeat, options.python)
+    print("import pylumerical : median {0:.1f}ms, min {1:.1f}ms, max {2:.1f}ms".format(
+        *[1000 * timings[key] for key in ('median', 'min', 'max')]))
+
+    failed = False
+    if heavy:
+        print("imported on import :", ", ".join(heavy))
+        failed = True
+    if printed:
+        print("printed on import :", repr(printed))
+        failed = True
+
+    if options.output:
+        with open(options.output, 'w') as jsonfile:
+            json.dump({'python': platform.python_version(), 'timings': timings},
+                      jsonfile, indent=1, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare, 'r') as jsonfile:
+            baseline = json.load(jsonfile)['timings']
+        if timings['median'] > baseline['median'] * (1 + options.tolerance):
+            print("median import {0:.1f}ms (was {1:.1f}ms)".format(
+                1000 * timings['median'], 1000 * baseline['median']))
+            failed = True
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,147 @@
+'''
+Pipeline benchmarks
+
+Description : Times each stage of a parameter sweep (generation, simulation,
+processing and loading) against the fake engine (see _fakeengine_) so that
+the overheads of pylumerical itself can be followed between versions. With
+no engine latency every second measured is spent in pylumerical, the shell
+or the file system.
+
+    python benchmarks/pipeline.py --output timings.json
+    python benchmarks/pipeline.py --compare timings.json --tolerance 0.25
+
+The default 'full' profile runs sweeps of 10, 1000 and 100000 points and
+the 'quick' profile (--profile quick) only the first two; --sizes runs any
+others. --compare exits with status 1 when any stage is slower than the saved
+timings by more than the tolerance, so the benchmark can gate CI.
+'''
+
+from __future__ import division, print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+import pylumerical as pyl
+from pylumerical import fakeengine
+
+dipoleexample = os.path.join(os.path.dirname(here), 'dipoleexample')
+script = (os.path.join(dipoleexample, 'originalscripts'), 'DipoleArray')
+processing = (os.path.join(dipoleexample, 'processingscripts'), 'farfieldsave')
+
+nm = 1e-9
+defaultparams = {'BravaisTheta': 90, 'LX': 100 * nm, 'LY': 100 * nm, 'MonitorMargin': 2 * nm,
+                 'MarginXY': 200 * nm, 'MarginZ': 100 * nm, 'N01': 0, 'N02': 0, 'N11': 0,
+                 'N12': 0, 'MonitorLoc': 0, 'phi': 0, 'theta': 0}
+
+PROFILES = {'quick': [10, 1000], 'full': [10, 1000, 100000]}  # sweep sizes run
+
+
+def timed(timings, stage, function, *args, **kwargs):
+    start = time.time()
+    result = function(*args, **kwargs)
+    timings[stage] = time.time() - start
+    return result
+
+
+def benchmark(size, workingdir, workers=4, batch_size=100, verbose=0):
+    '''
+    Returns {stage : seconds} of a sweep of _size_ points
+    '''
+    newparams = [('MonitorLoc', [2]),
+                 ('MarginXY', [(100 + 100 * i / size) * nm for i in range(size)])]
+    keyword = 'sweep{0}'.format(size)
+    timings = {}
+
+    fsploc, outputloc = timed(
+        timings, 'ParameterSweepInput', pyl.ParameterSweepInput, workingdir, keyword,
+        newparams, defaultparams, script, max_workers=workers, batch_size=batch_size,
+        short_names=True, verbose=verbose)
+
+    timed(timings, 'ExecuteFSPfiles', pyl.ExecuteFSPfiles, fsploc, cores=8, jobs=workers,
+          verbose=verbose)
+
+    timed(timings, 'ProcessGenerated', pyl.ProcessGenerated, fsploc, outputloc,
+          processing[0], processing[1], {'Monitor': 'PowerMonitor'}, max_workers=workers,
+          batch_size=batch_size, verbose=verbose)
+
+    data = timed(timings, 'LoadSweep', pyl.LoadSweep, outputloc, cache=False)
+    timed(timings, 'LoadSweep (writing cache)', pyl.LoadSweep, outputloc)
+    timed(timings, 'LoadSweep (cached)', pyl.LoadSweep, outputloc)
+    timed(timings, 'QueryRuns', pyl.QueryRuns, outputloc, status='processed')
+
+    if len(data) != size:
+        raise RuntimeError("{0} of {1} sweep points loaded".format(len(data), size))
+
+    return timings
+
+
+def regressions(timings, baseline, tolerance):
+    '''
+    Returns [(size, stage, seconds, baseline seconds)] slower than _tolerance_ allows
+    '''
+    return [(size, stage, seconds, baseline[size][stage])
+            for size, stages in sorted(timings.items()) if size in baseline
+            for stage, seconds in sorted(stages.items()) if stage in baseline[size] and
+            seconds > baseline[size][stage] * (1 + tolerance)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='full',
+                        help="sweep sizes run unless --sizes is given")
+    parser.add_argument('--sizes', type=int, nargs='+')
+    parser.add_argument('--workers', type=int, default=4,
+                        help="concurrent launches of each stage")
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help="sweep points generated or processed per launch")
+    parser.add_argument('--latency', type=float, default=0,
+                        help="seconds taken by each fake engine launch")
+    parser.add_argument('--output', help="write the timings to this json file")
+    parser.add_argument('--compare', help="json file of timings to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--keep', action='store_true', help="keep the sweep directories")
+    parser.add_argument('--verbose', type=int, default=0)
+    options = parser.parse_args()
+    sizes = options.sizes or PROFILES[options.profile]
+
+    workingdir = tempfile.mkdtemp(prefix='pylumerical-benchmark')
+    os.environ['PATH'] = fakeengine.install(os.path.join(workingdir, 'bin')) + \
+        os.pathsep + os.environ['PATH']
+    os.environ['PYLUMERICAL_FAKE_LATENCY'] = str(options.latency)
+
+    timings = {}
+    try:
+        for size in sizes:
+            timings[str(size)] = benchmark(size, workingdir, options.workers,
+                                           options.batch_size, options.verbose)
+            print("\n{0} sweep points".format(size))
+            for stage, seconds in sorted(timings[str(size)].items()):
+                print("  {0:<28}{1:>10.3f}s{2:>12.2f}ms/point".format(
+                    stage, seconds, 1000 * seconds / size))
+    finally:
+        if options.keep:
+            print("\nSweeps kept in", workingdir)
+        else:
+            shutil.rmtree(workingdir, ignore_errors=True)
+
+    if options.output:
+        with open(options.output, 'w') as jsonfile:
+            json.dump({'python': platform.python_version(), 'workers': options.workers,
+                       'batch_size': options.batch_size, 'timings': timings},
+                      jsonfile, indent=1, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare, 'r') as jsonfile:
+            baseline = json.load(jsonfile)['timings']
+        slower = regressions(timings, baseline, options.tolerance)
+        for size, stage, seconds, before in slower:
+            print("{0} at {1} points : {2:.3f}s (was {3:.3f}s)".format(stage, size, seconds, before))
+        sys.exit(1 if slower else 0)
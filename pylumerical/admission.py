@@ -0,0 +1,179 @@
+'''
+Memory admission control of engine jobs
+
+Description : Several engine processes running at once can overcommit the
+memory of a node, and the OOM killer then takes out the whole batch. A
+MemoryBudget only admits a job while the memory projected for the jobs
+already running plus the new job's estimate fits the budget. The projection
+is the larger of the running jobs' estimates and the resident memory of
+every process started from this one, sampled from /proc. A job which
+doesn't fit waits until there is room, and a job killed for memory while
+others were running is run again rather than failed (see the memory_budget
+option of _ExecuteFSPfiles_).
+'''
+
+from __future__ import division, print_function
+from subprocess import CalledProcessError
+import os
+import signal
+import threading
+import time
+from .runner import lastusage
+from .tracing import count, record
+
+OOMKILLED = (-signal.SIGKILL, 128 + signal.SIGKILL)  # exit status of a killed engine
+
+
+def meminfo():
+    '''
+    Returns {field : MB} from /proc/meminfo (e.g. MemTotal, MemAvailable), or
+    {} where there is no /proc
+    '''
+    try:
+        with open('/proc/meminfo', 'r') as infofile:
+            lines = infofile.readlines()
+    except (IOError, OSError):
+        return {}
+
+    info = {}
+    for aline in lines:
+        field, value = aline.split(':', 1)
+        if value.split()[1:] == ['kB']:
+            info[field] = int(value.split()[0]) / 1024
+    return info
+
+
+def descendantrss(pid=None):
+    '''
+    Returns the resident memory in MB of every descendant of process _pid_
+    (default : this one), or None where there is no /proc
+    '''
+    pid = os.getpid() if pid is None else pid
+    try:
+        pids = [int(entry) for entry in os.listdir('/proc') if entry.isdigit()]
+    except OSError:
+        return None
+
+    children, rss = {}, {}
+    for child in pids:
+        try:
+            with open('/proc/{0}/stat'.format(child), 'r') as statfile:
+                stat = statfile.read()
+            with open('/proc/{0}/status'.format(child), 'r') as statusfile:
+                status = statusfile.read()
+        except (IOError, OSError):  # finished meanwhile
+            continue
+        parent = int(stat[stat.rindex(')') + 1:].split()[1])  # the name may hold spaces
+        children.setdefault(parent, []).append(child)
+        for aline in status.splitlines():
+            if aline.startswith('VmRSS:'):
+                rss[child] = int(aline.split()[1]) / 1024
+
+    total, tovisit = 0, list(children.get(pid, []))
+    while tovisit:
+        child = tovisit.pop()
+        total += rss.get(child, 0)
+        tovisit += children.get(child, [])
+    return total
+
+
+class MemoryBudget(object):
+    '''
+    Admits jobs while the memory projected for them fits _budget_ MB, or
+    'auto' for the memory available when it is created
+
+    Optional Parameters
+    -------------------
+    interval (1) : seconds between samples of the running processes while a job waits
+    reserve (0) : MB always left available to the rest of the node
+    '''
+
+    def __init__(self, budget, interval=1, reserve=0):
+        if budget == 'auto':
+            budget = meminfo().get('MemAvailable')
+            if budget is None:
+                raise ValueError("memory budget 'auto' needs /proc/meminfo")
+            budget -= reserve
+
+        self.budget = budget
+        self.interval = interval
+        self.reserve = reserve
+        self.running = {}  # name : estimate in MB
+        self.peak = None  # largest peak memory measured of a job, None before any finished
+        self.condition = threading.Condition()
+
+    def projected(self):
+        '''
+        MB projected for the running jobs
+        '''
+        return max(sum(self.running.values()), descendantrss() or 0)
+
+    def fits(self, estimate):
+        '''
+        True if a job of _estimate_ MB can start now. A job always fits when
+        no other is running. A job of unknown estimate (None) takes the
+        largest peak measured, and only starts alone until a job has finished
+        '''
+        if not self.running:
+            return True
+        if estimate is None:
+            if self.peak is None:
+                return False
+            estimate = self.peak
+        if self.projected() + estimate > self.budget:
+            return False
+        available = meminfo().get('MemAvailable')
+        return available is None or available - estimate >= self.reserve
+
+    def acquire(self, name, estimate):
+        '''
+        Waits until job _name_ of _estimate_ MB (None : unknown) fits
+        '''
+        start, waited = time.time(), False
+        with self.condition:
+            while not self.fits(estimate):
+                self.condition.wait(self.interval)
+                waited = True
+            self.running[name] = estimate if estimate is not None else self.peak or 0
+
+        if waited:
+            record('memory wait', start, time.time() - start, 'wait', job=name,
+                   estimate=estimate)
+
+    def release(self, name, maxrss=None):
+        '''
+        Frees the memory of job _name_, which peaked at _maxrss_ MB
+        '''
+        with self.condition:
+            self.running.pop(name, None)
+            self.peak = max(self.peak or 0, maxrss or 0)
+            self.condition.notify_all()
+
+
+def admitjobs(budget, runjob, estimates=None, verbose=0):
+    '''
+    Wraps _runjob_(fspname, **overrides) so each job waits for _budget_ to
+    admit it. Its estimate comes from _estimates_ {fspname : MB}, otherwise
+    the largest peak measured so far, jobs without an estimate running one
+    at a time until a peak has been measured. A job killed for memory while
+    others were running is run again with twice the estimate
+    '''
+    estimates = dict(estimates or {})
+
+    def admitted(fspname, **overrides):
+        estimate = estimates.get(fspname) or None  # None : the peak, once measured
+        while True:
+            budget.acquire(fspname, estimate)
+            try:
+                return runjob(fspname, **overrides)
+            except CalledProcessError as err:
+                if err.returncode not in OOMKILLED or len(budget.running) < 2:
+                    raise
+                estimate = max(2 * (estimate or budget.peak or 0), lastusage().get('maxrss') or 0)
+                count('memory retries')
+                if verbose > 0:
+                    print(fspname, "was killed for memory, waiting for {0:.0f}MB".format(estimate))
+            finally:
+                budget.release(fspname, lastusage().get('maxrss'))
+
+    return admitted
@@ -0,0 +1,169 @@
+'''
+Content addressed cache of generated and simulated fsp files
+
+Description : Sweep points are keyed on the sha1 hash of the root script
+together with the rendered variables block. A generated (or simulated) fsp
+file whose key has been seen before, under any keyword directory, is copied
+or hardlinked from the cache instead of paying for another Lumerical run.
+'''
+
+from __future__ import division, print_function
+from collections import OrderedDict
+import json
+import os
+import shutil
+import tempfile
+from .template import _sha1
+
+GENERATED = 'generated'  # fsp files straight from the GUI
+SIMULATED = 'simulated'  # fsp files after the engine has run
+
+INDEX = '.cachekeys'  # fspname : key within each fsp directory
+
+
+class SweepCache(object):
+    '''
+    Persistent fsp store within _cache_dir_
+
+    Optional Parameters
+    -------------------
+    max_size (None) : size in bytes after which the least recently used files
+                      are evicted (None : never evict)
+    '''
+
+    def __init__(self, cache_dir, max_size=None, verbose=0):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.verbose = verbose
+
+        for kind in (GENERATED, SIMULATED):
+            if not os.path.exists(os.path.join(cache_dir, kind)):
+                os.makedirs(os.path.join(cache_dir, kind))
+
+    def key(self, template, variables):
+        '''
+        Returns the key of _variables_ rendered into LSFTemplate _template_
+        '''
+        ordered = OrderedDict(sorted(variables.items()))
+        return _sha1(template.digest + template.render(ordered))
+
+    def path(self, kind, key):
+        '''
+        Location of _key_ within the cache
+        '''
+        return os.path.join(self.cache_dir, kind, key + '.fsp')
+
+    def fetch(self, kind, key, dest, link=False):
+        '''
+        Places the cached file _key_ at _dest_, returning False on a miss
+        '''
+        src = self.path(kind, key)
+        if not os.path.exists(src):
+            return False
+
+        if os.path.exists(dest):
+            os.remove(dest)
+
+        try:
+            if not link:
+                raise OSError("copy requested")
+            os.link(src, dest)
+        except (OSError, AttributeError):  # other filesystem or no link support
+            shutil.copy2(src, dest)
+
+        os.utime(src, None)  # marks as recently used for eviction
+
+        if self.verbose > 1:
+            print("Cache hit", kind, key, "->", dest)
+        return True
+
+    def store(self, kind, key, src):
+        '''
+        Copies _src_ into the cache under _key_
+        '''
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.cache_dir, kind))
+        os.close(fd)
+        shutil.copy2(src, tmp)
+        os.rename(tmp, self.path(kind, key))  # atomic, readers never see half a file
+        os.utime(self.path(kind, key), None)
+
+    def size(self):
+        '''
+        Total size in bytes of every cached file
+        '''
+        return sum(os.path.getsize(os.path.join(self.cache_dir, kind, afile))
+                   for kind in (GENERATED, SIMULATED)
+                   for afile in os.listdir(os.path.join(self.cache_dir, kind)))
+
+    def evict(self):
+        '''
+        Removes least recently used files until the cache fits in _max_size_
+        '''
+        if self.max_size is None:
+            return
+
+        cached = []
+        for kind in (GENERATED, SIMULATED):
+            for afile in os.listdir(os.path.join(self.cache_dir, kind)):
+                fullpath = os.path.join(self.cache_dir, kind, afile)
+                stat = os.stat(fullpath)
+                cached.append((stat.st_mtime, stat.st_size, fullpath))
+
+        total = sum(size for mtime, size, fullpath in cached)
+        for mtime, size, fullpath in sorted(cached):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(fullpath)
+            except OSError:  # already evicted by another sweep
+                pass
+            total -= size
+            if self.verbose > 0:
+                print("Evicted", fullpath, "from cache")
+
+    def writeindex(self, fsploc, keys):
+        '''
+        Records the key of each fsp file in _fsploc_ ({fspname : key})
+        '''
+        index = readindex(fsploc)
+        index.update(keys)
+        with open(os.path.join(fsploc, INDEX), 'w') as indexfile:
+            json.dump(index, indexfile, indent=0, sort_keys=True)
+
+    def restore(self, fsploc, kind, fspnames=None, link=False):
+        '''
+        Fetches every cached fsp file of _kind_ into _fsploc_ and returns the
+        names (without .fsp) which were not found
+        '''
+        index = readindex(fsploc)
+        if fspnames is None:
+            fspnames = [fn[:-len('.fsp')] for fn in os.listdir(fsploc)
+                        if fn.endswith('.fsp')]
+
+        return [fspname for fspname in fspnames
+                if fspname not in index or
+                not self.fetch(kind, index[fspname],
+                               os.path.join(fsploc, fspname + '.fsp'), link=link)]
+
+    def save(self, fsploc, kind, fspnames):
+        '''
+        Stores the fsp files _fspnames_ of _fsploc_ and evicts if needed
+        '''
+        index = readindex(fsploc)
+        for fspname in fspnames:
+            fullpath = os.path.join(fsploc, fspname + '.fsp')
+            if fspname in index and os.path.exists(fullpath):
+                self.store(kind, index[fspname], fullpath)
+
+        self.evict()
+
+
+def readindex(fsploc):
+    '''
+    Returns {fspname : key} of the fsp files in _fsploc_ known to the cache
+    '''
+    try:
+        with open(os.path.join(fsploc, INDEX), 'r') as indexfile:
+            return json.load(indexfile)
+    except (IOError, OSError, ValueError):
+        return {}
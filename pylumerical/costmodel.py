@@ -0,0 +1,196 @@
+'''
+Runtime and memory cost model of simulations
+
+Description : The cost of a simulation varies by orders of magnitude within
+a sweep as the mesh grows with the simulation volume and array size. A
+CostModel keeps a history of past runs (their parameters, runtime, cores and
+peak memory) and predicts the cost of a new point from the recorded runs
+nearest to it in parameter space, optionally scaled by the grid points the
+engine reports for its fsp file (see _MeshQuery_). _planjobs_ uses the
+predictions to start the longest jobs first and give each a share of the
+cores in proportion to its cost, never more than similar runs could be laid
+out over (see the cost_model option of _ExecuteFSPfiles_).
+'''
+
+from __future__ import division, print_function
+import json
+import math
+import os
+import re
+import threading
+from .manifest import _plain
+from .runner import RunCommand
+
+HISTORY = 'runhistory.jsonl'  # one json run per line within each sweep directory
+
+MEMORY = re.compile(r'memory[^\d\n]*(\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)\s*([kmgt]?b)?', re.IGNORECASE)
+CELLS = re.compile(r'(?:grid\s*points|mesh\s*cells)[^\d\n]*(\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)',
+                   re.IGNORECASE)
+UNITS = {'b': 1 / 2 ** 20, 'kb': 1 / 1024, 'mb': 1, 'gb': 1024, 'tb': 2 ** 20}
+
+
+def MeshQuery(fsp, engine='fdtd-engine', verbose=0):
+    '''
+    Asks the engine for the memory requirements of fsp file _fsp_ without
+    running it (engine -mr), returning {'memory' : MB, 'cells' : grid points}
+    with whichever of them it reports
+    '''
+    stroutput = RunCommand("{0} -mr {1}".format(engine, fsp), verbose=verbose)
+    query = {}
+    memory = MEMORY.search(stroutput)
+    if memory:
+        query['memory'] = float(memory.group(1)) * UNITS[(memory.group(2) or 'mb').lower()]
+    cells = CELLS.search(stroutput)
+    if cells:
+        query['cells'] = float(cells.group(1))
+    return query
+
+
+def _isnumber(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _logmean(values, weights):
+    return math.exp(sum(w * math.log(v) for v, w in zip(values, weights)) / sum(weights))
+
+
+class CostModel(object):
+    '''
+    Predicts the runtime and peak memory of simulations from the runs
+    recorded in _history_, a json lines file which may be shared between
+    sweeps of the same script
+
+    Optional Parameters
+    -------------------
+    neighbours (4) : number of nearest recorded runs a prediction is drawn from
+    mesh_query (False) : query the grid points of each fsp file (see
+        _MeshQuery_) and scale the cost per grid point of the nearest runs
+        engine ('fdtd-engine') : engine queried
+    '''
+
+    def __init__(self, history, neighbours=4, mesh_query=False, engine='fdtd-engine'):
+        self.history = history
+        self.neighbours = neighbours
+        self.mesh_query = mesh_query
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.runs = []
+
+        if os.path.exists(history):
+            with open(history, 'r') as historyfile:
+                for aline in historyfile:
+                    try:
+                        self.runs.append(json.loads(aline))
+                    except ValueError:  # partly written by an interrupted run
+                        pass
+
+    def record(self, parameters, runtime=None, cores=1, maxrss=None, cells=None,
+               nolayout=False):
+        '''
+        Adds a run of _parameters_ which took _runtime_ seconds on _cores_
+        cores to the history. _nolayout_ records that the engine could not
+        lay the simulation out over _cores_ cores
+        '''
+        run = {'parameters': dict((key, _plain(value)) for key, value in parameters.items()),
+               'runtime': runtime, 'cores': cores, 'maxrss': maxrss, 'cells': cells,
+               'work': runtime * cores if runtime is not None and not nolayout else None,
+               'nolayout': nolayout}
+        with self.lock:
+            self.runs.append(run)
+            with open(self.history, 'a') as historyfile:
+                historyfile.write(json.dumps(run, sort_keys=True) + "\n")
+
+    def _nearest(self, parameters, runs):
+        '''
+        Returns [(distance, run)] of the _neighbours_ runs nearest to
+        _parameters_. Numeric parameters are scaled by their recorded range,
+        any other parameter adds 1 when it differs
+        '''
+        ranges = {}
+        for run in runs:
+            for key, value in run['parameters'].items():
+                if _isnumber(value):
+                    low, high = ranges.get(key, (value, value))
+                    ranges[key] = (min(low, value), max(high, value))
+
+        def distance(run):
+            squares = 0
+            for key in set(parameters) | set(run['parameters']):
+                mine, theirs = parameters.get(key), run['parameters'].get(key)
+                if _isnumber(mine) and _isnumber(theirs):
+                    low, high = ranges.get(key, (0, 0))
+                    squares += ((mine - theirs) / ((high - low) or 1)) ** 2
+                elif mine != theirs:
+                    squares += 1
+            return math.sqrt(squares)
+
+        return sorted(((distance(run), run) for run in runs),
+                      key=lambda pair: pair[0])[:self.neighbours]
+
+    def predict(self, parameters, fsp=None):
+        '''
+        Returns {'work' : core seconds, 'maxrss' : peak MB, 'cells' : grid
+        points, 'maxcores' : most cores similar runs were laid out over} for
+        a simulation of _parameters_, each None when unknown. _fsp_ is the
+        file queried when mesh_query is set
+        '''
+        parameters = dict((key, _plain(value)) for key, value in parameters.items())
+        query = MeshQuery(fsp, self.engine) if self.mesh_query and fsp is not None else {}
+        with self.lock:
+            runs = list(self.runs)
+
+        prediction = {'work': None, 'maxrss': query.get('memory'), 'cells': query.get('cells'),
+                      'maxcores': None}
+
+        nearest = self._nearest(parameters, [run for run in runs if run['work']])
+        if nearest:
+            weights = [1 / (distance + 1e-6) for distance, run in nearest]
+            if prediction['cells'] and all(run['cells'] for distance, run in nearest):
+                prediction['work'] = prediction['cells'] * _logmean(
+                    [run['work'] / run['cells'] for distance, run in nearest], weights)
+            else:
+                prediction['work'] = _logmean([run['work'] for distance, run in nearest], weights)
+
+            measured = [(run['maxrss'], weight) for (distance, run), weight
+                        in zip(nearest, weights) if run['maxrss']]
+            if prediction['maxrss'] is None and measured:
+                prediction['maxrss'] = _logmean(*zip(*measured))
+
+        similar = [run for distance, run in self._nearest(parameters, runs)]
+        failed = [run['cores'] for run in similar if run['nolayout']]
+        if failed:
+            laidout = [run['cores'] for run in similar
+                       if not run['nolayout'] and run['cores'] < min(failed)]
+            prediction['maxcores'] = max(laidout) if laidout else max(1, min(failed) // 2)
+
+        return prediction
+
+
+def planjobs(model, fspnames, parameters, fsploc, cores=8, jobs=1):
+    '''
+    Returns (_fspnames_ longest first, {fspname : cores}, {fspname :
+    prediction}) for running _jobs_ at once on _cores_ cores
+
+    Each job is given cores // jobs cores scaled by its predicted cost over
+    the mean cost, within 1 and the cores similar runs could be laid out
+    over (see _CostModel.predict_). Jobs with no prediction go first with
+    cores // jobs cores. _parameters_ is {fspname : parameters}
+    '''
+    predictions = dict((fspname, model.predict(parameters.get(fspname, {}),
+                                                os.path.join(fsploc, fspname + '.fsp')))
+                       for fspname in fspnames)
+    works = [prediction['work'] for prediction in predictions.values() if prediction['work']]
+    meanwork = sum(works) / len(works) if works else None
+    share = max(1, cores // jobs)
+
+    jobcores = {}
+    for fspname, prediction in predictions.items():
+        if prediction['work'] and meanwork:
+            jobcores[fspname] = int(round(share * prediction['work'] / meanwork))
+        else:
+            jobcores[fspname] = share
+        jobcores[fspname] = max(1, min(jobcores[fspname], cores,
+                                       prediction['maxcores'] or cores))
+
+    order = sorted(fspnames, key=lambda fspname: -(predictions[fspname]['work'] or float('inf')))
+    return order, jobcores, predictions
@@ -0,0 +1,317 @@
+'''
+Execution backends for FDTD-Solutions simulations
+
+Description : An executor runs the engine on fsp files somewhere. The local
+executor runs fdtd-run-local.sh, the MPI executor launches the engine
+through mpiexec and the SSH executor runs on another machine. It keeps a
+persistent OpenSSH connection to that machine, transfers only the fsp files
+the host is missing and pulls the simulated files back. A HostPool spreads
+jobs over several executors in proportion to their cores (see the hosts
+option of _ExecuteFSPfiles_). LocalHost emulates a host as subprocesses
+working in its own directory, so a distributed run can be tried without
+any remote machine. A CorePool shares the cores of one machine between
+jobs given different numbers of cores.
+'''
+
+from __future__ import division, print_function
+import os
+import shutil
+import tempfile
+import threading
+try:
+    from shlex import quote
+except ImportError:  # python2
+    from pipes import quote
+from .runner import RunCommand
+from .template import _sha1
+
+
+def _fspfiles(fsploc, fspnames):
+    '''
+    Returns the fsp filenames of _fspnames_ (default : every fsp file in _fsploc_)
+    '''
+    if fspnames is None:
+        return sorted(fn for fn in os.listdir(fsploc) if fn.endswith('.fsp'))
+    return [fspname + '.fsp' for fspname in fspnames]
+
+
+class Executor(object):
+    '''
+    Runs the engine on the local machine with _cores_ processes
+
+    Optional Parameters
+    -------------------
+    engine ('fdtd-run-local.sh') : engine launcher
+    name ('localhost') : name shown in messages
+    '''
+    engine = 'fdtd-run-local.sh'
+
+    def __init__(self, cores=8, engine=None, name='localhost'):
+        self.cores = cores
+        self.name = name
+        if engine is not None:
+            self.engine = engine
+
+    def command(self, fsploc, fspnames=None, cores=None):
+        '''
+        Returns the shell command running the engine on _fspnames_ (default : all)
+        '''
+        if fspnames is None:
+            fspfiles = os.path.join(fsploc, "*.fsp")
+        else:
+            fspfiles = " ".join(quote(os.path.join(fsploc, fspname + '.fsp'))
+                                for fspname in fspnames)
+
+        return self.engine + " -n " + str(cores or self.cores) + ' ' + fspfiles
+
+    def run(self, fsploc, fspnames=None, cores=None, progress=None, verbose=0):
+        '''
+        Simulates _fspnames_ (default : every fsp file) in _fsploc_ returning
+        the engine output (see _RunCommand_)
+        '''
+        command = self.command(fsploc, fspnames, cores)
+        if verbose > 0:
+            print(self.name, ":", command)
+
+        return RunCommand(command, progress=progress, verbose=verbose)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+LocalExecutor = Executor
+
+
+class MPIExecutor(Executor):
+    '''
+    Runs the engine through MPI, one fsp file after another
+
+    Optional Parameters
+    -------------------
+    engine ('fdtd-engine-mpich2nem') : MPI build of the engine
+    mpiexec ('mpiexec') : MPI launcher
+    options ('') : extra mpiexec options e.g. '-hosts node1,node2'
+    '''
+    engine = 'fdtd-engine-mpich2nem'
+
+    def __init__(self, cores=8, engine=None, mpiexec='mpiexec', options='', name='localhost'):
+        Executor.__init__(self, cores, engine, name)
+        self.mpiexec = mpiexec
+        self.options = options
+
+    def command(self, fsploc, fspnames=None, cores=None):
+        launch = " ".join(part for part in (self.mpiexec, self.options,
+                                            "-n", str(cores or self.cores),
+                                            self.engine, "-t 1") if part)
+        return " && ".join(launch + " " + quote(os.path.join(fsploc, fspfile))
+                           for fspfile in _fspfiles(fsploc, fspnames))
+
+
+class SSHExecutor(Executor):
+    '''
+    Runs the engine on _host_ over ssh
+
+    Every launch reuses one OpenSSH master connection (ControlMaster) which is
+    kept open until _close_. Files are copied with rsync into a directory per
+    fsp directory within _remoteloc_, so only missing or changed files are
+    sent, and simulated files are copied back.
+
+    Optional Parameters
+    -------------------
+    remoteloc ('pylumerical') : working directory on the host (relative to home)
+    shared (False) : the fsp directory is visible on the host at the same
+                     path, so no files are transferred
+    nice (None) : nice level of the engine
+    ssh_options ('') : extra ssh options e.g. '-p 2222 -i key'
+    persist ('10m') : how long an idle master connection stays open
+    '''
+
+    def __init__(self, host, cores=8, remoteloc='pylumerical', shared=False, nice=None,
+                 engine=None, ssh_options='', persist='10m'):
+        Executor.__init__(self, cores, engine, host)
+        self.host = host
+        self.remoteloc = remoteloc
+        self.shared = shared
+        self.nice = nice
+        self.controlpath = os.path.join(tempfile.gettempdir(), 'pylumerical-ssh-%r@%h:%p')
+        self.ssh = "ssh -o ControlMaster=auto -o ControlPath={0} -o ControlPersist={1} {2}".format(
+            quote(self.controlpath), persist, ssh_options).strip()
+
+    def remotedir(self, fsploc):
+        '''
+        Directory holding the files of _fsploc_ on the host
+        '''
+        if self.shared:
+            return fsploc
+        return os.path.join(self.remoteloc, _sha1(os.path.abspath(fsploc))[:10])
+
+    def shell(self, command):
+        '''
+        Returns the local command running shell _command_ on the host
+        '''
+        return "{0} {1} {2}".format(self.ssh, quote(self.host), quote(command))
+
+    def push(self, fsploc, fspnames=None, verbose=0):
+        '''
+        Sends the files of _fspnames_ the host is missing
+        '''
+        remotedir = self.remotedir(fsploc)
+        RunCommand(self.shell("mkdir -p " + quote(remotedir)), verbose=verbose)
+        RunCommand("rsync -a -e {0} {1} {2}:{3}/".format(
+            quote(self.ssh),
+            " ".join(quote(os.path.join(fsploc, fspfile))
+                     for fspfile in _fspfiles(fsploc, fspnames)),
+            quote(self.host), quote(remotedir)), verbose=verbose)
+
+    def pull(self, fsploc, fspnames=None, verbose=0):
+        '''
+        Copies the simulated files of _fspnames_ and their logs back
+        '''
+        patterns = [fspfile[:-len('.fsp')] + suffix for fspfile in _fspfiles(fsploc, fspnames)
+                    for suffix in ('.fsp', '_p*.log')] if fspnames is not None else ['*.fsp', '*.log']
+        RunCommand("rsync -a -e {0} {1} --exclude='*' {2}:{3}/ {4}/".format(
+            quote(self.ssh),
+            " ".join("--include=" + quote(pattern) for pattern in patterns),
+            quote(self.host), quote(self.remotedir(fsploc)), quote(fsploc)), verbose=verbose)
+
+    def command(self, fsploc, fspnames=None, cores=None):
+        remotedir = self.remotedir(fsploc)
+        command = Executor.command(self, '.', fspnames, cores)
+        if self.nice is not None:
+            command = "nice -n {0:.0f} {1}".format(self.nice, command)
+        return self.shell("cd {0} && {1}".format(quote(remotedir), command))
+
+    def run(self, fsploc, fspnames=None, cores=None, progress=None, verbose=0):
+        if not self.shared:
+            self.push(fsploc, fspnames, verbose=verbose)
+
+        stroutput = Executor.run(self, fsploc, fspnames, cores, progress, verbose)
+
+        if not self.shared:
+            self.pull(fsploc, fspnames, verbose=verbose)
+        return stroutput
+
+    def close(self):
+        try:
+            RunCommand("{0} -O exit {1}".format(self.ssh, quote(self.host)))
+        except Exception:  # no master connection open
+            pass
+
+
+class LocalHost(SSHExecutor):
+    '''
+    Stand-in for an SSH host. Commands run as local subprocesses within
+    directory _root_ and files are copied in and out of it, so a
+    distributed run can be tried without any remote machine.
+    '''
+
+    def __init__(self, root, cores=8, nice=None, engine=None, name=None):
+        root = os.path.abspath(root)
+        SSHExecutor.__init__(self, name or root, cores, remoteloc=root, nice=nice,
+                             engine=engine)
+        self.transfers = 0  # files copied in either direction
+
+    def shell(self, command):
+        return "sh -c " + quote(command)
+
+    def _copy(self, source, destination):
+        try:  # copy2 keeps the full mtime, so a file rewritten since differs
+            if (os.path.getsize(source) == os.path.getsize(destination) and
+                    os.stat(source).st_mtime == os.stat(destination).st_mtime):
+                return
+        except OSError:  # missing
+            pass
+        shutil.copy2(source, destination)
+        self.transfers += 1
+
+    def push(self, fsploc, fspnames=None, verbose=0):
+        remotedir = self.remotedir(fsploc)
+        if not os.path.isdir(remotedir):
+            os.makedirs(remotedir)
+        for fspfile in _fspfiles(fsploc, fspnames):
+            self._copy(os.path.join(fsploc, fspfile), os.path.join(remotedir, fspfile))
+
+    def pull(self, fsploc, fspnames=None, verbose=0):
+        remotedir = self.remotedir(fsploc)
+        for fspfile in _fspfiles(remotedir, fspnames):
+            self._copy(os.path.join(remotedir, fspfile), os.path.join(fsploc, fspfile))
+
+    def close(self):
+        pass
+
+
+class HostPool(object):
+    '''
+    Slots for running jobs on _executors_, each executor taking its cores
+    divided by _cores_per_job_ jobs at once (one job using every core when
+    _cores_per_job_ is None)
+    '''
+
+    def __init__(self, executors, cores_per_job=None):
+        self.executors = list(executors)
+        self.cores_per_job = cores_per_job
+        self.slots = [max(1, executor.cores // cores_per_job) if cores_per_job else 1
+                      for executor in self.executors]
+        self.free = list(self.slots)
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return sum(self.slots)
+
+    def acquire(self):
+        '''
+        Waits for a free slot, returning (index, executor, cores). The host with
+        the largest free share of its cores is chosen first
+        '''
+        with self.condition:
+            while not any(self.free):
+                self.condition.wait()
+            i = max(range(len(self.executors)),
+                    key=lambda i: (self.free[i] / self.slots[i], self.executors[i].cores))
+            self.free[i] -= 1
+
+        executor = self.executors[i]
+        return i, executor, min(self.cores_per_job or executor.cores, executor.cores)
+
+    def release(self, i):
+        with self.condition:
+            self.free[i] += 1
+            self.condition.notify()
+
+    def close(self):
+        for executor in self.executors:
+            executor.close()
+
+
+class CorePool(object):
+    '''
+    The _cores_ of a machine shared between concurrent jobs, each job
+    waiting until the cores it asks for are free
+    '''
+
+    def __init__(self, cores):
+        self.cores = cores
+        self.free = cores
+        self.condition = threading.Condition()
+
+    def acquire(self, cores):
+        '''
+        Waits for _cores_ free cores (at most all of them), returning the number taken
+        '''
+        cores = min(cores, self.cores)
+        with self.condition:
+            while self.free < cores:
+                self.condition.wait()
+            self.free -= cores
+        return cores
+
+    def release(self, cores):
+        with self.condition:
+            self.free += cores
+            self.condition.notify_all()
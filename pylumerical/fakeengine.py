@@ -0,0 +1,342 @@
+'''
+Fake Lumerical engine
+
+Description : Stand-ins for fdtd-solutions, fdtd-run-local.sh and
+fdtd-engine (its -mr memory report) which take the same command lines as
+the launchers of _pylumerical_ build, so the pipeline's own overheads
+(templates, file churn, scheduling, retries and loading) can be measured
+and tested without Lumerical licences.
+
+    python fakeengine.py install <bindir>
+
+writes the fakes into <bindir>, which is then put first on PATH.
+fdtd-solutions interprets the few script commands the pipeline relies on :
+variable assignments (strings, numbers and string concatenation),
+replacestring, cd, save, load, write (a num2str matrix), matlabsave (the
+same matrix in a level 5 .mat file), ?"..." and exit.
+Everything else in a script is ignored. The fakes are tuned through
+environment variables :
+
+    PYLUMERICAL_FAKE_LATENCY (0) : seconds taken by every launch
+    PYLUMERICAL_FAKE_RUNTIME (0) : core seconds taken to simulate each fsp file,
+        divided between the cores it runs on
+    PYLUMERICAL_FAKE_COST (None) : script variable scaling the runtime, grid
+        points (1e6 each) and memory (100MB each) of a simulation
+    PYLUMERICAL_FAKE_FSP_BYTES (1024) : size of the fsp files saved
+    PYLUMERICAL_FAKE_CSV_SHAPE (10,10) : rows,columns of the matrices written
+    PYLUMERICAL_FAKE_MEMORY (0) : MB held while simulating, scaled by COST
+    PYLUMERICAL_FAKE_OOM (0) : probability a simulation is killed as by the OOM killer
+    PYLUMERICAL_FAKE_FLEXNET (0) : probability a launch finds no free licence
+    PYLUMERICAL_FAKE_LAYOUT (None) : most cores a simulation can be split over
+    PYLUMERICAL_FAKE_ERROR (None) : an 'Error: ' is reported for any fsp file
+        or output whose path contains this text
+
+This module only uses the standard library and is run as a script, so it
+doesn't import the rest of the package.
+'''
+
+from __future__ import division, print_function
+import json
+import os
+import random
+import re
+import signal
+import stat
+import struct
+import sys
+import time
+
+FLEXNET = "Unable to check out a FlexNet license"
+NOLAYOUT = "There is no possible parallel processor layout"
+
+COMMANDS = {'fdtd-solutions': 'solutions', 'fdtd-run-local.sh': 'run-local',
+            'fdtd-engine': 'engine'}
+
+STATEMENT = re.compile(r'''((?:[^;"']|"[^"]*"|'[^']*')*);''')
+ASSIGNMENT = re.compile(r'^\s*([A-Za-z_]\w*)\s*=(?!=)\s*(.*)$', re.S)
+CALL = re.compile(r'^\s*(\w+)\s*\((.*)\)\s*$', re.S)
+PRINT = re.compile(r'^\s*\?\s*(.*)$', re.S)
+
+
+def setting(name, default=None):
+    return os.environ.get('PYLUMERICAL_FAKE_' + name, default)
+
+
+def install(bindir, python=None):
+    '''
+    Writes the fake fdtd-solutions and fdtd-run-local.sh into _bindir_,
+    returning _bindir_
+    '''
+    if not os.path.isdir(bindir):
+        os.makedirs(bindir)
+
+    for command, mode in COMMANDS.items():
+        path = os.path.join(bindir, command)
+        with open(path, 'w') as wrapper:
+            wrapper.write('#!/bin/sh\nexec "{0}" "{1}" {2} "$@"\n'.format(
+                python or sys.executable, os.path.abspath(__file__).replace('.pyc', '.py'),
+                mode))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    return bindir
+
+
+def _uncomment(text):
+    '''
+    Removes # comments outside string literals
+    '''
+    lines = []
+    for aline in text.splitlines():
+        quote = None
+        for i, character in enumerate(aline):
+            if quote:
+                quote = None if character == quote else quote
+            elif character in '"\'':
+                quote = character
+            elif character == '#':
+                aline = aline[:i]
+                break
+        lines.append(aline)
+    return "\n".join(lines)
+
+
+def _split(expression, separator):
+    '''
+    Splits _expression_ at _separator_ outside string literals and brackets
+    '''
+    parts, depth, quote, start = [], 0, None, 0
+    for i, character in enumerate(expression):
+        if quote:
+            quote = None if character == quote else quote
+        elif character in '"\'':
+            quote = character
+        elif character in '([':
+            depth += 1
+        elif character in ')]':
+            depth -= 1
+        elif character == separator and depth == 0:
+            parts.append(expression[start:i])
+            start = i + 1
+    parts.append(expression[start:])
+    return [part.strip() for part in parts]
+
+
+def _evaluate(expression, variables):
+    '''
+    Value of a string literal, number, variable or concatenation of them,
+    or None for anything else
+    '''
+    terms = _split(expression, '+')
+    values = []
+    for term in terms:
+        if len(term) > 1 and term[0] == term[-1] and term[0] in '"\'':
+            values.append(term[1:-1])
+        elif term in variables:
+            values.append(variables[term])
+        elif CALL.match(term) and CALL.match(term).group(1) == 'replacestring':
+            arguments = [_evaluate(argument, variables)
+                         for argument in _split(CALL.match(term).group(2), ',')]
+            if not all(isinstance(argument, str) for argument in arguments):
+                return None
+            values.append(arguments[0].replace(arguments[1], arguments[2]))
+        else:
+            try:
+                values.append(float(term))
+            except ValueError:
+                return None
+
+    if len(values) == 1:
+        return values[0]
+    if all(isinstance(value, str) for value in values):
+        return "".join(values)
+    return None
+
+
+def _values(path):
+    rows, columns = [int(n) for n in setting('CSV_SHAPE', '10,10').split(',')]
+    generator = random.Random(path.replace('.mat', '.csv'))  # the same values either way
+    return [[float("{0:.12g}".format(generator.random())) for column in range(columns)]
+            for row in range(rows)]
+
+
+def _matrix(path):
+    return "\n".join(" ".join("{0:.12g}".format(value) for value in row)
+                     for row in _values(path)) + "\n"
+
+
+def _element(mtype, data):
+    '''
+    MAT-file data element padded to 8 bytes
+    '''
+    return struct.pack('<II', mtype, len(data)) + data + b'\0' * (-len(data) % 8)
+
+
+def _matfile(path, name):
+    '''
+    Level 5 .mat file holding the matrix of _path_ as double array _name_
+    '''
+    rows = _values(path)
+    shape = (len(rows), len(rows[0]) if rows else 0)
+    columns = [row[j] for j in range(shape[1]) for row in rows]  # column major
+    matrix = (_element(6, struct.pack('<II', 6, 0)) +  # mxDOUBLE_CLASS
+              _element(5, struct.pack('<ii', *shape)) +
+              _element(1, name.encode('ascii')) +
+              _element(9, struct.pack('<{0}d'.format(len(columns)), *columns)))
+    header = b'MATLAB 5.0 MAT-file, written by the pylumerical fake engine'
+    return (header.ljust(116, b' ') + b'\0' * 8 + struct.pack('<H', 0x0100) + b'IM' +
+            _element(14, matrix))
+
+
+def _failed(path):
+    error = setting('ERROR')
+    return bool(error) and error in path
+
+
+def _cost(fsp):
+    '''
+    Value of the COST variable saved within _fsp_ (default 1)
+    '''
+    if setting('COST') is None:
+        return 1
+    try:
+        with open(fsp, 'rb') as fspfile:
+            variables = json.loads(fspfile.readline().decode('utf-8'))
+        return float(variables.get(setting('COST'), 1))
+    except (IOError, OSError, ValueError, TypeError):
+        return 1
+
+
+def _flexnet():
+    return random.random() < float(setting('FLEXNET', 0))
+
+
+def solutions(args):
+    '''
+    fdtd-solutions [fsp] -run script.lsf [-nw]
+    '''
+    time.sleep(float(setting('LATENCY', 0)))
+    if _flexnet():
+        print(FLEXNET)
+        return 0
+
+    script = args[args.index('-run') + 1]
+    with open(script, 'r') as lsf:
+        text = _uncomment(lsf.read())
+
+    variables = {}
+    cwd = os.getcwd()
+    fspbytes = int(setting('FSP_BYTES', 1024))
+    for match in STATEMENT.finditer(text):
+        statement = re.split(r'[{}]', match.group(1))[-1].strip()  # within if/for blocks
+
+        printed = PRINT.match(statement)
+        if printed:
+            value = _evaluate(printed.group(1), variables)
+            if value is not None:
+                print(value)
+            continue
+
+        assignment = ASSIGNMENT.match(statement)
+        if assignment:
+            value = _evaluate(assignment.group(2), variables)
+            if value is not None:
+                variables[assignment.group(1)] = value
+            continue
+
+        call = CALL.match(statement)
+        if not call:
+            continue
+        name, arguments = call.group(1), [_evaluate(argument, variables) for argument in
+                                          _split(call.group(2), ',')]
+        if name == 'exit':
+            break
+        elif name == 'cd' and arguments[0] is not None:
+            cwd = arguments[0]
+        elif name in ('save', 'load') and arguments[0] is not None:
+            fsp = os.path.join(cwd, arguments[0])
+            fsp += '' if fsp.endswith('.fsp') else '.fsp'
+            if _failed(fsp):
+                print("Error: fake failure of", fsp)
+                return 0
+            if name == 'save':
+                header = (json.dumps(variables) + "\n").encode('utf-8')
+                with open(fsp, 'wb') as fspfile:
+                    fspfile.write(header + b'\0' * max(0, fspbytes - len(header)))
+        elif name == 'write' and len(arguments) > 1 and isinstance(arguments[0], str):
+            if _failed(arguments[0]):
+                print("Error: fake failure writing", arguments[0])
+                return 0
+            with open(arguments[0], 'w') as csvfile:
+                csvfile.write(_matrix(arguments[0]))
+        elif name == 'matlabsave' and len(arguments) > 1 and isinstance(arguments[0], str):
+            matfile = arguments[0] if arguments[0].endswith('.mat') else arguments[0] + '.mat'
+            if _failed(matfile):
+                print("Error: fake failure writing", matfile)
+                return 0
+            with open(matfile, 'wb') as binaryfile:
+                binaryfile.write(_matfile(matfile, _split(call.group(2), ',')[1]))
+
+    return 0
+
+
+def runlocal(args):
+    '''
+    fdtd-run-local.sh -n <cores> file.fsp ...
+    '''
+    cores = int(args[args.index('-n') + 1])
+    fspfiles = [arg for arg in args if arg.endswith('.fsp')]
+
+    time.sleep(float(setting('LATENCY', 0)))
+    if _flexnet():
+        print(FLEXNET)
+        return 0
+    if setting('LAYOUT') is not None and cores > int(setting('LAYOUT')):
+        print(NOLAYOUT)
+        return 0
+
+    for fsp in fspfiles:
+        if _failed(fsp):
+            print("Error: fake failure of", fsp)
+            return 0
+        if not os.path.exists(fsp):
+            print("Error: cannot open", fsp)
+            return 0
+        held = b'\1' * int(float(setting('MEMORY', 0)) * _cost(fsp) * 2 ** 20)
+        time.sleep(float(setting('RUNTIME', 0)) * _cost(fsp) / cores)
+        if random.random() < float(setting('OOM', 0)):
+            os.kill(os.getpid(), signal.SIGKILL)
+        del held
+        for percent in (50, 100):
+            print("{0}% complete. Max time remaining: 0 sec. Auto Shutoff: {1:g}".format(
+                percent, 10 ** (-percent / 10)))
+            sys.stdout.flush()
+        os.utime(fsp, None)
+
+    return 0
+
+
+def engine(args):
+    '''
+    fdtd-engine -mr file.fsp (otherwise as fdtd-run-local.sh on one core)
+    '''
+    if '-mr' not in args:
+        return runlocal(['-n', '1'] + args)
+
+    for fsp in [arg for arg in args if arg.endswith('.fsp')]:
+        cost = _cost(fsp)
+        print("Memory requirements: {0:.1f} MB".format(100 * cost))
+        print("Number of grid points: {0:.0f}".format(1e6 * cost))
+    return 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == 'install':
+        print(install(sys.argv[2]))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'solutions':
+        sys.exit(solutions(sys.argv[2:]))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'run-local':
+        sys.exit(runlocal(sys.argv[2:]))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'engine':
+        sys.exit(engine(sys.argv[2:]))
+    else:
+        sys.exit("usage : fakeengine.py install <bindir> | solutions ... | run-local ... | engine ...")
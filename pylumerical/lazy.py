@@ -0,0 +1,35 @@
+'''
+Lazily imported modules
+
+Description : numpy and pandas take far longer to import than the rest of
+pylumerical together, and most processes importing it (job wrappers and the
+generation and engine stages of a sweep) never read an output. A LazyModule
+stands in for a module and only imports it the first time one of its
+attributes is used, so _import pylumerical_ needs nothing beyond the
+standard library.
+'''
+
+from __future__ import division, print_function
+import importlib
+
+
+class LazyModule(object):
+    '''
+    Module _name_, imported on first use
+    '''
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return "<lazy module '{0}' ({1})>".format(self._name, state)
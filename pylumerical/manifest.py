@@ -0,0 +1,262 @@
+'''
+Sweep manifest
+
+Description : Each parameter sweep keeps an SQLite index (manifest.db within
+<workingdir>/<keyword>) which maps a short run ID to its typed parameter
+values, file names and status. Runs can be found and filtered through the
+index without listing directories or parsing parameter encoded filenames.
+
+Each run also records the sha1 hash of the variables block its parameters
+render to, so a point which would build the same simulation as an earlier
+run is recorded as an alias of that run instead of being simulated again.
+An alias takes the status of its run and shares its outputs.
+'''
+
+from __future__ import division, print_function
+import json
+import numbers
+import os
+import sqlite3
+import time
+from .template import _sha1, renderdigest
+
+MANIFEST = 'manifest.db'
+
+OPERATORS = ('=', '!=', '<', '<=', '>', '>=')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    name TEXT UNIQUE,
+    status TEXT,
+    updated REAL,
+    digest TEXT,
+    alias_of TEXT
+);
+CREATE TABLE IF NOT EXISTS parameters (
+    run_id TEXT,
+    key TEXT,
+    value TEXT,
+    number REAL,
+    swept INTEGER,
+    PRIMARY KEY (run_id, key)
+);
+CREATE INDEX IF NOT EXISTS parameters_key ON parameters (key, number);
+CREATE INDEX IF NOT EXISTS runs_digest ON runs (digest);
+CREATE INDEX IF NOT EXISTS runs_alias_of ON runs (alias_of);
+CREATE INDEX IF NOT EXISTS runs_updated ON runs (updated);
+'''
+
+
+def _plain(value):
+    '''
+    Python value of _value_ which json and sqlite understand (numpy included)
+    '''
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Real):
+        return float(value)
+    return str(value)
+
+
+def runid(parameters):
+    '''
+    Short ID of a parameter set, the same whichever sweep it appears in
+    '''
+    plain = sorted((key, _plain(value)) for key, value in parameters.items())
+    return _sha1(json.dumps(plain))[:10]
+
+
+def findmanifest(location):
+    '''
+    Returns the SweepManifest of the sweep owning directory _location_ (its
+    input, fsp or output folder, or the sweep folder itself), or None
+    '''
+    location = os.path.normpath(location)
+    for sweeploc in (location, os.path.dirname(location)):
+        if os.path.exists(os.path.join(sweeploc, MANIFEST)):
+            return SweepManifest(sweeploc)
+
+
+class SweepManifest(object):
+    '''
+    SQLite index of every run within sweep directory _sweeploc_
+    '''
+    PENDING = 'pending'
+    GENERATED = 'generated'
+    SIMULATED = 'simulated'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+
+    def __init__(self, sweeploc):
+        self.sweeploc = sweeploc
+        self.path = os.path.join(sweeploc, MANIFEST)
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        # a connection per call so worker threads can update statuses
+        return _Connection(self.path)
+
+    def add(self, runs, swept=()):
+        '''
+        Records _runs_, a list of (run_id, name, parameters), as pending
+        '''
+        now = time.time()
+        with self._connect() as connection:
+            _addparameters(connection, runs, swept)
+            connection.executemany(
+                'INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, NULL)',
+                [(run_id, name, self.PENDING, now, renderdigest(parameters))
+                 for run_id, name, parameters in runs])
+
+    def alias(self, aliases, swept=()):
+        '''
+        Records _aliases_, a list of (name, parameters, run name), as points
+        simulated by the run called run name. Each is given the ID of its own
+        parameters and name (see _aliasid_) and the status of its run
+        '''
+        now = time.time()
+        with self._connect() as connection:
+            _addparameters(connection, [(aliasid(name, parameters), name, parameters)
+                                        for name, parameters, target in aliases], swept)
+            connection.executemany(
+                'INSERT OR REPLACE INTO runs SELECT ?, ?, status, ?, digest, name'
+                ' FROM runs WHERE name = ?',
+                [(aliasid(name, parameters), name, now, target)
+                 for name, parameters, target in aliases])
+
+    def find(self, digests, pending=False):
+        '''
+        Returns {digest : name} of the runs (not aliases) whose parameters
+        render to the variables blocks hashed in _digests_ (see _renderdigest_).
+        Failed runs aren't returned, nor pending ones (which nothing may go
+        on to simulate) unless _pending_
+        '''
+        excluded = [self.FAILED] if pending else [self.FAILED, self.PENDING]
+        digests = list(digests)
+        found = {}
+        with self._connect() as connection:
+            for first in range(0, len(digests), 500):  # sqlite's limit on arguments
+                chunk = digests[first:first + 500]
+                found.update(connection.execute(
+                    'SELECT digest, name FROM runs WHERE alias_of IS NULL AND status NOT IN'
+                    ' ({0}) AND digest IN ({1})'.format(', '.join('?' * len(excluded)),
+                                                        ', '.join('?' * len(chunk))),
+                    excluded + chunk).fetchall())
+        return found
+
+    def setstatus(self, names, status):
+        '''
+        Sets the status of the runs called _names_ (fsp name without .fsp)
+        and of their aliases
+        '''
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                'UPDATE runs SET status = ?, updated = ? WHERE name = ? OR alias_of = ?',
+                [(status, now, name, name) for name in names])
+
+    def counts(self):
+        '''
+        Returns {status : number of runs} (aliases aside)
+        '''
+        with self._connect() as connection:
+            return dict(connection.execute(
+                'SELECT status, COUNT(*) FROM runs WHERE alias_of IS NULL GROUP BY status'))
+
+    def runs(self, status=None, swept_only=False, aliases=False, since=None, **conditions):
+        '''
+        Returns a list of {'run_id', 'name', 'status', 'parameters',
+        'alias_of', 'updated'} for the runs matching every condition. A
+        condition is either a value or an (operator, value) pair e.g.
+        MarginXY=('<', 150e-9)
+
+        Optional Parameters
+        -------------------
+        status (None) : only runs with this status
+        swept_only (False) : parameters only holds the swept parameters
+        aliases (False) : include the points simulated by another run, whose
+            alias_of names that run
+        since (None) : only runs whose status changed at or after this time
+        '''
+        query = 'SELECT run_id, name, status, alias_of, updated FROM runs WHERE 1'
+        arguments = []
+        if status is not None:
+            query += ' AND status = ?'
+            arguments.append(status)
+        if since is not None:
+            query += ' AND updated >= ?'
+            arguments.append(since)
+        if not aliases:
+            query += ' AND alias_of IS NULL'
+
+        for key, condition in conditions.items():
+            operator, value = condition if isinstance(condition, tuple) else ('=', condition)
+            if operator not in OPERATORS:
+                raise ValueError("Unknown operator " + operator)
+            value = _plain(value)
+            column = 'number' if isinstance(value, (int, float)) else 'value'
+            query += (' AND run_id IN (SELECT run_id FROM parameters'
+                      ' WHERE key = ? AND {0} {1} ?)'.format(column, operator))
+            arguments += [key, value if column == 'number' else json.dumps(value)]
+
+        with self._connect() as connection:
+            rows = connection.execute(query + ' ORDER BY name', arguments).fetchall()
+            parameters = {}
+            for run_id, key, value, swept in connection.execute(
+                    'SELECT run_id, key, value, swept FROM parameters'
+                    ' WHERE run_id IN (SELECT run_id FROM ({0}))'.format(query), arguments):
+                if swept or not swept_only:
+                    parameters.setdefault(run_id, {})[key] = json.loads(value)
+
+        return [{'run_id': run_id, 'name': name, 'status': status,
+                 'parameters': parameters.get(run_id, {}), 'alias_of': alias_of,
+                 'updated': updated}
+                for run_id, name, status, alias_of, updated in rows]
+
+
+def aliasid(name, parameters):
+    '''
+    ID of the alias called _name_ of _parameters_, distinct from the run ID
+    of the run simulated in its place
+    '''
+    return runid(dict(parameters, **{'alias name': name}))
+
+
+def _addparameters(connection, runs, swept):
+    '''
+    Records the parameters of _runs_, deleting those of the runs they
+    replace (the same run ID or name), so is called before the runs are
+    '''
+    connection.executemany('DELETE FROM parameters WHERE run_id IN'
+                           ' (SELECT run_id FROM runs WHERE name = ?)',
+                           [(name,) for run_id, name, parameters in runs])
+    connection.executemany('DELETE FROM parameters WHERE run_id = ?',
+                           [(run_id,) for run_id, name, parameters in runs])
+    connection.executemany(
+        'INSERT OR REPLACE INTO parameters VALUES (?, ?, ?, ?, ?)',
+        [(run_id, key, json.dumps(_plain(value)),
+          _plain(value) if isinstance(_plain(value), (int, float)) else None,
+          key in swept)
+         for run_id, name, parameters in runs
+         for key, value in parameters.items()])
+
+
+class _Connection(object):
+    '''
+    sqlite3 connection which commits and closes on leaving a with block
+    '''
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, timeout=60)
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.connection.commit()
+        self.connection.close()
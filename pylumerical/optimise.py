@@ -0,0 +1,133 @@
+'''
+Batch optimisation of sweep parameters
+
+Description : Candidates are proposed a population at a time by a covariance
+matrix adaptation evolution strategy (CMA-ES) so that every candidate of a
+population can be generated, simulated and processed at once (see
+_OptimiseParameters_). The strategy works within the unit box, each
+parameter being mapped onto its range or choices as by the samplers of
+_sweep_.
+'''
+
+from __future__ import division, print_function
+import numpy as np
+from .sweep import _axis, _isnumber, _significant
+
+
+class CMAES(object):
+    '''
+    Covariance matrix adaptation evolution strategy minimising a metric over
+    the unit box of _dimensions_ parameters
+
+    Optional Parameters
+    -------------------
+    population (None) : candidates proposed by each _ask_ (default 4 + 3 ln dimensions)
+    mean (None) : starting point (default the centre of the box)
+    sigma (0.3) : starting step size
+    seed (None) : random seed
+    '''
+
+    def __init__(self, dimensions, population=None, mean=None, sigma=0.3, seed=None):
+        n = self.dimensions = dimensions
+        self.population = population or 4 + int(3 * np.log(n))
+        self.parents = max(1, self.population // 2)
+
+        weights = np.log(self.parents + 0.5) - np.log(np.arange(1, self.parents + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1 / np.sum(self.weights ** 2)
+
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1,
+                       2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+        self.damps = 1 + 2 * max(0, np.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chin = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+        self.mean = np.full(n, 0.5) if mean is None else np.array(mean, dtype=float)
+        self.sigma = sigma
+        self.C = np.eye(n)
+        self.B = np.eye(n)
+        self.D = np.ones(n)
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self.generation = 0
+        self.random = np.random.RandomState(seed)
+
+    def ask(self):
+        '''
+        Returns a population of candidates (rows) within the unit box
+        '''
+        z = self.random.standard_normal((self.population, self.dimensions))
+        return np.clip(self.mean + self.sigma * (z * self.D).dot(self.B.T), 0, 1)
+
+    def tell(self, candidates, values):
+        '''
+        Updates the search distribution from the metric _values_ of _candidates_
+        '''
+        n = self.dimensions
+        values = np.where(np.isfinite(values), values, np.inf)
+        best = np.asarray(candidates)[np.argsort(values, kind='mergesort')[:self.parents]]
+
+        old = self.mean
+        self.mean = self.weights.dot(best)
+        y = (self.mean - old) / self.sigma
+        self.generation += 1
+
+        invsqrtC = self.B.dot(np.diag(1 / self.D)).dot(self.B.T)
+        self.ps = (1 - self.cs) * self.ps + \
+            np.sqrt(self.cs * (2 - self.cs) * self.mueff) * invsqrtC.dot(y)
+        hsig = (np.linalg.norm(self.ps) / np.sqrt(1 - (1 - self.cs) ** (2 * self.generation))
+                / self.chin) < 1.4 + 2 / (n + 1)
+        self.pc = (1 - self.cc) * self.pc + \
+            hsig * np.sqrt(self.cc * (2 - self.cc) * self.mueff) * y
+
+        steps = (best - old) / self.sigma
+        self.C = ((1 - self.c1 - self.cmu) * self.C +
+                  self.c1 * (np.outer(self.pc, self.pc) +
+                             (1 - hsig) * self.cc * (2 - self.cc) * self.C) +
+                  self.cmu * (steps.T * self.weights).dot(steps))
+        self.sigma *= np.exp((self.cs / self.damps) * (np.linalg.norm(self.ps) / self.chin - 1))
+
+        self.C = np.triu(self.C) + np.triu(self.C, 1).T
+        eigenvalues, self.B = np.linalg.eigh(self.C)
+        self.D = np.sqrt(np.maximum(eigenvalues, 1e-20))
+
+    def spread(self):
+        '''
+        Largest standard deviation of the search distribution
+        '''
+        return self.sigma * self.D.max()
+
+
+def candidatepoint(newparams, candidate, precision=6):
+    '''
+    Returns the dict of swept parameters of unit box _candidate_, continuous
+    parameters rounded to _precision_ significant figures so that nearby
+    candidates fall on points already evaluated
+    '''
+    point = {}
+    for (name, values), u in zip(newparams, candidate):
+        value = _axis(values)(float(u))
+        if isinstance(value, float):
+            value = _significant(value, precision)
+        elif _isnumber(value):
+            value = value.item() if hasattr(value, 'item') else value
+        point[name] = value
+    return point
+
+
+def unitposition(newparams, point):
+    '''
+    Returns the position of _point_, a dict of swept parameters, within the
+    unit box (the inverse of _candidatepoint_)
+    '''
+    position = []
+    for name, values in newparams:
+        if isinstance(values, tuple) and len(values) == 2 and all(_isnumber(v) for v in values):
+            low, high = values
+            position.append((point[name] - low) / (high - low))
+        else:
+            values = list(values)
+            position.append((values.index(point[name]) + 0.5) / len(values))
+    return position
@@ -0,0 +1,129 @@
+'''
+Pipelined stages
+
+Description : Rather than generating every sweep point, then simulating every
+fsp file, then processing them all, a pipeline hands each job on to the next
+stage as soon as it finishes. Every stage runs on its own RetryQueue with its
+own workers, retry policy and licences, so the engine starts on the first
+file generated and processing follows the simulations instead of waiting for
+the slowest of them (see _RunSweep_).
+'''
+
+from __future__ import division, print_function
+import threading
+try:
+    from queue import Queue
+except ImportError:  # python2
+    from Queue import Queue
+from .retry import RetryQueue
+from .tracing import span
+
+_END = object()  # passed down a queue once the stage above has finished
+
+
+class Stage(object):
+    '''
+    A stage of a pipeline. _work_(job, **overrides) returns the list of jobs
+    handed on to the next stage, empty when a job goes no further
+
+    Optional Parameters
+    -------------------
+    workers (1) : jobs run at once
+    policy (None) : RetryPolicy of the stage's launches
+    licences (None) : LicencePool held by each job, which may be shared with
+        other stages needing the same licence type
+    '''
+
+    def __init__(self, name, work, workers=1, policy=None, licences=None):
+        self.name = name
+        self.work = work
+        self.workers = workers
+        self.policy = policy
+        self.licences = licences
+
+
+def _drain(queue):
+    while True:
+        job = queue.get()
+        if job is _END:
+            return
+        yield job
+
+
+def RunPipeline(stages, jobs, verbose=0, throttle=None):
+    '''
+    Passes every job of _jobs_ through _stages_ in turn. Each stage runs in
+    its own thread, picking up jobs as the stage above hands them on, and
+    _jobs_ is read lazily by the first stage
+
+    _throttle_(busy) is called before each job is read from _jobs_ and may
+    block to hold back new work, _busy_() being True while any job read
+    earlier is still within the pipeline (see _StoragePolicy.wait_)
+
+    An error raised by a stage (its job source, _throttle_ or handing jobs
+    on) stops reading _jobs_ and is raised once every stage has finished
+
+    Returns {stage name : [(job, error)]} of the jobs which failed in each stage
+    '''
+    failures = dict((stage.name, []) for stage in stages)
+    queues = [Queue() for stage in stages[1:]]
+    errors = []
+    lock = threading.Lock()
+    inflight = [0]  # jobs handed on and not yet finished by the last stage
+
+    def source():
+        jobsource = iter(jobs)
+        while not errors:
+            if throttle is not None:  # nothing frees space once a stage has stopped
+                throttle(lambda: inflight[0] > 0 and not errors)
+            try:
+                job = next(jobsource)
+            except StopIteration:
+                return
+            with lock:
+                inflight[0] += 1
+            yield job
+
+    sources = [source()] + [_drain(queue) for queue in queues]
+
+    def runstage(n):
+        stage = stages[n]
+        downstream = queues[n] if n < len(queues) else None
+
+        def done(job, result, err):
+            handedon = result if err is None and downstream is not None else []
+            with lock:
+                if err is not None:
+                    failures[stage.name].append((job, err))
+                inflight[0] += len(handedon) - 1
+            for nextjob in handedon:
+                downstream.put(nextjob)
+
+        try:
+            with span(stage.name + ' stage', 'pipeline'):
+                RetryQueue(stage.workers, policy=stage.policy, licences=stage.licences,
+                           verbose=verbose).run(stage.work, sources[n], done)
+        except Exception as err:
+            with lock:
+                errors.append(err)
+        finally:
+            if downstream is not None:
+                downstream.put(_END)
+
+    threads = [threading.Thread(target=runstage, args=(n,), name=stage.name)
+               for n, stage in enumerate(stages)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    if verbose > 0:
+        for stage in stages:
+            if failures[stage.name]:
+                print(len(failures[stage.name]), "jobs failed in stage", stage.name)
+
+    return failures
@@ -9,9 +9,26 @@ and plotting data generated by Lumerical
 '''
 
 from __future__ import division,print_function
+import json
 import re
 import os
-from pandas import Series
+import struct
+import time
+import zlib
+from .lazy import LazyModule
+from .template import estimateType
+from .manifest import SweepManifest, findmanifest
+from .tracing import traced
+
+np = LazyModule('numpy')  # numpy and pandas are imported when outputs are first read
+pd = LazyModule('pandas')
+
+CACHE = '.sweepdata.npz'  # binary copy of every output within an output directory
+
+MIMATRIX, MICOMPRESSED = 14, 15
+MITYPES = {1: 'i1', 2: 'u1', 3: 'i2', 4: 'u2', 5: 'i4', 6: 'u4', 7: 'f4', 9: 'f8',
+           12: 'i8', 13: 'u8'}  # MAT-file data types
+
 
 def parsefilename(fn, verbose=0):
     '''
@@ -32,3 +49,572 @@ def fetchparsednames(location, verbose=0):
     '''
     return [dict(parsefilename(fn).items(), fileloc=os.path.join(location,fn))
                 for fn in os.listdir(location)]
+
+
+def parseoutputname(fn):
+    '''
+    Splits an output filename into (sweep point name, quantity) so that
+    'MarginXY=1,5e-07.fsp_farfield_Er.csv' gives ('MarginXY=1,5e-07', 'farfield_Er')
+    '''
+    variables, quantity = fn.split('.fsp', 1)
+    return variables, os.path.splitext(quantity)[0].lstrip('_')
+
+
+def typedparameters(name):
+    '''
+    Returns the typed parameters of sweep point _name_ (see _parsefilename_)
+    '''
+    return {key: estimateType(value.replace(',', '.'))
+            for key, value in parsefilename(name).items()}
+
+
+def readnum2str(fn):
+    '''
+    Reads a matrix written by Lumerical's write(outfile, num2str(...)) into
+    a 2D numpy array with a single vectorised parse
+    '''
+    with open(fn, 'r') as csvfile:
+        text = csvfile.read()
+
+    rows = [aline for aline in text.splitlines() if aline.strip()]
+    if not rows:
+        return np.empty((0, 0))
+
+    data = np.fromstring(text, sep=' ')
+    ncols = len(rows[0].split())
+    if data.size != len(rows) * ncols:
+        raise ValueError("Cannot parse " + fn + " as a num2str matrix")
+
+    return data.reshape(len(rows), ncols)
+
+
+def _mattag(buf, offset, endian):
+    '''
+    Returns (data type, bytes, offset of the data, offset of the next element)
+    of the MAT-file data element at _offset_
+    '''
+    mtype, nbytes = struct.unpack_from(endian + 'II', buf, offset)
+    if mtype >> 16:  # small data element packed into the tag
+        return mtype & 0xffff, mtype >> 16, offset + 4, offset + 8
+    return mtype, nbytes, offset + 8, offset + 8 + nbytes + (-nbytes % 8)
+
+
+def _matmatrix(buf, offset, end, endian, name=None):
+    '''
+    Returns the numeric matrix stored in the miMATRIX element whose data
+    spans _offset_ to _end_ of _buf_, or None if it isn't named _name_. The
+    array is a view of _buf_ unless it is complex
+    '''
+    elements = []
+    while offset < end:
+        mtype, nbytes, start, offset = _mattag(buf, offset, endian)
+        elements.append((mtype, nbytes, start))
+
+    (flagstype, flagsbytes, flagsat), (dimstype, dimsbytes, dimsat), \
+        (nametype, namebytes, nameat) = elements[:3]
+    flags = struct.unpack_from(endian + 'I', buf, flagsat)[0]
+    shape = struct.unpack_from(endian + '{0}i'.format(dimsbytes // 4), buf, dimsat)
+    if name is not None and buf[nameat:nameat + namebytes].tobytes().decode('ascii') != name:
+        return None
+
+    parts = [np.ndarray(shape, dtype=np.dtype(MITYPES[mtype]).newbyteorder(endian),
+                        buffer=buf, offset=start, order='F')
+             for mtype, nbytes, start in elements[3:5]]
+    return parts[0] + 1j * parts[1] if flags & 0x0800 else parts[0]
+
+
+def readmat(fn, name=None):
+    '''
+    Reads the first matrix (or the matrix _name_) from the MATLAB level 5
+    .mat file _fn_, as written by Lumerical's matlabsave
+
+    The array is memory mapped from the file rather than read, so only the
+    parts used are loaded. Compressed and complex matrices are read into memory
+    '''
+    buf = np.memmap(fn, dtype=np.uint8, mode='r')
+    header = buf[:128].tobytes()
+    if header.startswith(b'MATLAB 7.3'):
+        raise ValueError(fn + " is an HDF5 (v7.3) mat file")
+    endian = '<' if header[126:128] == b'IM' else '>'
+
+    offset = 128
+    while offset + 8 <= len(buf):
+        mtype, nbytes, start, offset = _mattag(buf, offset, endian)
+        if mtype == MICOMPRESSED:
+            offset = start + nbytes  # compressed elements aren't padded
+            inner = np.frombuffer(zlib.decompress(buf[start:start + nbytes].tobytes()),
+                                  dtype=np.uint8)
+            mtype, nbytes, start, end = _mattag(inner, 0, endian)
+            matrix = _matmatrix(inner, start, start + nbytes, endian, name)
+        elif mtype == MIMATRIX:
+            matrix = _matmatrix(buf, start, start + nbytes, endian, name)
+        else:
+            continue
+        if matrix is not None:
+            return matrix
+
+    raise ValueError("No matrix {0}found in {1}".format(
+        "" if name is None else name + " ", fn))
+
+
+def readoutput(fn):
+    '''
+    Reads an output file, a num2str .csv or a .mat (see _readnum2str_ and _readmat_)
+    '''
+    return readmat(fn) if fn.endswith('.mat') else readnum2str(fn)
+
+
+def _readoutputs(fns, max_workers=8):
+    '''
+    Reads every output file of _fns_ (see _readoutput_), _max_workers_ at once
+    '''
+    from multiprocessing.pool import ThreadPool  # slow to import, only needed here
+
+    pool = ThreadPool(max(1, max_workers))
+    try:
+        return pool.map(readoutput, fns)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class SweepData(object):
+    '''
+    Every output of a parameter sweep held in memory
+
+    names : sweep point names (the .fsp filename without extension)
+    parameters : DataFrame of typed parameters with a row per sweep point
+    quantities : {quantity : array} with the sweep point as the first axis
+                 (an object array when shapes differ between points)
+    '''
+
+    def __init__(self, names, parameters, quantities):
+        self.names = list(names)
+        self.parameters = parameters
+        self.quantities = quantities
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, quantity):
+        return self.quantities[quantity]
+
+    def select(self, **conditions):
+        '''
+        Returns the SweepData of the points whose parameters equal _conditions_
+        '''
+        mask = np.ones(len(self), dtype=bool)
+        for key, value in conditions.items():
+            mask &= (self.parameters[key] == value).values
+
+        return self.take(np.flatnonzero(mask))
+
+    def take(self, index):
+        '''
+        Returns the SweepData of the points at positions _index_
+        '''
+        return SweepData([self.names[i] for i in index],
+                         self.parameters.iloc[index].reset_index(drop=True),
+                         {quantity: data[index] for quantity, data in self.quantities.items()})
+
+    def frame(self):
+        '''
+        DataFrame indexed by the sweep parameters with a column per quantity
+        '''
+        index = pd.MultiIndex.from_frame(self.parameters) if len(self.parameters.columns) > 1 \
+            else self.parameters.set_index(list(self.parameters.columns)).index
+        return pd.DataFrame({quantity: list(data) for quantity, data in self.quantities.items()},
+                         index=index)
+
+    def save(self, fn, **extra):
+        '''
+        Writes everything to the npz file _fn_ (so later loads are one read)
+        '''
+        arrays = {'names': np.array(self.names)}
+        for column in self.parameters.columns:
+            arrays['parameter:' + column] = self.parameters[column].values
+        for quantity, data in self.quantities.items():
+            arrays['quantity:' + quantity] = data
+        arrays.update(extra)
+
+        with open(fn, 'wb') as npzfile:
+            np.savez(npzfile, **arrays)
+
+    @classmethod
+    def load(cls, fn):
+        '''
+        Reads a SweepData written by _save_, returning it and any extra arrays
+        '''
+        with np.load(fn, allow_pickle=True) as npzfile:
+            arrays = dict((key, npzfile[key]) for key in npzfile.files)
+
+        names = [str(name) for name in arrays.pop('names')]
+        parameters = pd.DataFrame(dict((key.split(':', 1)[1], arrays.pop(key))
+                                    for key in list(arrays) if key.startswith('parameter:')))
+        quantities = dict((key.split(':', 1)[1], arrays.pop(key))
+                          for key in list(arrays) if key.startswith('quantity:'))
+        return cls(names, parameters, quantities), arrays
+
+
+def _stack(arrays):
+    '''
+    Stacks arrays along a new first axis, or into an object array when their
+    shapes differ
+    '''
+    if len(set(data.shape for data in arrays)) == 1:
+        return np.stack(arrays)
+    return _objects(arrays)
+
+
+def _objects(arrays):
+    '''
+    Object array holding _arrays_ without copying them
+    '''
+    stacked = np.empty(len(arrays), dtype=object)
+    for i, data in enumerate(arrays):
+        stacked[i] = data
+    return stacked
+
+
+def QueryRuns(location, status=None, **conditions):
+    '''
+    Returns a DataFrame (run_id, name, status, alias_of and swept
+    parameters) of the runs of the sweep owning _location_ which match
+    _conditions_ e.g.
+
+        QueryRuns(outputloc, status='processed', MarginXY=('<', 150e-9))
+
+    alias_of names the run simulated in place of a duplicate point (see
+    _SweepManifest.runs_)
+    '''
+    manifest = findmanifest(location)
+    if manifest is None:
+        raise ValueError("No sweep manifest found for " + location)
+
+    runs = manifest.runs(status=status, swept_only=True, aliases=True, **conditions)
+    keys = []
+    for run in runs:
+        keys += [key for key in run['parameters'] if key not in keys]
+
+    return pd.DataFrame([dict(run['parameters'], run_id=run['run_id'], name=run['name'],
+                              status=run['status'], alias_of=run['alias_of'])
+                         for run in runs],
+                        columns=keys + ['run_id', 'name', 'status', 'alias_of'])
+
+
+@traced(lambda outputloc, *args, **kwargs: os.path.dirname(os.path.normpath(outputloc)))
+def LoadSweep(outputloc, quantities=None, max_workers=8, cache=True, verbose=0, where=None,
+              mmap=False):
+    '''
+    Loads every num2str csv file and .mat file (see the binary option of
+    _ProcessGenerated_) in _outputloc_ into a SweepData
+
+    Parameters are taken from the sweep manifest when there is one, otherwise
+    they are parsed from the filenames. Points the manifest records as
+    aliases of a run (see _SweepManifest.alias_) are rows sharing its outputs
+
+    Optional Parameters
+    -------------------
+    quantities (None) : names of the quantities to load e.g. ['farfield_Er']
+                        (default : all)
+    max_workers (8) : number of files read at once
+    cache (True) : keep a binary copy in _outputloc_ which is read instead of
+                   the output files for as long as they are unchanged
+    where (None) : only load runs matching these manifest conditions
+                   e.g. {'MarginXY' : ('<', 150e-9)} (see _QueryRuns_)
+    mmap (False) : leave the matrices of .mat files memory mapped (see
+                   _readmat_), each quantity being an object array of them,
+                   so a large sweep can be sliced without reading it all.
+                   Nothing is cached
+    '''
+    manifest = findmanifest(outputloc)
+    aliases = {}  # alias : run simulated in its place
+    if manifest is not None:
+        aliases = dict((run['name'], run['alias_of']) for run in manifest.runs(aliases=True)
+                       if run['alias_of'] is not None)
+    wanted = None
+    if where is not None:
+        if manifest is None:
+            raise ValueError("No sweep manifest found for " + outputloc)
+        wanted = set(run['name'] for run in manifest.runs(aliases=True, **where))
+
+    outputfiles = sorted(fn for fn in os.listdir(outputloc)
+                      if fn.endswith(('.csv', '.mat')) and '.fsp' in fn and
+                      (quantities is None or parseoutputname(fn)[1] in quantities))
+    newest = max([os.path.getmtime(os.path.join(outputloc, fn)) for fn in outputfiles] or [0])
+
+    cache = cache and not mmap
+    cachefile = os.path.join(outputloc, CACHE)
+    if cache and os.path.exists(cachefile):
+        data, extra = SweepData.load(cachefile)
+        if list(extra['files']) == outputfiles and float(extra['mtime']) == newest and \
+                list(extra.get('aliases', [])) == sorted(aliases):
+            if verbose > 0:
+                print("Loaded", len(data), "sweep points from", cachefile)
+            if wanted is not None:
+                data = data.take([i for i, name in enumerate(data.names) if name in wanted])
+            return data
+
+    if wanted is not None:
+        simulated = wanted | set(aliases[name] for name in wanted if name in aliases)
+        outputfiles = [fn for fn in outputfiles if parseoutputname(fn)[0] in simulated]
+        cache = False  # the cache always holds the whole sweep
+
+    matrices = _readoutputs([os.path.join(outputloc, fn) for fn in outputfiles], max_workers)
+
+    outputs = {}  # quantity : {name : matrix}
+    for fn, matrix in zip(outputfiles, matrices):
+        name, quantity = parseoutputname(fn)
+        outputs.setdefault(quantity, {})[name] = matrix
+
+    names = sorted(set(name for byname in outputs.values() for name in byname))
+    for quantity, byname in outputs.items():
+        if len(byname) != len(names) and verbose > 0:
+            print(quantity, "is missing for", len(names) - len(byname), "sweep points")
+
+    names = sorted(set(names) | set(alias for alias, name in aliases.items() if name in names))
+    if wanted is not None:
+        names = [name for name in names if name in wanted]
+
+    known = {}
+    if manifest is not None:
+        known = dict((run['name'], run['parameters'])
+                     for run in manifest.runs(swept_only=True, aliases=True))
+    parameters = pd.DataFrame([known[name] if name in known else typedparameters(name)
+                            for name in names])
+    stack = _objects if mmap else _stack
+    data = SweepData(names, parameters,
+                     {quantity: stack([byname.get(aliases.get(name, name),
+                                                  np.full((0, 0), np.nan))
+                                       for name in names])
+                      for quantity, byname in outputs.items()})
+
+    if verbose > 0:
+        print("Loaded", len(outputfiles), "files for", len(names), "sweep points")
+
+    if cache:
+        data.save(cachefile, files=np.array(outputfiles), mtime=np.array(newest),
+                  aliases=np.array(sorted(aliases)))
+
+    return data
+
+
+AGGREGATE = '.sweepaggregate'  # dataset of a SweepAggregator within an output directory
+
+
+def _concatenate(datasets):
+    '''
+    Returns the SweepData of every sweep point of _datasets_ in turn
+    '''
+    datasets = [data for data in datasets if len(data)]
+    if not datasets:
+        return SweepData([], pd.DataFrame(), {})
+
+    quantities = {}
+    for quantity in sorted(set(quantity for data in datasets for quantity in data.quantities)):
+        quantities[quantity] = _stack([matrix for data in datasets for matrix in
+                                       (data.quantities[quantity] if quantity in data.quantities
+                                        else [np.full((0, 0), np.nan)] * len(data))])
+
+    return SweepData([name for data in datasets for name in data.names],
+                     pd.concat([data.parameters for data in datasets], ignore_index=True),
+                     quantities)
+
+
+class SweepAggregator(object):
+    '''
+    Dataset of a sweep's outputs which grows as the sweep runs
+
+    Each _update_ polls _outputloc_ for the points completed since the last
+    one and reads only their output files, saving them as a new segment of
+    the dataset kept in _outputloc_ (see AGGREGATE). Reopening the dataset
+    loads the segments rather than the output files, so following a large
+    sweep costs little more than reading what is new. With a sweep manifest a
+    point is complete once it is recorded as processed, found from the time
+    its status changed (the high-water mark). Without one it is complete once
+    its files have been left unchanged for _settle_ seconds.
+
+        aggregator = SweepAggregator(outputloc)
+        for data in aggregator.follow(interval=30):
+            plot(data.parameters['MarginXY'], data['farfield_Er'].max(axis=(1, 2)))
+
+    Optional Parameters
+    -------------------
+    quantities (None) : names of the quantities to load (default : all). A
+        dataset of other quantities is rebuilt
+    max_workers (8) : number of files read at once
+    settle (2) : seconds the files of a point must be left unchanged when
+        there is no manifest
+    compact (32) : number of segments at which they are merged into one
+    verbose (0) : verbosity control
+    '''
+    SLACK = 60  # seconds a status change may be committed after a later one
+
+    def __init__(self, outputloc, quantities=None, max_workers=8, settle=2, compact=32,
+                 verbose=0):
+        self.outputloc = outputloc
+        self.location = os.path.join(outputloc, AGGREGATE)
+        self.quantities = sorted(quantities) if quantities is not None else None
+        self.max_workers = max_workers
+        self.settle = settle
+        self.compact = compact
+        self.verbose = verbose
+        self.manifest = findmanifest(outputloc)
+
+        self.mark = None  # latest status change or file change ingested
+        self.segments = []
+        self.ingested = set()
+        self.datasets = []
+        self._data = None
+
+        state = os.path.join(self.location, 'state.json')
+        if os.path.exists(state):
+            with open(state, 'r') as statefile:
+                saved = json.load(statefile)
+            if saved['quantities'] == self.quantities:
+                self.mark = saved['mark']
+                self.segments = saved['segments']
+                self.ingested = set(saved['ingested'])
+                self.datasets = [SweepData.load(os.path.join(self.location, segment))[0]
+                                 for segment in self.segments]
+                if verbose > 0:
+                    print("Reopened", len(self.ingested), "sweep points from", self.location)
+
+    @property
+    def data(self):
+        '''
+        SweepData of every point ingested so far
+        '''
+        if self._data is None:
+            self._data = _concatenate(self.datasets)
+        return self._data
+
+    def __len__(self):
+        return len(self.ingested)
+
+    def _completed(self, outputfiles):
+        '''
+        Returns ({name : name whose files it shares}, {name : parameters},
+        high-water mark) of the points completed and not yet ingested
+        '''
+        names = set(parseoutputname(fn)[0] for fn in outputfiles)
+        if self.manifest is not None:
+            since = self.mark - self.SLACK if self.mark is not None else None
+            runs = [run for run in self.manifest.runs(status=SweepManifest.PROCESSED,
+                                                      swept_only=True, aliases=True,
+                                                      since=since)
+                    if run['name'] not in self.ingested and
+                    (run['alias_of'] or run['name']) in names]
+            completed = dict((run['name'], run['alias_of'] or run['name']) for run in runs)
+            parameters = dict((run['name'], run['parameters']) for run in runs)
+            mark = max([run['updated'] for run in runs] + [self.mark or 0])
+            return completed, parameters, mark
+
+        changed = {}
+        for fn in outputfiles:
+            name = parseoutputname(fn)[0]
+            if name not in self.ingested:
+                changed[name] = max(changed.get(name, 0),
+                                    os.path.getmtime(os.path.join(self.outputloc, fn)))
+        settled = time.time() - self.settle
+        completed = dict((name, name) for name, mtime in changed.items() if mtime < settled)
+        mark = max([changed[name] for name in completed] + [self.mark or 0])
+        return completed, dict((name, typedparameters(name)) for name in completed), mark
+
+    def update(self):
+        '''
+        Ingests the points completed since the last update, returning how many
+        '''
+        outputfiles = [fn for fn in os.listdir(self.outputloc)
+                       if fn.endswith(('.csv', '.mat')) and '.fsp' in fn and
+                       (self.quantities is None or parseoutputname(fn)[1] in self.quantities)]
+        completed, parameters, mark = self._completed(outputfiles)
+        if not completed:
+            self.mark = mark
+            return 0
+
+        byname = {}
+        for fn in outputfiles:
+            byname.setdefault(parseoutputname(fn)[0], []).append(fn)
+        toread = sorted(set(fn for name in set(completed.values()) for fn in byname[name]))
+
+        matrices = _readoutputs([os.path.join(self.outputloc, fn) for fn in toread],
+                                self.max_workers)
+
+        outputs = {}  # quantity : {name : matrix}
+        for fn, matrix in zip(toread, matrices):
+            name, quantity = parseoutputname(fn)
+            outputs.setdefault(quantity, {})[name] = matrix
+
+        names = sorted(completed)
+        segment = SweepData(names, pd.DataFrame([parameters[name] for name in names]),
+                            {quantity: _stack([bysource.get(completed[name],
+                                                            np.full((0, 0), np.nan))
+                                               for name in names])
+                             for quantity, bysource in outputs.items()})
+
+        self.datasets.append(segment)
+        self.ingested.update(names)
+        self.mark = mark
+        self._data = None
+        self._save(segment)
+
+        if self.verbose > 0:
+            print("Ingested", len(names), "sweep points,", len(self.ingested), "in all")
+        return len(names)
+
+    def _save(self, segment):
+        '''
+        Writes _segment_ (or every segment merged once there are _compact_)
+        followed by the state naming the segments
+        '''
+        if not os.path.isdir(self.location):
+            os.mkdir(self.location)
+
+        previous = []
+        if len(self.segments) + 1 >= self.compact:
+            previous = self.segments
+            self.datasets = [self.data]
+            self.segments = []
+            segment = self.datasets[0]
+
+        name = 'segment_{0:.6f}.npz'.format(time.time())
+        segment.save(os.path.join(self.location, name + '.tmp'))
+        os.rename(os.path.join(self.location, name + '.tmp'), os.path.join(self.location, name))
+        self.segments.append(name)
+
+        state = os.path.join(self.location, 'state.json')
+        with open(state + '.tmp', 'w') as statefile:
+            json.dump({'mark': self.mark, 'quantities': self.quantities,
+                       'segments': self.segments, 'ingested': sorted(self.ingested)},
+                      statefile)
+        os.rename(state + '.tmp', state)
+
+        for old in previous:
+            os.remove(os.path.join(self.location, old))
+
+    def finished(self):
+        '''
+        True once the manifest records runs and none still to be processed
+        (always False without a manifest)
+        '''
+        if self.manifest is None:
+            return False
+        counts = self.manifest.counts()
+        return bool(counts) and sum(counts.values()) == \
+            counts.get(SweepManifest.PROCESSED, 0) + counts.get(SweepManifest.FAILED, 0)
+
+    def follow(self, interval=10, timeout=None):
+        '''
+        Updates every _interval_ seconds, yielding the SweepData of every
+        point ingested after each update which finds new points, until the
+        sweep has finished (see _finished_) or _timeout_ seconds have passed
+        '''
+        start = time.time()
+        while True:
+            finished = self.finished()  # before the update so no point is left behind
+            if self.update():
+                yield self.data
+            if finished or (timeout is not None and time.time() - start >= timeout):
+                return
+            time.sleep(interval)
@@ -11,17 +11,43 @@
 """
 
 from __future__ import print_function, division
-import itertools
-from collections import Iterable
+try:
+    from collections.abc import Iterable
+except ImportError:  # python2
+    from collections import Iterable
 import os
-from subprocess import check_output
 import datetime
+import errno
+import itertools
+import math
+import re
+import shutil
+import tempfile
 import time
-
-
-def writedetails(workingdir, keyword, defaultparams, newparams, verbose=0):
+from .template import CompileLSF, LSFTemplate, estimateType, binaryoutput, renderdigest
+from .cache import SweepCache, GENERATED, SIMULATED
+from .sweep import (ParameterSweep, SweepPoints, SAMPLERS, PRECISION, refinesweep,
+                    lsftogenerate, _uniquedictstring)
+from .manifest import SweepManifest, findmanifest, runid, MANIFEST
+from .scheduler import ScheduleFSPfiles, runresult, _threadpool
+from .runner import RunCommand, parseprogress, lastusage
+from .tracing import Tracer, traced, span, count
+from .pipeline import Stage, RunPipeline
+from .executors import (Executor, LocalExecutor, MPIExecutor, SSHExecutor, LocalHost, HostPool,
+                        CorePool)
+from .costmodel import CostModel, MeshQuery, planjobs, HISTORY
+from .admission import MemoryBudget, admitjobs
+from .storage import StoragePolicy, POLICY
+from .retry import (LumericalError, Deferred, LicenceUnavailable, NoProcessorLayout, RetryPolicy,
+                    RetryQueue, LicencePool, classifyoutput, INVALID, NOLAYOUT, FLEXNET)
+
+
+def writedetails(workingdir, keyword, defaultparams, newparams, verbose=0, samples=None):
     '''
     Writes important details to text file within directory
+
+    With _samples_ the sweep is a sample of _newparams_ (see _sampler_ of
+    _ParameterSweepInput_) rather than their grid
     '''
 
     writedatatofile = open(os.path.join(workingdir, keyword, 'README'), 'w')
@@ -29,11 +55,19 @@ def writedetails(workingdir, keyword, defaultparams, newparams, verbose=0):
     writedatatofile.write("Files generated on {0} at {1}\n".format(
         datetime.date.today(), datetime.datetime.now()))
     writedatatofile.write("\n--Default parameters--\n")
-    for key, value in defaultparams.iteritems():
+    for key, value in defaultparams.items():
         writedatatofile.write("{0}={1}\n".format(key, value))
 
     writedatatofile.write("\n--Parameter Sweeping over--\n")
     for name, param in newparams:
+        if samples is not None and isinstance(param, tuple) and len(param) == 2:
+            writedatatofile.write("{0} sampled from {1} to {2} ({3} samples)\n".format(
+                name, param[0], param[1], samples))
+            continue
+        if samples is not None:
+            writedatatofile.write("{0} sampled among {1} ({2} samples)\n".format(
+                name, ", ".join(str(value) for value in param), samples))
+            continue
         writedatatofile.write(
             "{0} swept from {1} to {2} in {3} steps\n".format(name,
                                                               min(param),
@@ -43,6 +77,11 @@ def writedetails(workingdir, keyword, defaultparams, newparams, verbose=0):
     writedatatofile.close()
 
 
+_sweeploc = lambda workingdir, keyword, *args, **kwargs: os.path.join(workingdir, keyword)
+_fspsweeploc = lambda fsploc, *args, **kwargs: os.path.dirname(os.path.normpath(fsploc))
+
+
+@traced(_sweeploc)
 def ParameterSweepInput(workingdir, keyword, newparams, defaultparams, script, verbose=0, **kwargs):
     '''
     Parameter Sweep for FDTD-Solutions
@@ -58,6 +97,36 @@ def ParameterSweepInput(workingdir, keyword, newparams, defaultparams, script, v
     Optional Parameters
     -------------------
     delete_existing_files (False)   : (WARNING!) This will delete all existing files within directory
+    sampler ('grid') : 'grid' runs every combination of newparams, 'lhs' (Latin
+        hypercube) or 'sobol' run _samples_ points spread over them. For these a
+        (low, high) tuple is a continuous range (integers if both are ints) and
+        any other sequence a set of discrete choices
+        samples (None) : number of points sampled
+        seed (None) : random seed of the sample ('sobol' without one is unshifted)
+    points (None) : list of dicts of swept parameters to run instead (see
+        _AdaptiveParameterSweep_)
+    max_workers (1) : number of fdtd-solutions generator processes run at once,
+        bounded by the number of GUI licences available (alias : licences)
+    batch_size (1) : number of sweep points built by each fdtd-solutions launch
+    licence_pool (None) : LicencePool of GUI licences shared with other sweeps
+    TimeDelay (10), MaxAttempts (10) : licence retry backoff (see _RetryPolicy_)
+    cache_dir (None) : directory of a SweepCache shared between sweeps. Points
+        already generated (under any keyword) are copied from it
+        cache_size (None) : size in bytes the cache is evicted down to
+    short_names (False) : name files by run ID (see _runid_) rather than by
+        their swept parameters, parameters are then found in the sweep manifest
+    shard (None) : (i, n) only generate shard i of n near equal parts of the sweep
+    chunk_size (10000) : sweep points expanded and generated at a time
+    precision (12) : significant figures float parameters are canonicalised
+        to (see _canonical_), None to take them as given
+    deduplicate (True) : a point building the same simulation as another
+        point, or a run already in the sweep, is recorded in the manifest as
+        an alias of it rather than simulated again (see _SweepManifest.alias_).
+        Aliases share its outputs in _QueryRuns_ and _LoadSweep_
+    storage (None) : StoragePolicy bounding the disk taken by the sweep, kept
+        with it so _ProcessGenerated_ applies it too.
+        Generation stops with IOError (ENOSPC) once the sweep is over budget,
+        leaving the points not generated pending in the manifest
     generate_movie_of_setup (False) : generate movie using the Lumerical orbit command
         moviefsp (60) : frames per second passed to Orbit();
         moviezoom (1) : zoom factor passed to Orbit();
@@ -72,42 +141,128 @@ def ParameterSweepInput(workingdir, keyword, newparams, defaultparams, script, v
 
     ##Verbosity modifiers
     output_simulation_names = kwargs.get('output_simulation_names',False)
-    delete_existing_files = kwargs.get('delete_existing_files', False)
     show_created_fsp_files = kwargs.get('show_created_fsp_files', False)
     
     
-    lsfloc, fsploc, dataloc = SetupEnvironment(workingdir, keyword, 
-                    verbose=verbose, delete_existing_files=delete_existing_files)
+    storage = kwargs.pop('storage', None)
 
+    lsfloc, fsploc, dataloc, lsffiles, swept = _PrepareSweep(
+        workingdir, keyword, newparams, defaultparams, verbose=verbose, **kwargs)
 
-    ##This list comprehension will wrap any single parameters given INCLUDING
-    ##strings to ensure we don't mess about too much!
-    newparams = [(parametername, [parameter]) 
-             if not isinstance(parameter, Iterable) or isinstance(parameter, str) 
-             else (parametername, parameter) for parametername, parameter in newparams]
-    
-
-
-    writedetails(workingdir, keyword, defaultparams, newparams)
-
-    lsffiles = GenerateParameterSweepDictionary(newparams, defaultparams,
-                                                verbose=verbose)
+    sweeploc = os.path.join(workingdir, keyword)
+    manifest = SweepManifest(sweeploc)
+    if storage is not None:
+        storage.save(sweeploc)
     
     if verbose > 0:
         print("\nUsing override dictionary to generate ", len(lsffiles), " simulations:")
-    
-    for lsfname, parameters in lsffiles:
+
+    max_workers = kwargs.get('max_workers', kwargs.get('licences', 1))
+    batch_size = kwargs.get('batch_size', 1)
+    cache_dir = kwargs.get('cache_dir', None)
+    chunk_size = kwargs.get('chunk_size', 10000)
+
+    if cache_dir is not None:
+        cache = SweepCache(cache_dir, kwargs.get('cache_size', None), verbose=verbose)
+        template = CompileLSF(script)
+
+    def admitted(generate):
+        def admittedgenerate(job, **overrides):
+            if storage is not None:
+                storage.wait(sweeploc, verbose=verbose)
+            return generate(job, **overrides)
+        return admittedgenerate
+
+    ngenerated = ncached = 0
+    failures = []
+    outofspace = None
+    kept = {}  # digest : name of the points generated by earlier chunks
+    for chunk, lsffiles in enumerate(lsffiles.chunks(chunk_size)):
+        if kwargs.get('short_names', False):
+            lsffiles = [[runid(parameters), parameters] for lsfname, parameters in lsffiles]
+
+        if kwargs.get('deduplicate', True):
+            lsffiles = _Deduplicate(manifest, lsffiles, swept, kept=kept, verbose=verbose)
+        else:
+            manifest.add([(runid(parameters), lsfname, parameters)
+                          for lsfname, parameters in lsffiles], swept=swept)
+
         if (verbose > 0) and output_simulation_names:
             for lsfname, parameters in lsffiles:
                 print(lsfname, sep="\t")
 
-        lsf = (lsfloc, lsfname)
-        fsp = (fsploc, lsfname)
-        GenerateLSFinput(script, lsf, fsp, parameters, verbose=verbose, **kwargs)
-        GenerateFSPinput(lsf, verbose=verbose)
+        togenerate = lsffiles
+        if cache_dir is not None:
+            cache.writeindex(fsploc, {lsfname: cache.key(template, parameters)
+                                      for lsfname, parameters in lsffiles})
+            missing = set(cache.restore(fsploc, GENERATED,
+                                        [lsfname for lsfname, parameters in lsffiles]))
+            togenerate = [point for point in lsffiles if point[0] in missing]
+            ncached += len(lsffiles) - len(togenerate)
+
+        if batch_size > 1:
+            nbatches = (len(togenerate) + batch_size - 1) // batch_size
+            jobs = [("batch_{0}_{1:0{2}d}".format(chunk, i, len(str(nbatches))),
+                     togenerate[i * batch_size:(i + 1) * batch_size])
+                    for i in range(nbatches)]
+            generate = lambda job, **overrides: _GenerateBatch(script, lsfloc, fsploc, *job,
+                                                               verbose=verbose, **kwargs)
+        else:
+            jobs = togenerate
+            generate = lambda job, **overrides: _GeneratePoint(script, lsfloc, fsploc, *job,
+                                                               verbose=verbose, **kwargs)
+
+        held = set()  # points not generated for want of space
+        for (jobname, points), result, err in _threadpool(
+                admitted(generate), jobs, max_workers, policy=RetryPolicy.fromkwargs(kwargs),
+                licences=kwargs.get('licence_pool', None), verbose=verbose):
+            if _outofspace(err):
+                outofspace = err
+                held.update([jobname] if batch_size == 1 else
+                            [lsfname for lsfname, parameters in points])
+            elif err is not None:
+                failures.append((jobname, err))
+
+        if cache_dir is not None:  # stale files were deleted, so those left are new
+            failed = set(jobname for jobname, err in failures) if batch_size == 1 else set()
+            cache.save(fsploc, GENERATED, [lsfname for lsfname, parameters in togenerate
+                                           if lsfname not in failed and os.path.exists(
+                                               os.path.join(fsploc, lsfname + '.fsp'))])
+
+        generated = [os.path.exists(os.path.join(fsploc, lsfname + '.fsp'))
+                     for lsfname, parameters in lsffiles]
+        manifest.setstatus([lsfname for (lsfname, parameters), exists
+                            in zip(lsffiles, generated) if exists], SweepManifest.GENERATED)
+        manifest.setstatus([lsfname for (lsfname, parameters), exists
+                            in zip(lsffiles, generated)
+                            if not exists and lsfname not in held], SweepManifest.FAILED)
+        ngenerated += sum(generated)
+
+        if storage is not None:
+            storage.generated(lsfloc, [lsfname for (lsfname, parameters), exists
+                                       in zip(lsffiles, generated) if exists] +
+                              [jobname for jobname, points in jobs if batch_size > 1 and
+                               all(os.path.exists(os.path.join(fsploc, lsfname + '.fsp'))
+                                   for lsfname, parameters in points)])
+
+        if outofspace is not None:
+            break
+
+    if verbose > 0:
+        if cache_dir is not None:
+            print(ncached, "simulations copied from cache")
+        print("Generated", ngenerated - ncached, "simulations with", len(failures), "failures")
 
-        if any([afile.endswith('xml') for afile in os.listdir(lsfloc)]):
-            raise ValueError("lsf file : " + lsfname + " is not correct. Check error in input directory.")
+    if outofspace is not None:
+        raise outofspace
+
+    if failures:
+        raise ValueError("lsf files are not correct. Check errors in input directory:\n" +
+                         "\n".join("{0} : {1}".format(lsfname, err)
+                                   for lsfname, err in failures))
+
+    if any([afile.endswith('xml') for afile in os.listdir(lsfloc)]):
+        raise ValueError("Unattributed error found. Check error in input directory.")
 
     if (verbose > 0) and show_created_fsp_files:
         print("\nCreated (.lsf directory):")
@@ -121,17 +276,169 @@ def ParameterSweepInput(workingdir, keyword, newparams, defaultparams, script, v
     return fsploc, dataloc
 
 
-class LumericalError(Exception):
+def _PrepareSweep(workingdir, keyword, newparams, defaultparams, verbose=0, **kwargs):
     '''
-    Whenever Lumerical FDTD-Solutions throws a (known) wobbler that we cannot
-    solve, this error will be raised. Unknown errors cannot be caught as there
-    is no known list of errors to compare to (fun right?!)
+    Sets up the sweep directories and README, returning (lsfloc, fsploc,
+    dataloc, sweep, swept names) where sweep is the lazy sequence of
+    [lsfname, parameters] chosen by the sampler, points and shard options
+    (see _ParameterSweepInput_)
     '''
-    def __init__(self, value):
-        self.value = value
+    sampler = kwargs.get('sampler', 'grid')
+    sampled = sampler in SAMPLERS and kwargs.get('points', None) is None
+    if sampled and kwargs.get('samples', None) is None:
+        raise ValueError("The {0} sampler needs samples, the number of points "
+                         "sampled".format(sampler))
 
-    def __str__(self):
-        return repr(self.value)
+    lsfloc, fsploc, dataloc = SetupEnvironment(
+        workingdir, keyword, verbose=verbose,
+        delete_existing_files=kwargs.get('delete_existing_files', False))
+
+    ##This list comprehension will wrap any single parameters given INCLUDING
+    ##strings to ensure we don't mess about too much!
+    newparams = [(parametername, [parameter])
+             if not isinstance(parameter, Iterable) or isinstance(parameter, str)
+             else (parametername, parameter) for parametername, parameter in newparams]
+
+    writedetails(workingdir, keyword, defaultparams, newparams,
+                 samples=kwargs.get('samples', None) if sampler in SAMPLERS else None)
+
+    swept = [name for name, param in newparams]
+    if kwargs.get('points', None) is not None:
+        lsffiles = SweepPoints([dict((name, point[name]) for name in swept)
+                                for point in kwargs['points']], defaultparams)
+    elif sampler == 'grid':
+        if kwargs.get('seed', None) is not None:
+            raise ValueError("The grid sampler takes no seed, use 'lhs' or 'sobol'")
+        lsffiles = GenerateParameterSweepDictionary(newparams, defaultparams,
+                                                    verbose=verbose)
+    elif sampler in SAMPLERS:
+        lsffiles = SAMPLERS[sampler](newparams, defaultparams, kwargs['samples'],
+                                     **({'seed': kwargs['seed']} if 'seed' in kwargs else {}))
+    else:
+        raise ValueError("Unknown sampler " + sampler)
+
+    lsffiles.precision = kwargs.get('precision', PRECISION)
+    if kwargs.get('shard', None) is not None:
+        lsffiles = lsffiles.shard(*kwargs['shard'])
+
+    return lsfloc, fsploc, dataloc, lsffiles, swept
+
+
+def _Deduplicate(manifest, lsffiles, swept, known=(), kept=None, verbose=0):
+    '''
+    Records the [lsfname, parameters] points of _lsffiles_ in _manifest_,
+    returning those to generate
+
+    A point whose parameters render to the same variables block (see
+    _renderdigest_) as an earlier point or a run already in the manifest
+    (and not failed or pending, see _SweepManifest.find_) is recorded as an
+    alias of it and not generated, and a point repeated is only kept once.
+    Points named in _known_ are already in the manifest. _kept_ ({digest :
+    name}) holds the points kept by earlier calls of the same sweep, which
+    may still be pending, and is updated with those kept now
+    '''
+    digests = [renderdigest(parameters) for lsfname, parameters in lsffiles]
+    kept = kept if kept is not None else {}
+    simulated = manifest.find(set(digests))
+    simulated.update((digest, name) for digest, name in
+                     manifest.find(set(digests) & set(kept), pending=True).items()
+                     if digest not in simulated and kept[digest] == name)
+
+    unique, aliases, seen = [], [], set()
+    for (lsfname, parameters), digest in zip(lsffiles, digests):
+        if lsfname in seen:
+            continue
+        seen.add(lsfname)
+        target = simulated.setdefault(digest, lsfname)
+        if target == lsfname:
+            unique.append([lsfname, parameters])
+            kept[digest] = lsfname
+        else:
+            aliases.append((lsfname, parameters, target))
+
+    manifest.add([(runid(parameters), lsfname, parameters)
+                  for lsfname, parameters in unique if lsfname not in known], swept=swept)
+    manifest.alias(aliases, swept=swept)
+
+    if verbose > 0 and len(unique) < len(lsffiles):
+        print(len(lsffiles) - len(unique), "points duplicate others and are not simulated again")
+    return unique
+
+
+def _GeneratePoint(script, lsfloc, fsploc, lsfname, parameters, verbose=0, **kwargs):
+    '''
+    Generates the lsf and fsp files of a single sweep point, raising ValueError
+    if Lumerical leaves an xml error file for _lsfname_ in _lsfloc_
+    '''
+    if os.path.exists(os.path.join(fsploc, lsfname + '.fsp')):  # a stale file would hide failure
+        os.remove(os.path.join(fsploc, lsfname + '.fsp'))
+
+    lsf = (lsfloc, lsfname)
+    fsp = (fsploc, lsfname)
+    with span('generate', job=lsfname):
+        GenerateLSFinput(script, lsf, fsp, parameters, verbose=verbose, **kwargs)
+        GenerateFSPinput(lsf, verbose=verbose, defer=True)
+
+    if _lsferrors(lsfloc, lsfname):
+        raise ValueError("lsf file : " + lsfname + " is not correct. Check error in input directory.")
+
+
+def _GenerateBatch(script, lsfloc, fsploc, batchname, lsffiles, verbose=0, **kwargs):
+    '''
+    Generates the fsp files of several sweep points with one fdtd-solutions
+    launch, raising ValueError naming any point that failed to save
+
+    Points are saved in turn, so if the launch stops early the first unsaved
+    point is recorded as failed and the rest are relaunched without it
+    '''
+    for lsfname, parameters in lsffiles:  # stale files would hide failures
+        if os.path.exists(os.path.join(fsploc, lsfname + '.fsp')):
+            os.remove(os.path.join(fsploc, lsfname + '.fsp'))
+
+    lsf = (lsfloc, batchname)
+    missing = []
+    remaining = list(lsffiles)
+    while remaining:
+        with span('generate', job=batchname, points=len(remaining)):
+            GenerateBatchLSFinput(script, lsf, fsploc, remaining, verbose=verbose, **kwargs)
+            try:
+                GenerateFSPinput(lsf, verbose=verbose, defer=True)
+            except Deferred:
+                raise
+            except LumericalError as err:  # the files saved show how far the batch got
+                if verbose > 0:
+                    print(err)
+
+        saved = [os.path.exists(os.path.join(fsploc, lsfname + '.fsp'))
+                 for lsfname, parameters in remaining]
+        if all(saved):
+            break
+
+        failed = saved.index(False)
+        missing.append(remaining[failed][0])
+        if verbose > 0:
+            print(remaining[failed][0], "failed within batch", batchname)
+        remaining = remaining[failed + 1:]
+
+    if missing or _lsferrors(lsfloc, batchname):
+        raise ValueError("lsf file : " + batchname + " is not correct. Check error in input directory."
+                         " Not generated : " + ", ".join(missing))
+
+
+def _outofspace(err):
+    '''
+    True if _err_ is the IOError (ENOSPC) of a StoragePolicy over budget
+    '''
+    return isinstance(err, EnvironmentError) and err.errno == errno.ENOSPC
+
+
+def _lsferrors(lsfloc, lsfname):
+    '''
+    Lists the xml error files Lumerical has written for _lsfname_ (named
+    lsfname.xml or lsfname_p<process>.xml), not those of names it begins
+    '''
+    errorfile = re.compile(re.escape(lsfname) + r'(_p\d+)?\.xml$')
+    return [afile for afile in os.listdir(lsfloc) if errorfile.match(afile)]
 
 
 def catchlumericaloutput(execfunc):
@@ -144,87 +451,286 @@ def catchlumericaloutput(execfunc):
     is not known
 
     2) pause if all GUI licences are in use. Then rerun a maximum number of
-    times after a defined time. If the engine licences are all in use, stop
-    simulation
+    times with exponential backoff (see _RetryPolicy_). If the engine licences
+    are all in use, stop simulation
+
+    Called with defer=True, 1) and 2) raise NoProcessorLayout or
+    LicenceUnavailable instead so a RetryQueue can reschedule the launch
     '''
     def checkoutput(*args, **kwargs):
         '''
         Catches Lumerical FDTD-Solutions in the act of complaining
         '''
         verbose = kwargs.get('verbose', 0)  
-        TimeDelay = kwargs.pop('TimeDelay', 10) #seconds
-        MaxAttempts = kwargs.pop('MaxAttempts', 10)
+        policy = RetryPolicy.fromkwargs(kwargs)
+        kwargs.pop('TimeDelay', None)
+        kwargs.pop('MaxAttempts', None)
+        defer = kwargs.pop('defer', False)
 
-        stroutput = execfunc(*args, **kwargs) #output to be validated
+        attempt = 1
+        while True:
+            stroutput = execfunc(*args, **kwargs) #output to be validated
 
-        if verbose > 1:
-            print("Output from execution is")
-            print(stroutput)
+            if verbose > 1:
+                print("Output from execution is")
+                print(stroutput)
 
-        # Check number 0
-        zerothcheck = "Error: "
-        if stroutput.find(zerothcheck) > 0:
-            raise LumericalError("lsf script is invalid!\n\n"+stroutput)
-        
+            failure = classifyoutput(stroutput)
 
-        # Check number 1
-        firstcheck = "There is no possible parallel processor layout"
-        if stroutput.find(firstcheck) > 0:
-
-            if verbose > 0:
-                print("No Possible layout, executing again with single core")
-            kwargs['cores'] = 1
-            checkoutput(*args, **kwargs)  # attempt to run again
+            if failure == INVALID:
+                raise LumericalError("lsf script is invalid!\n\n"+stroutput)
 
-        # Check number 2
-        secondcheck = "Unable to check out a FlexNet license"
-        if stroutput.find(secondcheck) > 0:
-
-            try:
-                kwargs['attemptsmade'] += 1
-            except KeyError:
-                kwargs['attemptsmade'] = 1
-
-            if verbose > 0:
-                print(
-                    "Lumerical licence not currently available on run {0}".format(kwargs['attemptsmade']))
+            elif failure == NOLAYOUT:
+                if defer:
+                    raise NoProcessorLayout(stroutput)
+                count('layout retries')
+                if verbose > 0:
+                    print("No Possible layout, executing again with single core")
+                args, kwargs = _singlecore(execfunc, args, kwargs, stroutput)
 
-            if kwargs['attemptsmade'] > MaxAttempts: #do not pass go, do not collect 200
+            elif failure == FLEXNET:
+                if defer:
+                    raise LicenceUnavailable(stroutput)
                 if verbose > 0:
-                    raise LumericalError(
-                        "maximum number of attempts reached, stopping")
-            else:
+                    print("Lumerical licence not currently available on run {0}".format(attempt))
+                if attempt > policy.max_attempts: #do not pass go, do not collect 200
+                    raise LumericalError("maximum number of attempts reached, stopping")
                 # waits a reasonable amount of time before attempting again
-                time.sleep(TimeDelay)
-                checkoutput(*args, **kwargs)  # attempt to run again
+                count('licence retries')
+                with span('licence wait', 'wait', attempt=attempt):
+                    time.sleep(policy.backoff(attempt))
+                attempt += 1
 
-        return stroutput
+            else:
+                return stroutput
 
     return checkoutput
 
 
-@catchlumericaloutput
-def ExecuteFSPfiles(fsploc, cores=8, execute=True, verbose=0):
+def _singlecore(execfunc, args, kwargs, stroutput):
+    '''
+    Returns the arguments of _execfunc_ with cores set to 1, however it was given
+    '''
+    arguments = execfunc.__code__.co_varnames[:execfunc.__code__.co_argcount]
+    if 'cores' not in arguments or kwargs.get('cores') == 1:
+        raise LumericalError(stroutput)
+
+    position = arguments.index('cores')
+    if len(args) > position:
+        if args[position] == 1:
+            raise LumericalError(stroutput)
+        args = args[:position] + (1,) + args[position + 1:]
+    else:
+        kwargs = dict(kwargs, cores=1)
+
+    return args, kwargs
+
+
+@traced(_fspsweeploc)
+def ExecuteFSPfiles(fsploc, cores=8, execute=True, verbose=0, **kwargs):
     '''
     Executes all fsp files in _fsploc_
 
-    TODO - Get code to work properly for a list of lsffiles
+    Optional Parameters
+    -------------------
+    cache_dir (None) : directory of a SweepCache shared between sweeps. Files
+        generated by ParameterSweepInput with the same cache_dir which have
+        already been simulated are hardlinked (or copied) from the cache
+        rather than run, and newly simulated files are added to it
+        cache_size (None) : size in bytes the cache is evicted down to
+    jobs (None) : run each fsp file as its own engine job, _jobs_ at a time,
+        sharing _cores_ between them. A list of per file results is returned
+        (see _ScheduleFSPfiles_) rather than the engine output
+        resume (True) : skip files which completed on a previous call
+        licence_pool (None) : LicencePool of engine licences shared with other runs
+        cost_model (None) : CostModel (or True for one kept in the sweep
+            directory) predicting the cost of each file from earlier runs.
+            Files are then run longest first, each with cores // jobs cores
+            scaled by its predicted cost and bounded by the cores similar
+            runs could be laid out over (see _planjobs_), as many at once as
+            the cores allow. A file with no processor layout is retried on
+            half its cores. Every run is added to the model's history
+        memory_budget (None) : MB the jobs may use together, or 'auto' for
+            the memory available at the start. A job only starts while the
+            memory projected for it and the jobs running fits (see
+            _MemoryBudget_), otherwise it waits. A job killed for memory
+            while others were running is run again once there is room
+            memory_estimates (None) : {fspname : MB} of each job, otherwise
+                the cost_model's prediction or the largest peak measured
+            memory_reserve (0) : MB always left free for the rest of the node
+    fspnames (None) : names (without .fsp) of the files to run rather than all of them
+    hosts (None) : list of executors (e.g. SSHExecutor, MPIExecutor) the files
+        are spread over as separate jobs, each host running as many at once as
+        it has cores for (see _HostPool_). A list of per file results is returned
+        cores_per_job (None) : cores given to each job (default : all of a host's)
+    progress (None) : callback given each percent complete / auto shutoff line
+        as a dict (see _RunCommand_)
+    TimeDelay (10), MaxAttempts (10) : licence retry backoff (see _RetryPolicy_)
 
     see : http://docs.lumerical.com/en/fdtd/user_guide_run_linux_fdtd_command_line_multi.html
     '''
+    cache_dir = kwargs.pop('cache_dir', None)
+    cache_size = kwargs.pop('cache_size', None)
+    jobs = kwargs.pop('jobs', None)
+    resume = kwargs.pop('resume', True)
+    licence_pool = kwargs.pop('licence_pool', None)
+    fspnames = kwargs.pop('fspnames', None)
+    hosts = kwargs.pop('hosts', None)
+    cores_per_job = kwargs.pop('cores_per_job', None)
+    cost_model = kwargs.pop('cost_model', None)
+    memory_budget = kwargs.pop('memory_budget', None)
+    memory_reserve = kwargs.pop('memory_reserve', 0)
+    memory_estimates = kwargs.pop('memory_estimates', None)
+
+    if fspnames is None:
+        fspnames = sorted(fn[:-len('.fsp')] for fn in os.listdir(fsploc) if fn.endswith('.fsp'))
+        selected = None
+    else:
+        selected = fspnames = list(fspnames)
+    manifest = findmanifest(fsploc) if execute else None
+
+    if not execute or (cache_dir is None and jobs is None and hosts is None):
+        stroutput = _ExecuteFSPfiles(fsploc, cores, execute=execute, verbose=verbose,
+                                     fspnames=selected, **kwargs)
+        if manifest is not None:
+            manifest.setstatus(fspnames, SweepManifest.SIMULATED)
+        return stroutput
+
+    torun = fspnames
+
+    if cache_dir is not None:
+        cache = SweepCache(cache_dir, cache_size, verbose=verbose)
+        torun = cache.restore(fsploc, SIMULATED, fspnames, link=True)
+
+        if verbose > 0:
+            print(len(fspnames) - len(torun), "simulations fetched from cache")
+
+    if hosts is not None:
+        pool = HostPool(hosts, cores_per_job)
+
+        def runjob(fspname, cores=None):
+            i, executor, slotcores = pool.acquire()
+            try:
+                return _ExecuteOn(executor, fsploc, cores or slotcores, fspnames=[fspname],
+                                  verbose=verbose, defer=True, **kwargs)
+            finally:
+                pool.release(i)
+
+        try:
+            stroutput = ScheduleFSPfiles(fsploc, runjob, fspnames=torun, jobs=len(pool),
+                                         resume=resume, verbose=verbose,
+                                         policy=RetryPolicy.fromkwargs(kwargs),
+                                         licences=licence_pool)
+        finally:
+            pool.close()
+        succeeded = [result['fsp'] for result in stroutput if result['returncode'] == 0]
+    elif jobs is None:
+        stroutput = _ExecuteFSPfiles(fsploc, cores, fspnames=torun, verbose=verbose,
+                                     **kwargs) if torun else ""
+        succeeded = torun
+    else:
+        jobcores = max(1, cores // jobs)
+        runjob = lambda fspname, cores=jobcores: _ExecuteFSPfiles(
+            fsploc, cores, fspnames=[fspname], verbose=verbose, defer=True, **kwargs)
+        if cost_model is not None:
+            if cost_model is True:
+                cost_model = CostModel(os.path.join(_fspsweeploc(fsploc), HISTORY))
+            torun, runjob, predictions = _CostedJobs(cost_model, fsploc, torun, manifest,
+                                                     cores, jobs, verbose=verbose, **kwargs)
+            jobs = cores  # the cores each job takes bound how many run at once
+            predicted = dict((fspname, prediction['maxrss'])
+                             for fspname, prediction in predictions.items())
+            predicted.update(memory_estimates or {})
+            memory_estimates = predicted
+        if memory_budget is not None:
+            runjob = admitjobs(MemoryBudget(memory_budget, reserve=memory_reserve), runjob,
+                               memory_estimates, verbose=verbose)
+        stroutput = ScheduleFSPfiles(fsploc, runjob, fspnames=torun, jobs=jobs,
+                                     resume=resume, verbose=verbose,
+                                     policy=RetryPolicy.fromkwargs(kwargs),
+                                     licences=licence_pool)
+        succeeded = [result['fsp'] for result in stroutput if result['returncode'] == 0]
+
+    if cache_dir is not None:
+        cache.save(fsploc, SIMULATED, succeeded)
+
+    if manifest is not None:
+        manifest.setstatus(fspnames, SweepManifest.SIMULATED)
+        manifest.setstatus(set(torun) - set(succeeded), SweepManifest.FAILED)
+
+    return stroutput
+
+
+def _CostedJobs(model, fsploc, fspnames, manifest, cores=8, jobs=1, verbose=0, **kwargs):
+    '''
+    Returns (_fspnames_ longest first, a job running each file with the
+    cores chosen by _planjobs_ from _model_ and recording the run in it,
+    the predictions of each file)
+    '''
+    parameters = dict((run['name'], run['parameters'])
+                      for run in (manifest.runs() if manifest is not None else []))
+    order, jobcores, predictions = planjobs(model, fspnames, parameters, fsploc, cores, jobs)
+    pool = CorePool(cores)
+
+    if verbose > 0:
+        for fspname in order:
+            print(fspname, "predicted", predictions[fspname]['work'], "core seconds, running on",
+                  jobcores[fspname], "cores")
+
+    def runjob(fspname, cores=None):
+        cores = pool.acquire(cores or jobcores[fspname])
+        taken = cores
+        try:
+            while True:
+                start = time.time()
+                try:
+                    stroutput = _ExecuteFSPfiles(fsploc, cores, fspnames=[fspname],
+                                                 verbose=verbose, defer=True, **kwargs)
+                except NoProcessorLayout as err:
+                    model.record(parameters.get(fspname, {}), cores=cores, nolayout=True)
+                    if cores == 1:
+                        raise LumericalError(err.value)
+                    count('layout retries')
+                    cores //= 2
+                    if verbose > 0:
+                        print("No Possible layout, executing", fspname, "again with", cores, "cores")
+                    continue
+
+                model.record(parameters.get(fspname, {}), time.time() - start, cores,
+                             maxrss=lastusage().get('maxrss'),
+                             cells=predictions[fspname]['cells'])
+                return stroutput
+        finally:
+            pool.release(taken)
+
+    return order, runjob, predictions
+
+
+@catchlumericaloutput
+def _ExecuteFSPfiles(fsploc, cores=8, execute=True, verbose=0, fspnames=None, progress=None):
+    '''
+    Executes the fsp files _fspnames_ (default : all) in _fsploc_
+    '''
 
-    ExecFSP = "fdtd-run-local.sh -n " + \
-        str(cores) + ' ' + os.path.join(fsploc, "*.fsp")
+    ExecFSP = LocalExecutor(cores).command(fsploc, fspnames)
 
     if verbose > 0:
         print(ExecFSP)
 
     if execute:
-        return check_output(ExecFSP, shell=True)
+        return RunCommand(ExecFSP, progress=progress, verbose=verbose)
     else:
         return ExecFSP
 
 
+@catchlumericaloutput
+def _ExecuteOn(executor, fsploc, cores=8, verbose=0, fspnames=None, progress=None):
+    '''
+    Simulates the fsp files _fspnames_ in _fsploc_ with _executor_
+    '''
+    return executor.run(fsploc, fspnames, cores, progress=progress, verbose=verbose)
+
+
 @catchlumericaloutput
 def ExecuteScriptOnFSP(fsp, script, execute=True, verbose=0, **kwargs):
     '''
@@ -244,7 +750,7 @@ def ExecuteScriptOnFSP(fsp, script, execute=True, verbose=0, **kwargs):
         print(toexec)
 
     if execute:
-        return check_output(toexec, shell=True)
+        return RunCommand(toexec, progress=kwargs.get('progress', None), verbose=verbose)
     else:
         return toexec
 
@@ -271,71 +777,608 @@ def GenerateFSPinput(lsf, execute=True, verbose=0, **kwargs):
         print("calling :", ExecLumerical)
 
     if execute:
-        return check_output(ExecLumerical, shell=True)
+        return RunCommand(ExecLumerical, progress=kwargs.get('progress', None),
+                          verbose=verbose)
     else:
         return ExecLumerical
 
-try:
-    from fabric.api import run
-
-    @catchlumericaloutput
-    def ExecuteFSPfilesRemote(
-            fsploc, loc='tinker.ee.ucl.ac.uk', cores=8, nicelvl=-19, verbose=0):
-        '''
-        This will execute all the given fsp files on a remote machine using the
-        _ExecuteFSPfiles_ command above
-        '''
-
-        acmd = "/bin/nice -n {0:.0f} {1}".format(nicelvl,
-                                                 ExecuteFSPfiles(
-                                                     fsploc, cores, execute=False,
-                                                     verbose=verbose))
-
-        return run(acmd)
+@catchlumericaloutput
+def ExecuteFSPfilesRemote(
+        fsploc, loc='tinker.ee.ucl.ac.uk', cores=8, nicelvl=-19, verbose=0):
+    '''
+    This will execute all the given fsp files on a remote machine which sees
+    _fsploc_ at the same path (see _SSHExecutor_)
+    '''
+    with SSHExecutor(loc, cores, shared=True, nice=nicelvl) as executor:
+        stroutput = executor.run(fsploc, cores=cores, verbose=verbose)
 
-except ImportError:
-    print("Fabric is not found, ignoring ...")
+    manifest = findmanifest(fsploc)
+    if manifest is not None:
+        manifest.setstatus([fn[:-len('.fsp')] for fn in os.listdir(fsploc)
+                            if fn.endswith('.fsp')], SweepManifest.SIMULATED)
+    return stroutput
 
 
+@traced(_fspsweeploc)
 def ProcessGenerated(fsploc, outputloc, processingloc,
-                     processingscript, scriptparams={}, verbose=0):
+                     processingscript, scriptparams={}, verbose=0, **kwargs):
     '''
     Apply processing script to fsp file that has successfully run through FDTD-solutions
+
+    Each fsp file is given its own temporary copy of the processing script so
+    several can be processed at once, and by several sweeps at the same time.
+    Files missing from _fsploc_ or whose run the sweep manifest records as
+    failed are skipped, with a warning
+
+    Optional Parameters
+    -------------------
+    max_workers (1) : number of fdtd-solutions processing launches run at once
+    batch_size (1) : number of fsp files processed by each launch. A single
+        driver script loads each file in turn and runs the processing script on
+        it. Should one file fail the rest of its batch is relaunched without it
+    licence_pool (None) : LicencePool of GUI licences shared with other runs
+    keep_scripts (False) : leave the temporary processing scripts (printed
+        when verbose) rather than deleting them
+    binary (False) : matrices the processing script writes as num2str csv
+        files are saved with matlabsave as .mat files instead, which are
+        smaller and memory mapped by _LoadSweep_ (see _binaryoutput_)
+    fspnames (None) : names (without .fsp) of the files to process rather than all of them
+    storage (None) : StoragePolicy deleting or compressing each fsp file once
+        processed, by default the one kept with the sweep (see _ParameterSweepInput_)
+    TimeDelay (10), MaxAttempts (10) : licence retry backoff (see _RetryPolicy_)
+
+    Returns a list of per file results (see _runresult_)
     '''
-    for fspname in os.listdir(fsploc):
-        if not fspname.endswith("fsp"):
-            continue
+    max_workers = kwargs.get('max_workers', 1)
+    batch_size = kwargs.get('batch_size', 1)
+    keep_scripts = kwargs.get('keep_scripts', False)
+    binary = kwargs.pop('binary', False)
+    storage = kwargs.pop('storage', None) or StoragePolicy.find(fsploc)
+
+    fspnames = kwargs.pop('fspnames', None)
+    if fspnames is not None:
+        fspnames = [fspname + '.fsp' for fspname in fspnames]
+    else:
+        fspnames = sorted(fspname for fspname in os.listdir(fsploc) if fspname.endswith("fsp"))
+
+    manifest = findmanifest(fsploc)
+    failed = set(run['name'] + '.fsp' for run in
+                 manifest.runs(status=SweepManifest.FAILED)) if manifest is not None else set()
+    skipped = [fspname for fspname in fspnames if fspname in failed or
+               not os.path.exists(os.path.join(fsploc, fspname))]
+    if skipped:
+        print("Warning :", len(skipped), "fsp files are missing or failed and are skipped :",
+              ", ".join(skipped[:10]) + (", ..." if len(skipped) > 10 else ""))
+        skipped = set(skipped)
+        fspnames = [fspname for fspname in fspnames if fspname not in skipped]
+    tmploc = tempfile.mkdtemp(prefix='pylumerical')
+
+    def process(job, **overrides):
+        i, fspname = job
 
         if verbose > 0:
             print("Processing", fspname)
 
-        variables = dict(
-            {'Savefullpath': os.path.join(outputloc, fspname)}.items() + scriptparams.items())
+        variables = dict([('Savefullpath', os.path.join(outputloc, fspname))] +
+                         list(scriptparams.items()))
 
         if verbose > 0:
             print(variables)
 
-        # cuts off .fsp from filename
-        tmpscript = (processingloc, 'TemporaryScript')
+        tmpscript = (tmploc, 'TemporaryScript{0}'.format(i))
 
         AlterVariables(
             (processingloc,
              processingscript),
             tmpscript,
             variables,
-            verbose=0)
+            verbose=0,
+            binary=binary)
 
         fsp = (fsploc, fspname)
-        Success = ExecuteScriptOnFSP(fsp, tmpscript, verbose=0)
+        with span('process', job=fspname):
+            result = runresult(fspname, lambda fspname: ExecuteScriptOnFSP(
+                fsp, tmpscript, verbose=0, defer=True, **kwargs))
 
         if verbose > 0:
-            print(fspname, "returns with code", Success)
+            print(fspname, "returns with code", result['returncode'])
+
+        return result
+
+    def processbatch(job, **overrides):
+        i, batch = job
+        return _ProcessBatch(fsploc, batch, outputloc, (processingloc, processingscript),
+                             scriptparams, (tmploc, 'TemporaryBatch{0}'.format(i)),
+                             verbose=verbose, binary=binary, **kwargs)
+
+    if batch_size > 1:
+        jobs = list(enumerate(fspnames[i:i + batch_size]
+                              for i in range(0, len(fspnames), batch_size)))
+        work = processbatch
+    else:
+        jobs = [(i, [fspname]) for i, fspname in enumerate(fspnames)]
+        work = lambda job, **overrides: [process((job[0], job[1][0]), **overrides)]
+
+    try:
+        results = [result for (i, batch), batchresults, err in
+                   _threadpool(work, jobs, max_workers,
+                               policy=RetryPolicy.fromkwargs(kwargs),
+                               licences=kwargs.get('licence_pool', None),
+                               verbose=verbose)
+                   for result in (batchresults if err is None else
+                                  [{'fsp': fspname, 'returncode': -1, 'output': "",
+                                    'error': str(err), 'runtime': None}
+                                   for fspname in batch])]
+    finally:
+        if keep_scripts:
+            if verbose > 0:
+                print("Processing scripts kept in", tmploc)
+        else:
+            shutil.rmtree(tmploc, ignore_errors=True)
+
+    if verbose > 0:
+        print(sum(result['returncode'] == 0 for result in results), "of", len(results),
+              "fsp files processed")
+
+    if manifest is not None:
+        for status, succeeded in ((SweepManifest.PROCESSED, True), (SweepManifest.FAILED, False)):
+            manifest.setstatus([result['fsp'][:-len('.fsp')] for result in results
+                                if (result['returncode'] == 0) == succeeded], status)
+
+    if storage is not None:
+        storage.processed(fsploc, [result['fsp'][:-len('.fsp')] for result in results
+                                   if result['returncode'] == 0])
+
+    return results
+
+
+def _ProcessBatch(fsploc, fspnames, outputloc, processing, scriptparams, tmpscript,
+                  verbose=0, binary=False, **kwargs):
+    '''
+    Runs the _processing_ script on every fsp file of _fspnames_ with a single
+    launch, returning a result per file (see _runresult_)
+
+    Each file prints a marker once processed. If the launch stops early the
+    first unmarked file is recorded as failed and the rest are relaunched
+    '''
+    template = CompileLSF(processing)
+    marker = "pylumerical processed "
+
+    results = []
+    remaining = list(fspnames)
+    while remaining:
+        driver = []
+        for fspname in remaining:
+            variables = dict([('Savefullpath', os.path.join(outputloc, fspname))] +
+                             list(scriptparams.items()))
+            driver.append("\n##{0}\nload('{1}');\n".format(
+                fspname, os.path.join(fsploc, fspname)))
+            driver.append(template.render(variables, noexit=True, binary=binary))
+            driver.append('\n?"{0}{1}";\n'.format(marker, fspname))
+        driver.append("exit(2);\n")
+
+        with open(os.path.join(tmpscript[0], tmpscript[1] + '.lsf'), 'w') as newlsf:
+            newlsf.write("".join(driver))
+
+        if verbose > 0:
+            print("Processing", len(remaining), "fsp files in", tmpscript[1])
+
+        def runbatch(name, **overrides):
+            try:
+                return ExecuteScriptOnFSP((fsploc, remaining[0]), tmpscript,
+                                          verbose=0, defer=True, **kwargs)
+            except Deferred:
+                raise
+            except LumericalError as err:
+                return err.value  # markers show how far the batch got
+
+        with span('process batch', job=tmpscript[1], files=len(remaining)):
+            batchresult = runresult(tmpscript[1], runbatch)
+        stroutput = batchresult['output'] or ""
+
+        processed = set(aline.strip()[len(marker):] for aline in stroutput.splitlines()
+                        if aline.strip().startswith(marker))
+
+        for fspname in remaining:
+            if fspname not in processed:
+                break
+            results.append(dict(batchresult, fsp=fspname, returncode=0, error=None))
+        else:
+            break
+
+        failed = remaining.index(fspname)
+        results.append(dict(batchresult, fsp=fspname,
+                            returncode=batchresult['returncode'] or -1,
+                            error=batchresult['error'] or "processing stopped in batch"))
+        if verbose > 0:
+            print(fspname, "failed within batch", tmpscript[1])
+        remaining = remaining[failed + 1:]
+
+    return results
+
+
+@traced(_sweeploc)
+def RunSweep(workingdir, keyword, newparams, defaultparams, script, processing,
+             scriptparams={}, verbose=0, **kwargs):
+    '''
+    Generates, simulates and processes a parameter sweep as a pipeline
+
+    Each sweep point is simulated as soon as its fsp file has been generated
+    and processed as soon as it has been simulated (see _RunPipeline_), rather
+    than each stage waiting for the whole sweep to finish the one before as
+    with _ParameterSweepInput_, _ExecuteFSPfiles_ and _ProcessGenerated_ in
+    turn. Each stage has its own concurrency limit.
+
+    Required Parameters
+    -------------------
+    as _ParameterSweepInput_, plus
+    processing : (processingloc, processingscript) run on each fsp file (see _ProcessGenerated_)
+
+    Optional Parameters
+    -------------------
+    max_workers (1) : fdtd-solutions generator processes run at once
+    batch_size (1) : sweep points built by each generator launch
+    cores (8) : engine cores shared between the simulations
+        jobs (1) : simulations run at once, each with cores // jobs cores
+    process_workers (max_workers) : fdtd-solutions processing launches run at once
+    binary (False) : save processed matrices as .mat files (see _ProcessGenerated_)
+    licences (None) : number of GUI licences shared by generation and
+        processing (alias : licence_pool, a LicencePool shared with other runs)
+    engine_licence_pool (None) : LicencePool of engine licences
+    storage (None) : StoragePolicy of the sweep (see _ParameterSweepInput_).
+        While the sweep is over budget no new point is generated until
+        processing has freed space, and IOError (ENOSPC) is raised should
+        nothing under way be able to free any
+    delete_fsp (False) : delete each fsp file once it has been processed, as
+        storage=StoragePolicy(fsp='delete')
+    resume (True) : skip points the manifest records as processed and carry
+        on from the last stage of points generated or simulated by an earlier call
+    progress (None), TimeDelay (10), MaxAttempts (10) : see _ExecuteFSPfiles_
+    Any other keyword is passed to _ParameterSweepInput_ (e.g. sampler,
+    short_names, shard, chunk_size, precision and deduplicate). cache_dir is not used.
+
+    Returns fsploc and outputloc as _ParameterSweepInput_. Failed points are
+    marked in the sweep manifest (see _QueryRuns_)
+    '''
+    max_workers = kwargs.get('max_workers', 1)
+    batch_size = kwargs.get('batch_size', 1)
+    cores = kwargs.pop('cores', 8)
+    jobs = kwargs.pop('jobs', 1)
+    process_workers = kwargs.pop('process_workers', max_workers)
+    delete_fsp = kwargs.pop('delete_fsp', False)
+    storage = kwargs.pop('storage', None)
+    resume = kwargs.pop('resume', True)
+    engine_licence_pool = kwargs.pop('engine_licence_pool', None)
+    licence_pool = kwargs.pop('licence_pool', None)
+    if licence_pool is None and kwargs.get('licences', None) is not None:
+        licence_pool = LicencePool(kwargs['licences'])
+    policy = RetryPolicy.fromkwargs(kwargs)
+
+    lsfloc, fsploc, dataloc, lsffiles, swept = _PrepareSweep(
+        workingdir, keyword, newparams, defaultparams, verbose=verbose, **kwargs)
+    sweeploc = os.path.join(workingdir, keyword)
+    manifest = SweepManifest(sweeploc)
+    if storage is not None:
+        storage.save(sweeploc)
+    else:
+        storage = StoragePolicy.find(sweeploc) or StoragePolicy()
+    if delete_fsp:
+        storage.fsp = 'delete'
+    status = dict((run['name'], run['status']) for run in manifest.runs()) if resume else {}
+    fspfile = lambda fspname: os.path.join(fsploc, fspname + '.fsp')
+    made = lambda fspname: (status.get(fspname) in (SweepManifest.GENERATED,
+                                                     SweepManifest.SIMULATED)
+                            and os.path.exists(fspfile(fspname)))
+
+    def points():
+        kept = {}  # digest : name of the points of earlier chunks
+        for chunk, sweep in enumerate(lsffiles.chunks(kwargs.get('chunk_size', 10000))):
+            if kwargs.get('short_names', False):
+                sweep = [[runid(parameters), parameters] for lsfname, parameters in sweep]
+            sweep = [point for point in sweep
+                     if status.get(point[0]) != SweepManifest.PROCESSED]
+            if kwargs.get('deduplicate', True):
+                sweep = _Deduplicate(manifest, sweep, swept, known=status, kept=kept,
+                                     verbose=verbose)
+            else:
+                manifest.add([(runid(parameters), lsfname, parameters)
+                              for lsfname, parameters in sweep if lsfname not in status],
+                             swept=swept)
+
+            for i in range(0, len(sweep), batch_size):
+                yield ("batch_{0}_{1}".format(chunk, i // batch_size), sweep[i:i + batch_size])
+
+    def generate(job, **overrides):
+        batchname, batch = job
+        togenerate = [point for point in batch if not made(point[0])]
+        try:
+            if len(togenerate) == 1:
+                _GeneratePoint(script, lsfloc, fsploc, *togenerate[0], verbose=verbose, **kwargs)
+            elif togenerate:
+                _GenerateBatch(script, lsfloc, fsploc, batchname, togenerate, verbose=verbose,
+                               **kwargs)
+        except Deferred:
+            raise
+        except (ValueError, LumericalError) as err:  # the points not saved are marked as failed
+            if verbose > 0:
+                print(err)
+
+        fspnames = [lsfname for lsfname, parameters in togenerate]
+        saved = [fspname for fspname in fspnames if os.path.exists(fspfile(fspname))]
+        manifest.setstatus(saved, SweepManifest.GENERATED)
+        manifest.setstatus([fspname for fspname in fspnames
+                            if not os.path.exists(fspfile(fspname))], SweepManifest.FAILED)
+        storage.generated(lsfloc, saved + ([batchname] if len(saved) > 1 and
+                                           len(saved) == len(fspnames) else []))
+        return [lsfname for lsfname, parameters in batch if os.path.exists(fspfile(lsfname))]
+
+    def simulate(fspname, cores=max(1, cores // jobs)):
+        if status.get(fspname) == SweepManifest.SIMULATED and made(fspname):
+            return [fspname]
+
+        with span('simulate', job=fspname, cores=cores) as jobspan:
+            result = runresult(fspname, lambda fspname: _ExecuteFSPfiles(
+                fsploc, cores, fspnames=[fspname], verbose=verbose, defer=True,
+                progress=kwargs.get('progress', None)))
+            jobspan.args['returncode'] = result['returncode']
+
+        if verbose > 0:
+            print(fspname, "simulated with code", result['returncode'])
+        succeeded = result['returncode'] == 0
+        manifest.setstatus([fspname], SweepManifest.SIMULATED if succeeded else
+                           SweepManifest.FAILED)
+        return [fspname] if succeeded else []
+
+    tmploc = tempfile.mkdtemp(prefix='pylumerical')
+    scripts = itertools.count()
+
+    def process(fspname, **overrides):
+        variables = dict([('Savefullpath', os.path.join(dataloc, fspname + '.fsp'))] +
+                         list(scriptparams.items()))
+        tmpscript = (tmploc, 'TemporaryScript{0}'.format(next(scripts)))
+        AlterVariables(processing, tmpscript, variables, verbose=0,
+                       binary=kwargs.get('binary', False))
+
+        with span('process', job=fspname):
+            result = runresult(fspname, lambda fspname: ExecuteScriptOnFSP(
+                (fsploc, fspname + '.fsp'), tmpscript, verbose=0, defer=True, **kwargs))
+        os.remove(os.path.join(tmploc, tmpscript[1] + '.lsf'))
+
+        if verbose > 0:
+            print(fspname, "processed with code", result['returncode'])
+        succeeded = result['returncode'] == 0
+        manifest.setstatus([fspname], SweepManifest.PROCESSED if succeeded else
+                           SweepManifest.FAILED)
+        if succeeded:
+            storage.processed(fsploc, [fspname])
+        return []
+
+    stages = [Stage('generate', generate, max_workers, policy, licence_pool),
+              Stage('simulate', simulate, jobs, policy, engine_licence_pool),
+              Stage('process', process, process_workers, policy, licence_pool)]
+    try:
+        failures = RunPipeline(stages, points(), verbose=verbose,
+                               throttle=lambda busy: storage.wait(sweeploc, busy, verbose))
+    finally:
+        shutil.rmtree(tmploc, ignore_errors=True)
+
+    for job, err in failures['generate']:  # retries exhausted
+        manifest.setstatus([lsfname for lsfname, parameters in job[1]], SweepManifest.FAILED)
+    manifest.setstatus([fspname for stage in ('simulate', 'process')
+                        for fspname, err in failures[stage]], SweepManifest.FAILED)
+
+    if verbose > 0:
+        print(len(manifest.runs(status=SweepManifest.PROCESSED)), "points processed,",
+              len(manifest.runs(status=SweepManifest.FAILED)), "failed")
+
+    return fsploc, dataloc
+
+
+@traced(_sweeploc)
+def AdaptiveParameterSweep(workingdir, keyword, newparams, defaultparams, script, processing,
+                           metric, scriptparams={}, verbose=0, **kwargs):
+    '''
+    Runs a coarse sweep (see _ParameterSweepInput_) through generation,
+    simulation and processing then adds points where the results change the
+    most, repeating for a number of rounds
+
+    Each round the processed outputs are loaded (see _LoadSweep_) and _metric_
+    is called with {quantity : array} of every point. New points bisect the
+    intervals between neighbouring points, along grid lines or to the nearest
+    sampled point, with the largest change in metric (see _refinesweep_).
+    Only new points are simulated and processed.
+
+    Required Parameters
+    -------------------
+    processing : (processingloc, processingscript) run on each fsp file (see _ProcessGenerated_)
+    metric : function of a point's outputs returning a number
+
+    Optional Parameters
+    -------------------
+    rounds (3) : number of refinement rounds after the coarse sweep
+    refine (10) : number of points added each round
+    cores (8), jobs (None), cache_dir (None) : passed to _ExecuteFSPfiles_
+    Any other keyword is passed to _ParameterSweepInput_ and _ProcessGenerated_
+    (e.g. sampler and samples for a space filling coarse sweep)
+
+    Returns fsploc and outputloc as _ParameterSweepInput_
+    '''
+    from .processingoutput import LoadSweep  # numpy and pandas are only needed here
+
+    rounds = kwargs.pop('rounds', 3)
+    refine = kwargs.pop('refine', 10)
+    cores = kwargs.pop('cores', 8)
+    execute = dict((key, kwargs[key]) for key in
+                   ('jobs', 'resume', 'cache_dir', 'cache_size', 'progress', 'TimeDelay',
+                    'MaxAttempts') if key in kwargs)
+
+    for refinement in range(rounds + 1):
+        fsploc, outputloc = ParameterSweepInput(workingdir, keyword, newparams, defaultparams,
+                                                script, verbose=verbose, **kwargs)
+        kwargs['delete_existing_files'] = False
+
+        manifest = findmanifest(fsploc)
+        fspnames = [run['name'] for run in manifest.runs(status=SweepManifest.GENERATED)]
+        ExecuteFSPfiles(fsploc, cores, verbose=verbose, fspnames=fspnames, **execute)
+        ProcessGenerated(fsploc, outputloc, processing[0], processing[1], scriptparams,
+                         verbose=verbose, fspnames=fspnames, **kwargs)
+
+        if refinement == rounds:
+            break
+
+        data = LoadSweep(outputloc, verbose=verbose)
+        index = dict((name, i) for i, name in enumerate(data.names))
+        runs = [run for run in manifest.runs(status=SweepManifest.PROCESSED, swept_only=True,
+                                             aliases=True)
+                if run['name'] in index]
+        values = [metric(dict((quantity, data[quantity][index[run['name']]])
+                              for quantity in data.quantities))
+                  for run in runs]
+
+        kwargs['points'] = refinesweep([run['parameters'] for run in runs], values, refine)
+        if verbose > 0:
+            print("Refinement", refinement + 1, "adds", len(kwargs['points']), "points")
+        if not kwargs['points']:
+            break
+
+    return fsploc, outputloc
+
+
+@traced(_sweeploc)
+def OptimiseParameters(workingdir, keyword, newparams, defaultparams, script, processing,
+                       metric, scriptparams={}, verbose=0, **kwargs):
+    '''
+    Minimises _metric_ over the parameters of _newparams_ with CMA-ES (see
+    _CMAES_), evaluating each population of candidates as one sweep through
+    generation, simulation and processing
+
+    newparams gives each parameter as a (low, high) tuple (integers if both
+    are ints) or a list of choices. Every evaluation is memoised by run ID in
+    the sweep manifest, so candidates which round (see _precision_) onto a
+    point already processed, in this or an earlier call, are never rerun.
+
+    Required Parameters
+    -------------------
+    processing : (processingloc, processingscript) run on each fsp file (see _ProcessGenerated_)
+    metric : function of a point's outputs {quantity : array} returning the
+        number minimised (negate it to maximise)
+
+    Optional Parameters
+    -------------------
+    generations (20) : maximum number of populations evaluated
+    population (None) : candidates per population. Defaults to the CMA-ES size
+        rounded up to a multiple of max_workers (or jobs) so each batch fills
+        the available licences or cores
+    start (None) : {parameter : value} of the starting point (default : centre)
+    sigma (0.3) : starting step size as a fraction of each range
+    tolerance (1e-3) : stop once the step size falls below this fraction
+    precision (6) : significant figures continuous parameters are rounded to
+    seed (None) : random seed
+    cores (8), jobs (None), cache_dir (None) : passed to _ExecuteFSPfiles_
+    Any other keyword is passed to _ParameterSweepInput_ and _ProcessGenerated_
+
+    Returns (best parameters, best value, [(parameters, value) for every
+    candidate in the order evaluated])
+    '''
+    from .optimise import CMAES, candidatepoint, unitposition  # numpy is only needed here
+
+    generations = kwargs.pop('generations', 20)
+    tolerance = kwargs.pop('tolerance', 1e-3)
+    precision = kwargs.pop('precision', 6)
+    cores = kwargs.pop('cores', 8)
+    execute = dict((key, kwargs[key]) for key in
+                   ('jobs', 'resume', 'cache_dir', 'cache_size', 'progress', 'TimeDelay',
+                    'MaxAttempts') if key in kwargs)
+
+    newparams = [(name, values) for name, values in newparams]
+
+    workers = max(kwargs.get('max_workers', kwargs.get('licences', 1)),
+                  kwargs.get('jobs', None) or 1)
+    population = kwargs.pop('population', None)
+    if population is None:
+        population = 4 + int(3 * math.log(len(newparams)))
+        population = -(-population // workers) * workers
+
+    start = kwargs.pop('start', None)
+    if start is not None:
+        start = unitposition(newparams, start)
+
+    strategy = CMAES(len(newparams), population=population, mean=start,
+                     sigma=kwargs.pop('sigma', 0.3), seed=kwargs.pop('seed', None))
+
+    lsfloc, fsploc, outputloc = SetupEnvironment(
+        workingdir, keyword, verbose=verbose,
+        delete_existing_files=kwargs.pop('delete_existing_files', False))
+    manifest = SweepManifest(os.path.join(workingdir, keyword))
+    kwargs.setdefault('short_names', True)
+
+    memo = _memoised(manifest, {}, outputloc, metric, verbose)  # run_id : metric
+    evaluations = []
+    for generation in range(generations):
+        candidates = strategy.ask()
+        points = [candidatepoint(newparams, candidate, precision) for candidate in candidates]
+        keys = [runid(lsftogenerate(point, defaultparams, PRECISION)[1])  # as _PrepareSweep_
+                for point in points]
+
+        torun = dict((key, point) for key, point in zip(keys, points) if key not in memo)
+        if torun:
+            try:
+                ParameterSweepInput(workingdir, keyword, newparams, defaultparams, script,
+                                    verbose=verbose, points=list(torun.values()), **kwargs)
+            except ValueError as err:  # failed points are marked in the manifest
+                if verbose > 0:
+                    print(err)
+
+            fspnames = [run['name'] for run in manifest.runs(status=SweepManifest.GENERATED)]
+            if fspnames:
+                ExecuteFSPfiles(fsploc, cores, verbose=verbose, fspnames=fspnames, **execute)
+                ProcessGenerated(fsploc, outputloc, processing[0], processing[1], scriptparams,
+                                 verbose=verbose, fspnames=fspnames, **kwargs)
+
+            memo.update(_memoised(manifest, memo, outputloc, metric, verbose))
+            for key in torun:
+                memo.setdefault(key, float('inf'))  # failed to generate, simulate or process
+
+        values = [memo[key] for key in keys]
+        evaluations += list(zip(points, values))
+        strategy.tell(candidates, values)
+
+        if verbose > 0:
+            print("Generation", generation + 1, "evaluated", len(torun), "new points, best",
+                  min(value for point, value in evaluations))
+
+        if strategy.spread() < tolerance:
+            break
+
+    best, value = min(evaluations, key=lambda evaluation: evaluation[1])
+    return best, value, evaluations
+
+
+def _memoised(manifest, memo, outputloc, metric, verbose=0):
+    '''
+    Returns {run_id : metric} of the processed runs missing from _memo_
+    '''
+    from .processingoutput import LoadSweep
+
+    runs = [run for run in manifest.runs(status=SweepManifest.PROCESSED, aliases=True)
+            if run['run_id'] not in memo]
+    if not runs or not os.path.isdir(outputloc):
+        return {}
+
+    data = LoadSweep(outputloc, verbose=verbose)
+    index = dict((name, i) for i, name in enumerate(data.names))
+    return dict((run['run_id'], float(metric(dict((quantity, data[quantity][index[run['name']]])
+                                                  for quantity in data.quantities))))
+                for run in runs if run['name'] in index)
 
 
 def SetupEnvironment(
         workingdir, akeyword, verbose=0, delete_existing_files=False):
     '''
     Creates input, processing and output folders
+
+    With _delete_existing_files_ the files of a previous sweep are deleted,
+    its manifest and storage policy included
     '''
     keyword = lambda adir: os.path.join(akeyword, adir)
     lsfloc = full(workingdir, keyword('input'), verbose=verbose)  # input
@@ -347,7 +1390,16 @@ def SetupEnvironment(
         print("Deleting pre-existing files in: .lsf, .fsp and .csv directories:")
         for directory in [lsfloc, fsploc, dataloc]:
             for existing_file in os.listdir(directory):
-                os.remove(os.path.join(directory, existing_file))
+                if os.path.isdir(os.path.join(directory, existing_file)):  # e.g. SweepAggregator's
+                    shutil.rmtree(os.path.join(directory, existing_file))
+                else:
+                    os.remove(os.path.join(directory, existing_file))
+                print("\t", existing_file, " DELETED")
+
+        sweeploc = os.path.join(workingdir, akeyword)
+        for existing_file in (MANIFEST, MANIFEST + '-journal', POLICY):
+            if os.path.exists(os.path.join(sweeploc, existing_file)):
+                os.remove(os.path.join(sweeploc, existing_file))
                 print("\t", existing_file, " DELETED")
 
     return lsfloc, fsploc, dataloc
@@ -370,59 +1422,11 @@ def GenerateParameterSweepDictionary(newparams, defaultparams, verbose=0):
     '''
     This will return the dictionary ready for insertion into the lsf file
     newparms should have have format [(parameter_name1, values1),(parameter_name2, values2),...]
-    '''
-    names, parameters = zip(*newparams)
-    
-    newparamdict = [dict(zip(names, item)) 
-                    for item in itertools.product(*parameters)]
-    
-    return ([lsftogenerate(override, defaultparams) for override in newparamdict])
-
 
-def _uniquedictstring(adict):
+    The sweep is returned as a ParameterSweep, a lazy sequence of
+    [uniquename, parameters] pairs which is only expanded as it is iterated
     '''
-    Turns dictionary into unique name
-    '''
-    uniquename = "_".join("{0}={1}".format(key, data)
-                          for key, data in adict.iteritems())
-    return uniquename.replace('.', ',')
-
-
-def lsftogenerate(newparams, defaultparams):
-    '''
-    Returns dict of parameters along with unique name determined by given parameters
-    '''
-    uniquename = _uniquedictstring(newparams)
-
-    newparams = dict(defaultparams.items() + newparams.items())
-    return [uniquename, newparams]
-
-# /typecast##
-# http://stackoverflow.com/questions/7019283/automatically-type-cast-parameters-in-python
-
-
-def __boolify(astr):
-    '''
-    String to Bool
-    '''
-    if astr == 'True' or astr == 'true':
-        return True
-    if astr == 'False' or astr == 'false':
-        return False
-    raise ValueError('Not Boolean Value!')
-
-
-def estimateType(var):
-    '''guesses the str representation of the variables type'''
-    var = str(var)  # important if the parameters aren't strings...
-    for caster in (__boolify, int, float):
-        try:
-            return caster(var)
-        except ValueError:
-            pass
-    return var
-
-# /typecast##
+    return ParameterSweep(newparams, defaultparams)
 
 
 def GetCurrentParameters(root, verbose=0, **kwargs):
@@ -436,7 +1440,10 @@ def GetCurrentParameters(root, verbose=0, **kwargs):
 
     params = []
     invar = False
-    for i, aline in enumerate(open(os.path.join(rootloc, rootname + '.lsf'), 'r')):
+    with open(os.path.join(rootloc, rootname + '.lsf'), 'r') as rootlsf:
+        lines = rootlsf.readlines()
+
+    for i, aline in enumerate(lines):
         for achar in unwanted:
             aline = aline.replace(achar, '')
         if verbose > 1:  # prints full output
@@ -453,59 +1460,38 @@ def GetCurrentParameters(root, verbose=0, **kwargs):
             params.append(aline.split(' = '))
 
 
-def _GeneratenewLSF(root, lsf, variables, verbose=0):
+def _GeneratenewLSF(root, lsf, variables, verbose=0, newlsf=None):
     '''
     Updates parameters in variable section and returns new file
 
+    If _newlsf_ is an open file the script is appended to it instead
+
     If this function is called by the user,  they must close __newlsf__!!
     '''
-    rootloc, rootname = root
     lsfloc, lsfname = lsf
 
-    (lmin, lmax), params = GetCurrentParameters(root, verbose=verbose)
-    newlsf = open(os.path.join(lsfloc, lsfname + '.lsf'), 'w')
-    for i, aline in enumerate(open(os.path.join(rootloc, rootname + '.lsf'), 'r')):
-        if i < lmin or i > lmax:  # outside range write original file as usual
-            newlsf.write(aline)
-            continue
-
-        if verbose > 1:
-            print("line : variable : new line")
-        for j, akey in enumerate(variables):
-            if isinstance(variables[akey], bool):  # Type casts for Lumerical
-                aparam = int(variables[akey])
-            elif isinstance(variables[akey], str):
-                aparam = "'" + variables[akey] + "'"
-            elif isinstance(variables[akey], int):
-                aparam = int(variables[akey])
-            elif isinstance(variables[akey], float):
-                aparam = float(variables[akey])
-            else:
-                if verbose > 0:
-                    print("unknown type!", type(variables[akey]))
-                aparam = "'" + variables[akey] + "'"
-                # TODO make code work properly with python3 unicode
-
-            newline = akey + " = " + str(aparam) + ";\n"
-            if verbose > 0:
-                print(i, ":", j, ":", newline, end="")
-            newlsf.write(newline)
-        newlsf.write('#</variables>#\n')
+    template = CompileLSF(root, verbose=verbose)
+    if newlsf is None:
+        newlsf = open(os.path.join(lsfloc, lsfname + '.lsf'), 'w')
+    newlsf.write(template.render(variables, verbose=verbose))
 
     return newlsf
 
 
-def AlterVariables(root, lsf, variables, verbose=0):
+@traced()
+def AlterVariables(root, lsf, variables, verbose=0, binary=False):
     '''
     Alter parameters of existing lsf file and add new variables only
     old variables WILL be removed
+
+    _binary_ saves num2str matrices as .mat files instead (see _binaryoutput_)
     '''
 
-    newlsf = _GeneratenewLSF(root, lsf, variables, verbose=verbose)
-    newlsf.write("exit(2);\n")
-    newlsf.close()
+    CompileLSF(root, verbose=verbose).write(lsf, variables, "exit(2);\n", verbose=verbose,
+                                            binary=binary)
 
 
+@traced()
 def GenerateLSFinput(root, lsf, fsp, variables, verbose=0, **kwargs):
     '''
     Generates new lsf file in _lsfloc_ with name _lsfname_ using the original
@@ -518,9 +1504,6 @@ def GenerateLSFinput(root, lsf, fsp, variables, verbose=0, **kwargs):
     rootloc, rootname = root
     fsploc, fspname = fsp
 
-    moviefps = kwargs.get('moviefps', 60);
-    moviezoom = kwargs.get('moviezoom', 1);  
-
     #scriptloc, scriptname = script
 
     if not os.path.exists(rootloc):
@@ -531,14 +1514,58 @@ def GenerateLSFinput(root, lsf, fsp, variables, verbose=0, **kwargs):
         print("lsf location doesn't exist!")
         return
 
-    newlsf = _GeneratenewLSF(root, lsf, variables, verbose=verbose)
-    newlsf.write("\ncd('" + fsploc + "');\n")
-    newlsf.write("save('" + fspname + "');\n")
+    template = CompileLSF(root, verbose=verbose)
+    template.write(lsf, variables, _fspepilogue(lsfname, fsp, **kwargs) + "exit(2);\n",
+                   verbose=verbose)
+
+
+@traced()
+def GenerateBatchLSFinput(root, lsf, fsploc, lsffiles, verbose=0, **kwargs):
+    '''
+    Generates a single driver lsf file in _lsfloc_ with name _lsfname_ which
+    builds and saves every (fspname, variables) pair of _lsffiles_ in turn
+
+    When executed one fdtd-solutions launch saves every fsp binary into _fsploc_
+    '''
+
+    lsfloc, lsfname = lsf
+    rootloc, rootname = root
+
+    if not os.path.exists(rootloc):
+        print("Root location doesn't exist!")
+        return
+
+    if not os.path.exists(lsfloc):
+        print("lsf location doesn't exist!")
+        return
+
+    template = CompileLSF(root, verbose=verbose)
+    driver = []
+    for fspname, variables in lsffiles:
+        driver.append("\n##{0}\ndeleteall;\n".format(fspname))
+        driver.append(template.render(variables, verbose=verbose))
+        driver.append(_fspepilogue(fspname, (fsploc, fspname), **kwargs))
+    driver.append("exit(2);\n")
+
+    with open(os.path.join(lsfloc, lsfname + '.lsf'), 'w') as newlsf:
+        newlsf.write("".join(driver))
+
+
+def _fspepilogue(lsfname, fsp, **kwargs):
+    '''
+    Returns the lsf commands which save the generated simulation as _fsp_
+    '''
+    fsploc, fspname = fsp
+
+    moviefps = kwargs.get('moviefps', 60)
+    moviezoom = kwargs.get('moviezoom', 1)
+
+    epilogue = "\ncd('" + fsploc + "');\n"
+    epilogue += "save('" + fspname + "');\n"
 
     if kwargs.get('generate_movie_of_setup', False):
-        newlsf.write('select("FDTD");\n')
-        newlsf.write('setview("extent");\n')
-        newlsf.write("orbit("'{0}, {1}, "{2}");\n'.format(moviezoom, moviefps, lsfname+"_input"))
+        epilogue += 'select("FDTD");\n'
+        epilogue += 'setview("extent");\n'
+        epilogue += "orbit("'{0}, {1}, "{2}");\n'.format(moviezoom, moviefps, lsfname+"_input")
 
-    newlsf.write("exit(2);\n")
-    newlsf.close()
+    return epilogue
@@ -0,0 +1,266 @@
+'''
+Licence aware retries of Lumerical launches
+
+Description : FDTD-Solutions reports licence exhaustion and impossible
+processor layouts in its output. Launches which fail this way are retried
+with exponential backoff. When jobs run through a RetryQueue the retry is
+deferred onto the queue, so the worker thread moves on to other jobs rather
+than sleeping while it waits for a licence.
+'''
+
+from __future__ import division, print_function
+import heapq
+import random
+import threading
+import time
+from .tracing import count, record
+
+INVALID = "Error: "
+NOLAYOUT = "There is no possible parallel processor layout"
+FLEXNET = "Unable to check out a FlexNet license"
+
+
+class LumericalError(Exception):
+    '''
+    Whenever Lumerical FDTD-Solutions throws a (known) wobbler that we cannot
+    solve, this error will be raised. Unknown errors cannot be caught as there
+    is no known list of errors to compare to (fun right?!)
+    '''
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class Deferred(LumericalError):
+    '''
+    Raised instead of retrying in place when a launch is called with defer=True
+    '''
+
+
+class LicenceUnavailable(Deferred):
+    '''
+    Every FlexNet licence is currently checked out
+    '''
+
+
+class NoProcessorLayout(Deferred):
+    '''
+    The engine cannot split the simulation over the requested cores
+    '''
+
+
+def classifyoutput(stroutput):
+    '''
+    Returns the known failure (INVALID, NOLAYOUT or FLEXNET) reported in
+    _stroutput_, or None
+    '''
+    if isinstance(stroutput, bytes):
+        stroutput = stroutput.decode('utf-8', 'replace')
+
+    for failure in (INVALID, NOLAYOUT, FLEXNET):
+        if failure in stroutput:
+            return failure
+
+
+class RetryPolicy(object):
+    '''
+    Exponential backoff with jitter
+
+    Optional Parameters
+    -------------------
+    max_attempts (10) : number of retries before giving up
+    delay (10) : seconds waited before the first retry, doubled on each retry
+    max_delay (600) : longest wait between retries in seconds
+    jitter (0.25) : fractional spread of each wait, stops jobs retrying in step
+    '''
+
+    def __init__(self, max_attempts=10, delay=10, max_delay=600, jitter=0.25):
+        self.max_attempts = max_attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    @classmethod
+    def fromkwargs(cls, kwargs):
+        '''
+        Policy from the TimeDelay and MaxAttempts keywords used by the launchers
+        '''
+        return cls(max_attempts=kwargs.get('MaxAttempts', 10),
+                   delay=kwargs.get('TimeDelay', 10))
+
+    def backoff(self, attempt):
+        '''
+        Seconds to wait before retry number _attempt_ (starting at 1)
+        '''
+        wait = min(self.max_delay, self.delay * 2 ** (attempt - 1))
+        return wait * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class LicencePool(object):
+    '''
+    Semaphore of _licences_ shared by every job needing the same licence type
+    '''
+
+    def __init__(self, licences):
+        self.licences = licences
+        self._semaphore = threading.BoundedSemaphore(licences)
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._semaphore.release()
+
+
+class _NoPool(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class RetryQueue(object):
+    '''
+    Runs jobs on _workers_ threads. A job which cannot check out a licence is
+    put back on the queue to be retried after its backoff while the worker
+    carries on with other jobs. A job with no parallel processor layout is
+    requeued at once with the override cores=1.
+
+    Optional Parameters
+    -------------------
+    policy (RetryPolicy()) : backoff and maximum number of retries
+    licences (None) : LicencePool held by each job while it runs
+    '''
+
+    def __init__(self, workers=1, policy=None, licences=None, verbose=0):
+        self.workers = max(1, workers)
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.licences = licences if licences is not None else _NoPool()
+        self.verbose = verbose
+
+    def run(self, work, jobs, done=None):
+        '''
+        Calls _work_(job, **overrides) for every job, returning a list of
+        (job, result, error) in the order of _jobs_
+
+        _jobs_ is read lazily by one worker at a time so it may block until
+        its next job is ready (see _RunPipeline_). _done_(job, result, error)
+        is called as each job finishes. An error raised by _jobs_ or _done_
+        stops every worker once its current job is done and is raised here
+        '''
+        source = enumerate(jobs)
+        exhausted = [False]
+        pulling = [False]  # a worker is waiting on _jobs_
+        deferred = []  # heap of (ready time, index, job, attempt, overrides, deferred at)
+        active = [0]
+        results = {}
+        failed = []  # error raised by _jobs_ or _done_
+        condition = threading.Condition()
+
+        def nextjob():
+            while True:
+                with condition:
+                    now = time.time()
+                    if failed:
+                        return None
+                    if deferred and deferred[0][0] <= now:
+                        active[0] += 1
+                        return heapq.heappop(deferred)
+                    if not exhausted[0] and not pulling[0]:
+                        pulling[0] = True
+                    elif exhausted[0] and not deferred and active[0] == 0:
+                        condition.notify_all()
+                        return None
+                    else:
+                        condition.wait(deferred[0][0] - now if deferred else None)
+                        continue
+
+                try:
+                    i, job = next(source)
+                except StopIteration:
+                    with condition:
+                        exhausted[0], pulling[0] = True, False
+                        condition.notify_all()
+                    continue
+                except Exception as err:
+                    with condition:
+                        exhausted[0], pulling[0] = True, False
+                        failed.append(err)
+                        condition.notify_all()
+                    return None
+
+                with condition:
+                    pulling[0] = False
+                    active[0] += 1
+                    condition.notify_all()
+                return (time.time(), i, job, 1, {}, None)
+
+        def worker():
+            while True:
+                entry = nextjob()
+                if entry is None:
+                    return
+
+                readytime, i, job, attempt, overrides, deferredat = entry
+                if deferredat is not None:
+                    record('licence wait', deferredat, time.time() - deferredat, 'wait',
+                           job=str(job), attempt=attempt)
+                outcome = requeue = None
+                try:
+                    with self.licences:
+                        outcome = (job, work(job, **overrides), None)
+                except LicenceUnavailable as err:
+                    if attempt > self.policy.max_attempts:
+                        outcome = (job, None, LumericalError(
+                            "maximum number of attempts reached, stopping"))
+                    else:
+                        wait = self.policy.backoff(attempt)
+                        if self.verbose > 0:
+                            print("Lumerical licence not currently available on run",
+                                  attempt, "retrying in {0:.0f}s".format(wait))
+                        count('licence retries')
+                        requeue = (time.time() + wait, i, job, attempt + 1, overrides,
+                                   time.time())
+                except NoProcessorLayout as err:
+                    if overrides.get('cores') == 1:
+                        outcome = (job, None, err)
+                    else:
+                        if self.verbose > 0:
+                            print("No Possible layout, executing again with single core")
+                        count('layout retries')
+                        requeue = (time.time(), i, job, attempt, dict(overrides, cores=1), None)
+                except Exception as err:
+                    outcome = (job, None, err)
+
+                stopped = None
+                if requeue is None and done is not None:
+                    try:
+                        done(*outcome)  # while still active so run can't return first
+                    except Exception as err:
+                        stopped = err
+
+                with condition:
+                    if stopped is not None:
+                        failed.append(stopped)
+                    active[0] -= 1
+                    if requeue is not None:
+                        heapq.heappush(deferred, requeue)
+                    else:
+                        results[i] = outcome
+                    condition.notify_all()
+
+        threads = [threading.Thread(target=worker) for n in range(self.workers - 1)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        worker()
+        for thread in threads:
+            thread.join()
+
+        if failed:
+            raise failed[0]
+        return [results[i] for i in sorted(results)]
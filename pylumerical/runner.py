@@ -0,0 +1,142 @@
+'''
+Streaming execution of Lumerical commands
+
+Description : Commands are run with their output read line by line rather
+than buffered until exit. Percent complete and auto shutoff lines from the
+engine are passed to a progress callback as they arrive, and a run reporting
+a known error (see _classifyoutput_) is killed at once rather than left to
+finish.
+
+The engine span recorded for a tracer (see _tracing_) holds the peak memory
+and CPU time of the command and every process it waited for, which are also
+kept for the thread that ran it (see _lastusage_).
+'''
+
+from __future__ import division, print_function
+from subprocess import Popen, PIPE, STDOUT, CalledProcessError
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from .retry import classifyoutput
+from .tracing import span, record
+
+_usage = threading.local()  # resources of the last command run by each thread
+
+PERCENT = re.compile(r'(\d+(?:\.\d+)?)\s*%\s*complete', re.IGNORECASE)
+SHUTOFF = re.compile(r'auto\s*shutoff\s*:?\s*([-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)',
+                     re.IGNORECASE)
+
+
+def parseprogress(aline):
+    '''
+    Returns {'percent' : float, 'shutoff' : float or None} from an engine
+    progress line, or None if _aline_ reports no progress
+    '''
+    percent = PERCENT.search(aline)
+    shutoff = SHUTOFF.search(aline)
+    if percent is None and shutoff is None:
+        return None
+
+    return {'percent': float(percent.group(1)) if percent else None,
+            'shutoff': float(shutoff.group(1)) if shutoff else None}
+
+
+def RunCommand(command, progress=None, kill_on_error=True, verbose=0):
+    '''
+    Runs shell _command_ returning its (combined stdout and stderr) output
+
+    Optional Parameters
+    -------------------
+    progress (None) : called with a dict for every progress line
+                      {'command', 'percent', 'shutoff', 'line'}
+    kill_on_error (True) : stop the command as soon as it prints a known error,
+                           the output so far is returned for the caller to check
+
+    Raises CalledProcessError on a non zero exit status (as _check_output_)
+    '''
+    if sys.version_info[0] > 2:  # preexec_fn isn't safe in threads
+        newsession = {'start_new_session': True}
+    else:
+        newsession = {'preexec_fn': os.setsid} if hasattr(os, 'setsid') else {}
+    with span('engine', 'process', command=command) as enginespan:
+        process = Popen(command, shell=True, stdout=PIPE, stderr=STDOUT,
+                        universal_newlines=True, **newsession)
+
+        lines = []
+        killed = started = False
+        for aline in iter(process.stdout.readline, ''):
+            lines.append(aline)
+            if verbose > 2:
+                print(aline, end="")
+
+            event = parseprogress(aline)
+            if event is not None and not started:
+                record('engine startup', enginespan.start, time.time() - enginespan.start,
+                       'process', command=command)
+                started = True
+            if event is not None and progress is not None:
+                event.update(command=command, line=aline)
+                progress(event)
+
+            if kill_on_error and classifyoutput(aline) is not None:
+                if verbose > 0:
+                    print("Stopping :", aline.strip())
+                _terminate(process)
+                killed = True
+                break
+
+        process.stdout.close()
+        returncode, usage = _wait(process)
+        enginespan.args.update(usage, returncode=returncode)
+        _usage.last = usage
+    stroutput = "".join(lines)
+
+    if returncode and not killed:
+        raise CalledProcessError(returncode, command, output=stroutput)
+
+    return stroutput
+
+
+def lastusage(clear=False):
+    '''
+    Returns {'maxrss' : MB, 'cpu' : seconds} of the last command run by this
+    thread (see _wait_), or {} if there was none. _clear_ forgets it
+    '''
+    if clear:
+        return _usage.__dict__.pop('last', {})
+    return getattr(_usage, 'last', {})
+
+
+def _wait(process):
+    '''
+    Waits for _process_ returning its exit status and {'maxrss' : peak
+    resident memory in MB, 'cpu' : user and system seconds} of it and the
+    processes it waited for
+    '''
+    if not hasattr(os, 'wait4'):
+        return process.wait(), {}
+
+    pid, status, rusage = os.wait4(process.pid, 0)
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+
+    return process.returncode, {'maxrss': rusage.ru_maxrss / 1024,  # kB on linux
+                                'cpu': rusage.ru_utime + rusage.ru_stime}
+
+
+def _terminate(process):
+    '''
+    Stops _process_ and any engine processes started by its shell
+    '''
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.terminate()
+    except OSError:  # already finished
+        pass
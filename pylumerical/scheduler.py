@@ -0,0 +1,214 @@
+'''
+Per file job scheduling for FDTD-Solutions
+
+Description : Each fsp file is treated as its own engine job. Several jobs
+run at once, sharing the machine's cores between them, and the outcome of
+every job is appended to a journal within the fsp directory (its engine
+output to a log file beside it) so that an interrupted batch resumes where
+it left off.
+'''
+
+from __future__ import division, print_function
+from subprocess import CalledProcessError
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from .retry import Deferred, RetryQueue
+from .runner import lastusage
+from .tracing import span
+
+STATE = '.schedule'  # journal of job records within each fsp directory, one json per line
+LOGS = '.schedulelogs'  # engine output of each job within each fsp directory
+
+RECORD = ('fsp', 'returncode', 'runtime', 'error', 'mtime', 'maxrss', 'cpu', 'log')
+
+
+def _threadpool(work, jobs, max_workers=1, policy=None, licences=None, verbose=0):
+    '''
+    Applies _work_ to every job using up to _max_workers_ threads. Each job
+    returns (job, result, error) so a single failure doesn't stop the others.
+    Launches raising LicenceUnavailable or NoProcessorLayout are rescheduled
+    (see _RetryQueue_)
+    '''
+    return RetryQueue(max_workers, policy=policy, licences=licences,
+                      verbose=verbose).run(work, jobs)
+
+
+def readstate(fsploc):
+    '''
+    Returns {fspname : record} of the last job run for each file in
+    _fsploc_, rebuilt from its journal. A line left incomplete by an
+    interruption is ignored
+    '''
+    state = {}
+    try:
+        with open(os.path.join(fsploc, STATE), 'r') as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                state[record['fsp']] = record
+    except (IOError, OSError):
+        pass
+    return state
+
+
+def writelog(fsploc, result):
+    '''
+    Writes the engine output of _result_ to its log file in _fsploc_,
+    returning the path of the log (None without output)
+    '''
+    if not result.get('output'):
+        return None
+
+    logloc = os.path.join(fsploc, LOGS)
+    if not os.path.isdir(logloc):
+        try:
+            os.makedirs(logloc)
+        except OSError:  # made by another job meanwhile
+            pass
+    log = os.path.join(logloc, result['fsp'] + '.log')
+    with io.open(log, 'w', encoding='utf-8') as logfile:
+        logfile.write(result['output'])
+    return log
+
+
+def writestate(fsploc, result):
+    '''
+    Appends the record of _result_ (without its output, see _writelog_) to
+    the journal of _fsploc_, returning the record
+    '''
+    record = dict((key, result.get(key)) for key in RECORD)
+    with open(os.path.join(fsploc, STATE), 'a') as journal:
+        journal.write(json.dumps(record, sort_keys=True) + '\n')
+    return record
+
+
+def compactstate(fsploc):
+    '''
+    Rewrites the journal of _fsploc_ with only the last record of each fsp
+    file still there, so it doesn't grow with every schedule
+    '''
+    state = readstate(fsploc)
+    fd, tmp = tempfile.mkstemp(dir=fsploc, prefix=STATE)
+    with os.fdopen(fd, 'w') as journal:
+        for fspname in sorted(state):
+            if os.path.exists(os.path.join(fsploc, fspname + '.fsp')):
+                journal.write(json.dumps(state[fspname], sort_keys=True) + '\n')
+    os.rename(tmp, os.path.join(fsploc, STATE))  # atomic, an interruption keeps the old journal
+
+
+def completed(fsploc, fspname, state):
+    '''
+    True if _fspname_ ran successfully and hasn't changed since
+    '''
+    try:
+        result = state[fspname]
+        return (result['returncode'] == 0 and
+                result['mtime'] == os.path.getmtime(os.path.join(fsploc, fspname + '.fsp')))
+    except (KeyError, OSError):
+        return False
+
+
+def runresult(name, runjob, **overrides):
+    '''
+    Calls _runjob_(name, **overrides) returning its result :
+
+        {'fsp' : name, 'returncode' : exit code (0 : success),
+         'runtime' : seconds, 'output' : engine output, 'error' : message or None,
+         'maxrss' : peak MB, 'cpu' : seconds (where known, see _lastusage_)}
+
+    Deferred launches are re-raised for the RetryQueue to reschedule
+    '''
+    start = time.time()
+    lastusage(clear=True)
+    result = {'fsp': name, 'returncode': 0, 'output': "", 'error': None}
+    try:
+        result['output'] = runjob(name, **overrides)
+    except Deferred:
+        raise
+    except CalledProcessError as err:
+        result['returncode'] = err.returncode
+        result['output'] = err.output
+        result['error'] = str(err)
+    except Exception as err:
+        result['returncode'] = -1
+        result['error'] = str(err)
+    result['runtime'] = time.time() - start
+    result.update(lastusage())
+
+    if isinstance(result['output'], bytes):
+        result['output'] = result['output'].decode('utf-8', 'replace')
+
+    return result
+
+
+def ScheduleFSPfiles(fsploc, runjob, fspnames=None, jobs=1, resume=True, verbose=0,
+                     policy=None, licences=None):
+    '''
+    Runs _runjob_(fspname) for every fsp file in _fsploc_ with up to _jobs_ at
+    once, returning a list of per file results (see _runresult_). Files
+    skipped as complete are returned as their journal records, whose log
+    names the file holding their output. The journal is compacted once
+    every job has finished (see _compactstate_)
+
+    Optional Parameters
+    -------------------
+    fspnames (None) : names (without .fsp) to run (default : all in _fsploc_)
+    resume (True) : skip files the journal records as completed
+    policy (None), licences (None) : RetryPolicy and LicencePool of the RetryQueue
+
+    _runjob_ should be launched with defer=True and accept a cores override,
+    which is set to 1 when the engine finds no parallel processor layout
+    '''
+    if fspnames is None:
+        fspnames = sorted(fn[:-len('.fsp')] for fn in os.listdir(fsploc)
+                          if fn.endswith('.fsp'))
+
+    state = readstate(fsploc) if resume else {}
+    lock = threading.Lock()
+
+    torun = [fspname for fspname in fspnames if not completed(fsploc, fspname, state)]
+    if verbose > 0:
+        print(len(fspnames) - len(torun), "simulations already complete,",
+              len(torun), "to run in", jobs, "concurrent jobs")
+
+    def work(fspname, **overrides):
+        if verbose > 0:
+            print("Starting", fspname)
+
+        with span('simulate', job=fspname, **overrides) as jobspan:
+            result = runresult(fspname, runjob, **overrides)
+            jobspan.args['returncode'] = result['returncode']
+
+        try:
+            result['mtime'] = os.path.getmtime(os.path.join(fsploc, fspname + '.fsp'))
+        except OSError:
+            result['mtime'] = None
+
+        result['log'] = writelog(fsploc, result)
+        with lock:
+            writestate(fsploc, result)
+            state[fspname] = result
+
+        if verbose > 0:
+            print(fspname, "returns with code", result['returncode'],
+                  "after {0:.1f}s".format(result['runtime']))
+
+        return result
+
+    for fspname, result, err in _threadpool(work, torun, jobs, policy=policy,
+                                            licences=licences, verbose=verbose):
+        if err is not None:  # retries exhausted
+            with lock:
+                state[fspname] = writestate(fsploc, {'fsp': fspname, 'returncode': -1,
+                                                     'error': str(err)})
+
+    if torun:
+        compactstate(fsploc)
+
+    return [state[fspname] for fspname in fspnames if fspname in state]
@@ -0,0 +1,167 @@
+'''
+Disk budget of a sweep
+
+Description : Every fsp file holds the full monitor data of its simulation
+and can be hundreds of MB, so a large sweep fills a scratch disk long before
+it finishes. A StoragePolicy kept with the sweep bounds the size of the
+sweep directory (and the space left free on its disk), deletes or compresses
+each fsp file once its outputs have been extracted and removes the
+generated lsf inputs. Generation waits while the sweep is over its budget
+so that the simulations and processing already under way can catch up
+(see the storage option of _ParameterSweepInput_ and _RunSweep_).
+'''
+
+from __future__ import division, print_function
+import errno
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from .tracing import record
+
+POLICY = '.storage'  # policy within each sweep directory
+
+FSPACTIONS = ('keep', 'delete', 'compress')
+
+
+def _size(location):
+    '''
+    Bytes taken by every file below _location_
+    '''
+    total = 0
+    for root, dirs, files in os.walk(location):
+        for fn in files:
+            try:
+                total += os.path.getsize(os.path.join(root, fn))
+            except OSError:  # removed meanwhile
+                pass
+    return total
+
+
+class StoragePolicy(object):
+    '''
+    Disk budget and clean up of a sweep directory. The budget only holds
+    back new points, so those being generated when it is reached still
+    take the sweep over it
+
+    Optional Parameters
+    -------------------
+    max_bytes (None) : size the sweep directory may grow to
+    min_free (None) : bytes which must stay free on the sweep's file system
+    fsp ('keep') : what becomes of an fsp file once processed, 'keep', 'delete'
+        or 'compress' (gzipped to .fsp.gz)
+    delete_inputs (False) : delete the lsf files of each point once its fsp
+        file has been generated
+    timeout (0) : seconds generation waits for space when nothing under way
+        can free any, before raising IOError (ENOSPC)
+    interval (5) : seconds between measurements of the sweep directory
+    '''
+
+    def __init__(self, max_bytes=None, min_free=None, fsp='keep', delete_inputs=False,
+                 timeout=0, interval=5):
+        if fsp not in FSPACTIONS:
+            raise ValueError("fsp must be one of " + ", ".join(FSPACTIONS))
+
+        self.max_bytes = max_bytes
+        self.min_free = min_free
+        self.fsp = fsp
+        self.delete_inputs = delete_inputs
+        self.timeout = timeout
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.measured = {}  # sweep directory : (time, bytes)
+
+    def settings(self):
+        return {'max_bytes': self.max_bytes, 'min_free': self.min_free, 'fsp': self.fsp,
+                'delete_inputs': self.delete_inputs, 'timeout': self.timeout,
+                'interval': self.interval}
+
+    def save(self, sweeploc):
+        '''
+        Keeps the policy within _sweeploc_ so later stages apply it (see _find_)
+        '''
+        with open(os.path.join(sweeploc, POLICY), 'w') as policyfile:
+            json.dump(self.settings(), policyfile, indent=1, sort_keys=True)
+
+    @classmethod
+    def find(cls, location):
+        '''
+        Returns the policy saved for the sweep owning directory _location_
+        (its input, fsp or output folder or the sweep folder), or None
+        '''
+        location = os.path.normpath(location)
+        for sweeploc in (location, os.path.dirname(location)):
+            if os.path.exists(os.path.join(sweeploc, POLICY)):
+                with open(os.path.join(sweeploc, POLICY), 'r') as policyfile:
+                    return cls(**json.load(policyfile))
+
+    def usage(self, sweeploc, refresh=False):
+        '''
+        Bytes taken by _sweeploc_, measured at most every _interval_ seconds
+        '''
+        with self.lock:
+            measuredat, used = self.measured.get(sweeploc, (0, None))
+            if refresh or used is None or time.time() - measuredat > self.interval:
+                used = _size(sweeploc)
+                self.measured[sweeploc] = (time.time(), used)
+        return used
+
+    def exceeded(self, sweeploc, refresh=False):
+        '''
+        True if _sweeploc_ is over its budget or its disk is too full
+        '''
+        if self.min_free is not None:
+            stat = os.statvfs(sweeploc)
+            if stat.f_bavail * stat.f_frsize < self.min_free:
+                return True
+        return self.max_bytes is not None and self.usage(sweeploc, refresh) > self.max_bytes
+
+    def wait(self, sweeploc, busy=None, verbose=0):
+        '''
+        Waits while _sweeploc_ is over budget. While _busy_() is True work
+        under way may still free space, otherwise IOError (ENOSPC) is raised
+        once _timeout_ seconds have passed
+        '''
+        start = time.time()
+        if not self.exceeded(sweeploc):
+            return
+
+        if verbose > 0:
+            print("Sweep", sweeploc, "is over its disk budget, waiting")
+        while self.exceeded(sweeploc):
+            if not (busy is not None and busy()) and time.time() - start >= self.timeout:
+                raise IOError(errno.ENOSPC, "Sweep is over its disk budget "
+                              "({0} bytes used)".format(self.usage(sweeploc)), sweeploc)
+            time.sleep(min(self.interval, 1))
+        record('disk wait', start, time.time() - start, 'wait', sweep=sweeploc)
+
+    def generated(self, lsfloc, lsfnames):
+        '''
+        Applies the policy to the lsf files of _lsfnames_ whose fsp files
+        have been generated
+        '''
+        if not self.delete_inputs:
+            return
+        for lsfname in lsfnames:
+            try:
+                os.remove(os.path.join(lsfloc, lsfname + '.lsf'))
+            except OSError:  # already gone
+                pass
+
+    def processed(self, fsploc, fspnames):
+        '''
+        Deletes or compresses the fsp files of _fspnames_ (without .fsp)
+        whose outputs have been extracted
+        '''
+        for fspname in fspnames:
+            fsp = os.path.join(fsploc, fspname + '.fsp')
+            if self.fsp == 'keep' or not os.path.exists(fsp):
+                continue
+            if self.fsp == 'compress':
+                with open(fsp, 'rb') as fspfile:
+                    with gzip.open(fsp + '.gz.tmp', 'wb') as compressed:
+                        shutil.copyfileobj(fspfile, compressed)
+                os.rename(fsp + '.gz.tmp', fsp + '.gz')
+            os.remove(fsp)
@@ -0,0 +1,373 @@
+'''
+Lazy parameter sweep expansion
+
+Description : A sweep over the Cartesian product of several parameters is
+held as its axes and the default parameters only. Sweep points are built on
+demand from their index, so a grid of millions of points can be iterated,
+sliced or sharded over several machines in constant memory.
+
+For a fixed budget of simulations the grid can be replaced by a Latin
+hypercube or Sobol sample of the same parameters, and an existing sweep can
+be refined where a metric of its results changes the most (see _refinesweep_).
+
+Parameter values are canonicalised as points are built (see _canonical_) so
+floats differing only in their last bits, e.g. linspace(...)*nm against a
+literal, give the same name and variables block.
+'''
+
+from __future__ import division, print_function
+import numbers
+import random
+
+try:
+    xrange
+except NameError:  # python3
+    xrange = range
+
+PRECISION = 12  # significant figures sweep point floats are canonicalised to
+
+
+def _significant(value, precision):
+    return float("{0:.{1}g}".format(value, precision))
+
+
+def canonical(value, precision=PRECISION):
+    '''
+    Returns _value_ as a plain python value, floats rounded to _precision_
+    significant figures (None leaves them as they are)
+    '''
+    if isinstance(value, bool) or not isinstance(value, numbers.Real):
+        return value
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if precision is None:
+        return float(value)
+    return _significant(value, precision)
+
+
+def _uniquedictstring(adict):
+    '''
+    Turns dictionary into unique name
+    '''
+    uniquename = "_".join("{0}={1}".format(key, data)
+                          for key, data in adict.items())
+    return uniquename.replace('.', ',')
+
+
+def lsftogenerate(newparams, defaultparams, precision=None):
+    '''
+    Returns dict of parameters along with unique name determined by given parameters
+
+    When _precision_ is given every value is canonicalised first (see _canonical_)
+    '''
+    if precision is not None:
+        newparams = dict((key, canonical(value, precision)) for key, value in newparams.items())
+        defaultparams = dict((key, canonical(value, precision))
+                             for key, value in defaultparams.items())
+    uniquename = _uniquedictstring(newparams)
+
+    parameters = dict(defaultparams)
+    parameters.update(newparams)
+    return [uniquename, parameters]
+
+
+class ParameterSweep(object):
+    '''
+    Sequence of the [uniquename, parameters] pairs of every sweep point in the
+    Cartesian product of _newparams_ (in itertools.product order)
+
+    newparams should have the format [(parameter_name1, values1),(parameter_name2, values2),...]
+    and _defaultparams_ gives every other parameter. Indexing with a slice,
+    _shard_ and _chunks_ return views without expanding the sweep.
+
+    _precision_ is the significant figures values are canonicalised to (see
+    _canonical_), None to leave them as given
+    '''
+    precision = None
+
+    def __init__(self, newparams, defaultparams, indices=None):
+        self.newparams = [(name, list(values)) for name, values in newparams]
+        self.defaultparams = defaultparams
+
+        size = 1
+        for name, values in self.newparams:
+            size *= len(values)
+        self.size = size  # of the whole grid
+        self.indices = indices if indices is not None else (0, size, 1)
+
+    def _view(self, start, stop, step):
+        return ParameterSweep(self.newparams, self.defaultparams, (start, stop, step))
+
+    def __len__(self):
+        start, stop, step = self.indices
+        return max(0, (stop - start + step - 1) // step)
+
+    def override(self, index):
+        '''
+        Returns the swept parameters of grid point _index_
+        '''
+        values = []
+        for name, axis in reversed(self.newparams):  # last parameter varies fastest
+            index, position = divmod(index, len(axis))
+            values.append(axis[position])
+
+        return dict(zip([name for name, axis in self.newparams], reversed(values)))
+
+    def point(self, index):
+        '''
+        Returns [uniquename, parameters] of grid point _index_
+        '''
+        return lsftogenerate(self.override(index), self.defaultparams, self.precision)
+
+    def __getitem__(self, item):
+        start, stop, step = self.indices
+        if isinstance(item, slice):
+            first, last, stride = item.indices(len(self))
+            view = self._view(start + first * step, start + last * step, step * stride)
+            view.precision = self.precision
+            return view
+
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("sweep point out of range")
+        return self.point(start + item * step)
+
+    def __iter__(self):
+        start, stop, step = self.indices
+        for index in xrange(start, stop, step):
+            yield self.point(index)
+
+    def shard(self, i, n):
+        '''
+        Returns shard _i_ of _n_ near equal contiguous parts of the sweep
+        '''
+        return self[len(self) * i // n:len(self) * (i + 1) // n]
+
+    def chunks(self, size):
+        '''
+        Yields consecutive lists of at most _size_ sweep points
+        '''
+        for first in xrange(0, len(self), size):
+            yield list(self[first:first + size])
+
+
+class SweepPoints(ParameterSweep):
+    '''
+    Sweep over an explicit list of _overrides_, dicts of the swept parameters
+    of each point
+    '''
+
+    def __init__(self, overrides, defaultparams, indices=None):
+        self.overrides = overrides
+        self.defaultparams = defaultparams
+        self.size = len(overrides)
+        self.indices = indices if indices is not None else (0, self.size, 1)
+
+    def _view(self, start, stop, step):
+        return SweepPoints(self.overrides, self.defaultparams, (start, stop, step))
+
+    def override(self, index):
+        return dict(self.overrides[index])
+
+
+def _isnumber(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _axis(values):
+    '''
+    Returns the function mapping u in [0, 1) onto a sampled parameter. A
+    (low, high) tuple is a continuous range (every integer between when both
+    are ints), any other sequence a set of discrete choices
+    '''
+    if isinstance(values, tuple) and len(values) == 2 and all(_isnumber(v) for v in values):
+        low, high = values
+        if all(isinstance(v, numbers.Integral) for v in values):
+            return lambda u: low + min(int(u * (high - low + 1)), high - low)
+        return lambda u: low + u * (high - low)
+
+    values = list(values)
+    return lambda u: values[min(int(u * len(values)), len(values) - 1)]
+
+
+def LatinHypercubeSweep(newparams, defaultparams, samples, seed=None):
+    '''
+    Returns a Latin hypercube sample of _samples_ points, each parameter of
+    _newparams_ taking every one of _samples_ equal strata once (see _axis_
+    for how parameter values are given)
+    '''
+    generator = random.Random(seed)
+    columns = []
+    for name, values in newparams:
+        strata = list(range(samples))
+        generator.shuffle(strata)
+        axis = _axis(values)
+        columns.append([axis((stratum + generator.random()) / samples) for stratum in strata])
+
+    names = [name for name, values in newparams]
+    return SweepPoints([dict(zip(names, row)) for row in zip(*columns)], defaultparams)
+
+
+# Joe and Kuo primitive polynomials (degree s, coefficients a) and initial
+# direction numbers m of Sobol dimensions 2 onwards (the first is m = 1, 1, ...)
+SOBOL = [(1, 0, (1,)),
+         (2, 1, (1, 3)),
+         (3, 1, (1, 3, 1)),
+         (3, 2, (1, 1, 1)),
+         (4, 1, (1, 1, 3, 3)),
+         (4, 4, (1, 3, 5, 13)),
+         (5, 2, (1, 1, 5, 5, 17)),
+         (5, 4, (1, 1, 5, 5, 5)),
+         (5, 7, (1, 1, 7, 11, 19)),
+         (5, 11, (1, 1, 5, 1, 1)),
+         (5, 13, (1, 1, 1, 3, 11)),
+         (5, 14, (1, 3, 5, 5, 31)),
+         (6, 1, (1, 3, 3, 9, 7, 49)),
+         (6, 13, (1, 1, 1, 15, 21, 21)),
+         (6, 16, (1, 3, 1, 13, 27, 49))]
+
+BITS = 32
+
+
+def _sobolvectors(dimensions):
+    '''
+    Direction numbers (scaled by 2**BITS) of the first _dimensions_ Sobol dimensions
+    '''
+    if dimensions > len(SOBOL) + 1:
+        raise ValueError("Sobol sampling supports at most {0} parameters".format(len(SOBOL) + 1))
+
+    vectors = [[1 << (BITS - 1 - i) for i in range(BITS)]]
+    for s, a, m in SOBOL[:dimensions - 1]:
+        m = list(m)
+        for i in range(s, BITS):
+            new = m[i - s] ^ (m[i - s] << s)
+            for k in range(1, s):
+                new ^= (((a >> (s - 1 - k)) & 1) * m[i - k]) << k
+            m.append(new)
+        vectors.append([m[i] << (BITS - 1 - i) for i in range(BITS)])
+
+    return vectors
+
+
+class SobolSweep(ParameterSweep):
+    '''
+    The first _samples_ points of the Sobol sequence over _newparams_ (see
+    _axis_ for how parameter values are given). Points are built from their
+    index like the grid so the sample can be sliced and sharded.
+
+    With a _seed_ each dimension is XORed with a random digital shift, giving
+    a different sample with the same stratification for each seed
+    '''
+
+    def __init__(self, newparams, defaultparams, samples, seed=None, indices=None):
+        self.newparams = [(name, values) for name, values in newparams]
+        self.defaultparams = defaultparams
+        self.size = samples
+        self.seed = seed
+        self.indices = indices if indices is not None else (0, samples, 1)
+        self._axes = [_axis(values) for name, values in self.newparams]
+        self._vectors = _sobolvectors(len(self.newparams))
+        generator = random.Random(seed)
+        self._shifts = [0 if seed is None else generator.getrandbits(BITS)
+                        for name, values in self.newparams]
+
+    def _view(self, start, stop, step):
+        return SobolSweep(self.newparams, self.defaultparams, self.size, self.seed,
+                          (start, stop, step))
+
+    def override(self, index):
+        gray = index ^ (index >> 1)
+        override = {}
+        for (name, values), axis, vector, shift in zip(self.newparams, self._axes,
+                                                       self._vectors, self._shifts):
+            x = shift
+            for bit in range(BITS):
+                if gray >> bit & 1:
+                    x ^= vector[bit]
+            override[name] = axis(x / 2 ** BITS)
+        return override
+
+
+SAMPLERS = {'lhs': LatinHypercubeSweep, 'sobol': SobolSweep}
+
+
+def _pointkey(point):
+    return tuple(sorted(point.items()))
+
+
+def _midpoint(x0, x1):
+    if isinstance(x0, numbers.Integral) and isinstance(x1, numbers.Integral):
+        return (x0 + x1) // 2
+    return (x0 + x1) / 2
+
+
+def _nearest(points):
+    '''
+    Returns the pairs (i, j) of _points_ joining each to its nearest other
+    point sharing its non numeric parameters, with every numeric parameter
+    scaled to [0, 1] over _points_
+    '''
+    keys = sorted(set(key for point in points for key in point))
+    numeric = [key for key in keys if all(_isnumber(point.get(key)) for point in points)]
+    spans = {}
+    for key in numeric:
+        low, high = min(point[key] for point in points), max(point[key] for point in points)
+        spans[key] = (low, (high - low) or 1)
+    unit = [[(point[key] - spans[key][0]) / spans[key][1] for key in numeric]
+            for point in points]
+    rest = [tuple((key, point.get(key)) for key in keys if key not in spans) for point in points]
+
+    pairs = set()
+    for i, u in enumerate(unit):
+        distances = [(sum((a - b) ** 2 for a, b in zip(u, v)), j) for j, v in enumerate(unit)
+                     if j != i and rest[j] == rest[i]]
+        if distances:
+            pairs.add(tuple(sorted((i, min(distances)[1]))))
+    return sorted(pairs)
+
+
+def refinesweep(points, values, count):
+    '''
+    Returns up to _count_ new sweep points (dicts of swept parameters) which
+    bisect the intervals between neighbouring _points_ over which the metric
+    _values_ change the most. Neighbours are points differing in a single
+    numeric parameter with no other point between them, as on a grid, and
+    each point and its nearest other point (see _nearest_), so that samples
+    scattered by the 'lhs' and 'sobol' samplers are refined too.
+    '''
+    existing = set(_pointkey(point) for point in points)
+    candidates = []
+    for key in sorted(set(key for point in points for key in point)):
+        lines = {}  # the other parameters : [(value of key, metric)]
+        for point, value in zip(points, values):
+            if _isnumber(point.get(key)) and value == value:  # skip NaN
+                rest = tuple(sorted((k, v) for k, v in point.items() if k != key))
+                lines.setdefault(rest, []).append((point[key], value))
+
+        for rest, line in lines.items():
+            line.sort()
+            for (x0, m0), (x1, m1) in zip(line, line[1:]):
+                middle = _midpoint(x0, x1)
+                if x0 < middle < x1:
+                    point = dict(rest)
+                    point[key] = middle
+                    candidates.append((abs(m1 - m0), point))
+
+    measured = [(point, value) for point, value in zip(points, values) if value == value]
+    for i, j in _nearest([point for point, value in measured]):
+        (p0, m0), (p1, m1) = measured[i], measured[j]
+        point = dict((key, _midpoint(p0[key], p1[key]) if _isnumber(p0[key]) else p0[key])
+                     for key in p0)
+        candidates.append((abs(m1 - m0), point))
+
+    candidates.sort(key=lambda candidate: -candidate[0])
+    refined = []
+    for change, point in candidates:
+        if len(refined) == count:
+            break
+        if _pointkey(point) not in existing:
+            existing.add(_pointkey(point))
+            refined.append(point)
+
+    return refined
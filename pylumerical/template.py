@@ -0,0 +1,185 @@
+'''
+Compiled Lumerical script templates
+
+Description : The root lsf script of a parameter sweep is read and split into
+header, variables block and body once. Every sweep point is then rendered from
+memory, either to a string or to disk with a single write.
+'''
+
+from __future__ import division, print_function
+import hashlib
+import os
+import re
+
+_compiled = {}  # lsf path : (mtime, LSFTemplate)
+
+EXIT = re.compile(r'^\s*exit\s*\([^)]*\)\s*;[^\n]*\n?', re.MULTILINE)
+NUM2STR = re.compile(r'write\s*\(\s*([^,;\n]+?)\s*,\s*num2str\s*\(([^;\n]*)\)\s*\)\s*;')
+BINARY = ('pylumerical_data = \\2; '
+          'matlabsave(replacestring(\\1, ".csv", ".mat"), pylumerical_data);')
+
+
+# /typecast##
+# http://stackoverflow.com/questions/7019283/automatically-type-cast-parameters-in-python
+
+
+def __boolify(astr):
+    '''
+    String to Bool
+    '''
+    if astr == 'True' or astr == 'true':
+        return True
+    if astr == 'False' or astr == 'false':
+        return False
+    raise ValueError('Not Boolean Value!')
+
+
+def estimateType(var):
+    '''guesses the str representation of the variables type'''
+    var = str(var)  # important if the parameters aren't strings...
+    for caster in (__boolify, int, float):
+        try:
+            return caster(var)
+        except ValueError:
+            pass
+    return var
+
+# /typecast##
+
+
+def lsfassignment(akey, value, verbose=0):
+    '''
+    Returns the lsf line assigning _value_ to _akey_
+    '''
+    if isinstance(value, bool):  # Type casts for Lumerical
+        aparam = int(value)
+    elif isinstance(value, str):
+        aparam = "'" + value + "'"
+    elif isinstance(value, int):
+        aparam = int(value)
+    elif isinstance(value, float):
+        aparam = float(value)
+    else:
+        if verbose > 0:
+            print("unknown type!", type(value))
+        aparam = "'" + value + "'"
+        # TODO make code work properly with python3 unicode
+
+    return akey + " = " + str(aparam) + ";\n"
+
+
+def renderdigest(variables):
+    '''
+    sha1 hash of the variables block _variables_ render to, whatever their
+    order. Points with the same hash build the same simulation
+    '''
+    return _sha1("".join(lsfassignment(key, variables[key]) for key in sorted(variables)))
+
+
+def binaryoutput(script):
+    '''
+    Rewrites every write(outfile, num2str(...)); of _script_ to save the
+    matrix with matlabsave into a binary .mat file named as outfile with
+    .mat in place of .csv (see _readmat_)
+    '''
+    return NUM2STR.sub(BINARY, script)
+
+
+def _sha1(text):
+    '''
+    sha1 hex digest of _text_ (str in python2 and python3)
+    '''
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+
+class LSFTemplate(object):
+    '''
+    Lumerical script held in memory as header, variables block and body
+
+    The variables block is found between the #<variables># and #</variables>#
+    tags (see _GetCurrentParameters_). _parameters_ holds the values the root
+    script currently assigns and _digest_ is the sha1 hash of the root script.
+    '''
+
+    def __init__(self, root, verbose=0, **kwargs):
+        unwanted = kwargs.get('unwanted', ["\n", ";", "'", "#"])
+
+        rootloc, rootname = root
+        self.path = os.path.join(rootloc, rootname + '.lsf')
+
+        with open(self.path, 'r') as rootlsf:
+            lines = rootlsf.readlines()
+
+        start = end = None
+        params = []
+        for i, aline in enumerate(lines):
+            for achar in unwanted:
+                aline = aline.replace(achar, '')
+            if aline == "<variables>" and start is None:
+                start = i
+            elif aline == "</variables>" and start is not None:
+                end = i
+                break
+            elif start is not None and aline != "":
+                if verbose > 0:
+                    print(i, ":", aline)
+                params.append(aline.split(' = '))
+
+        if end is None:
+            raise ValueError("No #<variables># block found in " + self.path)
+
+        self.header = "".join(lines[:start + 1])
+        self.body = "".join(lines[end + 1:])
+        self.parameters = {a: estimateType(b) for a, b in params}
+        self.digest = _sha1("".join(lines))
+
+    def render(self, variables, verbose=0, noexit=False, binary=False):
+        '''
+        Returns the script with its variables block replaced by _variables_
+
+        _noexit_ removes any exit(); lines so the script can be followed by others
+        _binary_ writes num2str matrices as .mat files instead (see _binaryoutput_)
+        '''
+        block = []
+        for j, akey in enumerate(variables):
+            newline = lsfassignment(akey, variables[akey], verbose=verbose)
+            if verbose > 0:
+                print(j, ":", newline, end="")
+            block.append(newline)
+
+        body = EXIT.sub("", self.body) if noexit else self.body
+        body = binaryoutput(body) if binary else body
+
+        return "".join([self.header] + block + ['#</variables>#\n', body])
+
+    def write(self, lsf, variables, epilogue="", verbose=0, binary=False):
+        '''
+        Writes the rendered script followed by _epilogue_ to _lsfloc_/_lsfname_.lsf
+        '''
+        lsfloc, lsfname = lsf
+
+        with open(os.path.join(lsfloc, lsfname + '.lsf'), 'w') as newlsf:
+            newlsf.write(self.render(variables, verbose=verbose, binary=binary) + epilogue)
+
+
+def CompileLSF(root, verbose=0):
+    '''
+    Returns the LSFTemplate of _root_, only re-reading the script from disk
+    when its modification time changes
+    '''
+    rootloc, rootname = root
+    path = os.path.join(rootloc, rootname + '.lsf')
+    mtime = os.path.getmtime(path)
+
+    try:
+        compiledtime, template = _compiled[path]
+        if compiledtime == mtime:
+            return template
+    except KeyError:
+        pass
+
+    template = LSFTemplate(root, verbose=verbose)
+    _compiled[path] = (mtime, template)
+    return template
@@ -0,0 +1,194 @@
+'''
+Timing and tracing of sweeps
+
+Description : While a Tracer is active (with Tracer() as trace: ...) the
+public entry points record a span for every stage and job : lsf rendering,
+generation, engine launches (with the peak memory and CPU time of the
+engine processes and the time until they report progress), licence waits
+and processing. Retries are counted. The trace can be saved as JSON, as a
+Chrome trace (chrome://tracing or https://ui.perfetto.dev) or summarised
+in a table, which is also written as TIMINGS beside the README of each
+sweep. Without an active tracer nothing is recorded.
+'''
+
+from __future__ import division, print_function
+import functools
+import json
+import os
+import threading
+import time
+
+TIMINGS = 'TIMINGS'  # summary table within each sweep directory
+
+_tracers = []  # active tracers, shared by every thread
+
+
+class Tracer(object):
+    '''
+    Records spans (name, category, start, duration, thread, args) and counters
+    '''
+
+    def __init__(self):
+        self.events = []
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.origin = time.time()
+
+    def __enter__(self):
+        _tracers.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _tracers.remove(self)
+
+    def add(self, name, start, duration, category='stage', **args):
+        '''
+        Records a span of _duration_ seconds which began at time _start_
+        '''
+        event = {'name': name, 'category': category, 'start': start, 'duration': duration,
+                 'thread': threading.current_thread().name, 'args': args}
+        with self.lock:
+            self.events.append(event)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        '''
+        Returns {span name : {'count', 'total', 'mean', 'max'}} with the
+        peak memory (MB) and CPU time (s) of engine processes where known
+        '''
+        with self.lock:
+            events = list(self.events)
+
+        summary = {}
+        for event in events:
+            row = summary.setdefault(event['name'], {'count': 0, 'total': 0, 'max': 0})
+            row['count'] += 1
+            row['total'] += event['duration']
+            row['max'] = max(row['max'], event['duration'])
+            if 'maxrss' in event['args']:
+                row['maxrss'] = max(row.get('maxrss', 0), event['args']['maxrss'])
+                row['cpu'] = row.get('cpu', 0) + event['args']['cpu']
+
+        for row in summary.values():
+            row['mean'] = row['total'] / row['count']
+        return summary
+
+    def table(self):
+        '''
+        Summary as a text table
+        '''
+        lines = ["{0:<28}{1:>8}{2:>12}{3:>12}{4:>12}{5:>12}{6:>12}".format(
+            "span", "count", "total (s)", "mean (s)", "max (s)", "peak (MB)", "cpu (s)")]
+        for name, row in sorted(self.summary().items(), key=lambda item: -item[1]['total']):
+            lines.append("{0:<28}{1:>8}{2:>12.3f}{3:>12.3f}{4:>12.3f}{5:>12}{6:>12}".format(
+                name, row['count'], row['total'], row['mean'], row['max'],
+                "{0:.1f}".format(row['maxrss']) if 'maxrss' in row else "",
+                "{0:.2f}".format(row['cpu']) if 'cpu' in row else ""))
+
+        for name, value in sorted(self.counters.items()):
+            lines.append("{0:<28}{1:>8}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+    def save(self, fn):
+        '''
+        Writes every span and counter to the json file _fn_
+        '''
+        with self.lock:
+            trace = {'origin': self.origin, 'events': list(self.events),
+                     'counters': dict(self.counters)}
+        with open(fn, 'w') as jsonfile:
+            json.dump(trace, jsonfile, indent=1, sort_keys=True)
+
+    def chrome(self, fn):
+        '''
+        Writes the trace to _fn_ in the Chrome trace event format
+        '''
+        with self.lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+
+        threads = {}
+        traceevents = [{'name': event['name'], 'cat': event['category'], 'ph': 'X',
+                        'ts': (event['start'] - self.origin) * 1e6,
+                        'dur': event['duration'] * 1e6, 'pid': os.getpid(),
+                        'tid': threads.setdefault(event['thread'], len(threads)),
+                        'args': event['args']}
+                       for event in events]
+        traceevents += [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+                         'args': {'name': thread}} for thread, tid in threads.items()]
+
+        with open(fn, 'w') as jsonfile:
+            json.dump({'traceEvents': traceevents, 'otherData': counters}, jsonfile)
+
+    def writesummary(self, sweeploc):
+        '''
+        Writes the summary table to TIMINGS within _sweeploc_
+        '''
+        if os.path.isdir(sweeploc):
+            with open(os.path.join(sweeploc, TIMINGS), 'w') as summaryfile:
+                summaryfile.write(self.table())
+
+
+class _Span(object):
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        record(self.name, self.start, time.time() - self.start, self.category, **self.args)
+
+
+def active():
+    '''
+    Returns the active Tracer or None
+    '''
+    return _tracers[-1] if _tracers else None
+
+
+def span(name, category='stage', **args):
+    '''
+    Context manager timing a span on the active tracer. More args can be
+    added to the span object returned before it ends
+    '''
+    return _Span(name, category, args)
+
+
+def record(name, start, duration, category='stage', **args):
+    tracer = active()
+    if tracer is not None:
+        tracer.add(name, start, duration, category, **args)
+
+
+def count(name, n=1):
+    tracer = active()
+    if tracer is not None:
+        tracer.count(name, n)
+
+
+def traced(sweeploc=None):
+    '''
+    Decorator recording a span for each call. _sweeploc_ is a function of the
+    call's arguments giving the sweep directory the summary is written to
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def tracedfunction(*args, **kwargs):
+            with span(function.__name__, 'entry point'):
+                result = function(*args, **kwargs)
+
+            tracer = active()
+            if tracer is not None and sweeploc is not None:
+                tracer.writesummary(sweeploc(*args, **kwargs))
+            return result
+        return tracedfunction
+    return decorator
@@ -0,0 +1,34 @@
+'''
+Fixtures running sweeps against the fake engine (see _fakeengine_)
+'''
+
+from __future__ import division, print_function
+import os
+import sys
+
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+from pylumerical import fakeengine
+
+dipoleexample = os.path.join(os.path.dirname(here), 'dipoleexample')
+SCRIPT = (os.path.join(dipoleexample, 'originalscripts'), 'DipoleArray')
+PROCESSING = (os.path.join(dipoleexample, 'processingscripts'), 'farfieldsave')
+SCRIPTPARAMS = {'Monitor': 'P'}
+
+DEFAULTPARAMS = {'BravaisTheta': 90, 'LX': 100e-9, 'MarginXY': 200e-9, 'N01': 0,
+                 'Monitor': 'a'}
+
+
+@pytest.fixture
+def workingdir(tmp_path, monkeypatch):
+    '''
+    Directory for sweeps, with the fake engine first on PATH
+    '''
+    bindir = fakeengine.install(str(tmp_path / 'bin'))
+    monkeypatch.setenv('PATH', bindir + os.pathsep + os.environ['PATH'])
+    for name in ('LATENCY', 'RUNTIME', 'FLEXNET', 'OOM', 'ERROR'):
+        monkeypatch.delenv('PYLUMERICAL_FAKE_' + name, raising=False)
+    return str(tmp_path)
@@ -0,0 +1,103 @@
+from __future__ import division, print_function
+from subprocess import CalledProcessError
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+import pylumerical as pyl
+from pylumerical.admission import MemoryBudget, admitjobs
+from conftest import SCRIPT, DEFAULTPARAMS
+
+
+def runall(runjob, names):
+    threads = [threading.Thread(target=runjob, args=(name,)) for name in names]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class Jobs(object):
+    '''
+    Jobs recording when each ran and how many ran at once
+    '''
+
+    def __init__(self, duration=0.1):
+        self.duration = duration
+        self.running = 0
+        self.most = 0
+        self.spans = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, fspname):
+        with self.lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+        start = time.time()
+        time.sleep(self.duration)
+        with self.lock:
+            self.running -= 1
+        self.spans[fspname] = (start, time.time())
+        return fspname
+
+
+def test_the_first_job_runs_alone():
+    jobs = Jobs()
+    runall(admitjobs(MemoryBudget(1e9, interval=0.01), jobs), ['a', 'b', 'c', 'd'])
+
+    first = min(jobs.spans.values())
+    assert all(start >= first[1] for start, end in jobs.spans.values() if (start, end) != first)
+    assert jobs.most > 1  # a peak was measured, so the rest are admitted together
+
+
+def test_estimates_over_budget_run_one_at_a_time():
+    jobs = Jobs(0.05)
+    runall(admitjobs(MemoryBudget(1e9, interval=0.01), jobs,
+                     dict((name, 6e8) for name in 'abc')), 'abc')
+    assert jobs.most == 1
+
+
+def test_estimates_within_budget_run_together():
+    jobs = Jobs()
+    runall(admitjobs(MemoryBudget(1e9, interval=0.01), jobs,
+                     dict((name, 1) for name in 'abc')), 'abc')
+    assert jobs.most == 3
+
+
+def test_jobs_killed_for_memory_alongside_others_run_again():
+    started = threading.Event()
+    attempts = []
+
+    def runjob(fspname):
+        attempts.append(fspname)
+        if fspname == 'slow':
+            started.set()
+            time.sleep(0.2)
+        elif attempts.count(fspname) == 1:
+            started.wait()
+            raise CalledProcessError(-signal.SIGKILL, 'engine')
+        return fspname
+
+    runall(admitjobs(MemoryBudget(1e9, interval=0.01), runjob, {'slow': 1, 'killed': 1}),
+           ['slow', 'killed'])
+    assert attempts.count('killed') == 2
+
+
+def test_a_job_killed_alone_fails():
+    def runjob(fspname):
+        raise CalledProcessError(-signal.SIGKILL, 'engine')
+
+    with pytest.raises(CalledProcessError):
+        admitjobs(MemoryBudget(1e9), runjob)('alone')
+
+
+def test_sweeps_run_within_a_memory_budget(workingdir):
+    fsploc = pyl.ParameterSweepInput(workingdir, 'budget', [('MarginXY', [1e-7, 2e-7, 3e-7])],
+                                     DEFAULTPARAMS, SCRIPT)[0]
+    results = pyl.ExecuteFSPfiles(fsploc, cores=2, jobs=2, memory_budget=1e6)
+
+    assert len(results) == len([fn for fn in os.listdir(fsploc) if fn.endswith('.fsp')])
+    assert all(result['returncode'] == 0 for result in results)
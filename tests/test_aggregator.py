@@ -0,0 +1,75 @@
+from __future__ import division, print_function
+import os
+import shutil
+
+import pylumerical as pyl
+from pylumerical.processingoutput import AGGREGATE
+from conftest import SCRIPT, PROCESSING, SCRIPTPARAMS, DEFAULTPARAMS
+
+
+def runsweep(workingdir, values):
+    return pyl.RunSweep(workingdir, 'aggregate', [('MarginXY', values)], DEFAULTPARAMS,
+                        SCRIPT, PROCESSING, SCRIPTPARAMS)[1]
+
+
+def test_only_new_points_are_ingested(workingdir):
+    outputloc = runsweep(workingdir, [1e-7, 2e-7])
+    aggregator = pyl.SweepAggregator(outputloc, compact=3)
+    assert aggregator.update() == 2
+    assert aggregator.update() == 0
+
+    runsweep(workingdir, [1e-7, 2e-7, 3e-7])
+    assert aggregator.update() == 1
+    assert aggregator.data.names == ['MarginXY=1e-07', 'MarginXY=2e-07', 'MarginXY=3e-07']
+    assert list(aggregator.data.parameters['MarginXY']) == [1e-7, 2e-7, 3e-7]
+
+    loaded = pyl.LoadSweep(outputloc)
+    for quantity in loaded.quantities:
+        assert (aggregator.data[quantity] == loaded[quantity]).all()
+
+
+def test_reopened_datasets_keep_their_segments(workingdir):
+    outputloc = runsweep(workingdir, [1e-7, 2e-7])
+    pyl.SweepAggregator(outputloc).update()
+
+    reopened = pyl.SweepAggregator(outputloc)
+    assert len(reopened) == 2
+    assert reopened.update() == 0
+    assert len(reopened.data) == 2
+
+    assert len(pyl.SweepAggregator(outputloc, quantities=['farfield_Er'])) == 0
+
+
+def test_segments_are_compacted(workingdir):
+    outputloc = runsweep(workingdir, [1e-7])
+    aggregator = pyl.SweepAggregator(outputloc, compact=2)
+    aggregator.update()
+    runsweep(workingdir, [1e-7, 2e-7])
+    aggregator.update()
+
+    assert len(aggregator.segments) == 1
+    assert sorted(fn for fn in os.listdir(os.path.join(outputloc, AGGREGATE))
+                  if fn.endswith('.npz')) == aggregator.segments
+    assert len(pyl.SweepAggregator(outputloc).data) == 2
+
+
+def test_following_stops_once_the_sweep_has_finished(workingdir):
+    outputloc = runsweep(workingdir, [1e-7, 2e-7])
+    aggregator = pyl.SweepAggregator(outputloc)
+
+    assert aggregator.finished()
+    assert [len(data) for data in aggregator.follow(interval=0)] == [2]
+
+
+def test_points_without_a_manifest_settle_first(workingdir):
+    outputloc = runsweep(workingdir, [1e-7, 2e-7])
+    plainloc = os.path.join(workingdir, 'plain')
+    os.mkdir(plainloc)
+    for fn in os.listdir(outputloc):
+        if '.fsp' in fn:
+            shutil.copy(os.path.join(outputloc, fn), plainloc)
+
+    assert pyl.SweepAggregator(plainloc, settle=3600).update() == 0
+    aggregator = pyl.SweepAggregator(plainloc, settle=0)
+    assert aggregator.update() == 2
+    assert not aggregator.finished()
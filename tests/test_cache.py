@@ -0,0 +1,73 @@
+from __future__ import division, print_function
+import os
+import shutil
+
+import pylumerical as pyl
+from conftest import SCRIPT, DEFAULTPARAMS
+
+NEWPARAMS = [('MarginXY', [1e-7, 2e-7])]
+
+
+def cached(cache_dir, kind):
+    return sorted(os.listdir(os.path.join(cache_dir, kind)))
+
+
+def test_a_failed_point_leaves_no_stale_file(workingdir, monkeypatch):
+    scriptloc = os.path.join(workingdir, 'scripts')
+    shutil.copytree(SCRIPT[0], scriptloc)
+    script = (scriptloc, SCRIPT[1])
+    cache_dir = os.path.join(workingdir, 'cache')
+
+    fsploc, outputloc = pyl.ParameterSweepInput(workingdir, 'stale', NEWPARAMS, DEFAULTPARAMS,
+                                                script, cache_dir=cache_dir)
+    before = cached(cache_dir, 'generated')
+    assert len(before) == 2
+
+    with open(os.path.join(scriptloc, SCRIPT[1] + '.lsf'), 'a') as lsf:
+        lsf.write("\n# edited\n")
+    monkeypatch.setenv('PYLUMERICAL_FAKE_ERROR', 'MarginXY=2e-07.fsp')
+    try:
+        pyl.ParameterSweepInput(workingdir, 'stale', NEWPARAMS, DEFAULTPARAMS, script,
+                                cache_dir=cache_dir)
+    except ValueError:
+        pass
+
+    assert not os.path.exists(os.path.join(fsploc, 'MarginXY=2e-07.fsp'))
+    runs = pyl.QueryRuns(outputloc)
+    assert dict(zip(runs['name'], runs['status'])) == {'MarginXY=1e-07': 'generated',
+                                                       'MarginXY=2e-07': 'failed'}
+    assert len(cached(cache_dir, 'generated')) == 3  # the edited point which saved
+
+
+def test_sweeps_share_cached_files(workingdir, monkeypatch):
+    cache_dir = os.path.join(workingdir, 'cache')
+    fsploc = pyl.ParameterSweepInput(workingdir, 'first', NEWPARAMS, DEFAULTPARAMS, SCRIPT,
+                                     cache_dir=cache_dir)[0]
+    pyl.ExecuteFSPfiles(fsploc, cores=2, cache_dir=cache_dir)
+    assert len(cached(cache_dir, 'generated')) == len(cached(cache_dir, 'simulated')) == 2
+
+    monkeypatch.setenv('PYLUMERICAL_FAKE_ERROR', 'second')  # any launch would fail
+    fsploc = pyl.ParameterSweepInput(workingdir, 'second', NEWPARAMS, DEFAULTPARAMS, SCRIPT,
+                                     cache_dir=cache_dir)[0]
+    pyl.ExecuteFSPfiles(fsploc, cores=2, cache_dir=cache_dir)
+
+    assert sorted(fn for fn in os.listdir(fsploc) if fn.endswith('.fsp')) == \
+        ['MarginXY=1e-07.fsp', 'MarginXY=2e-07.fsp']
+    runs = pyl.QueryRuns(fsploc)
+    assert set(runs['status']) == {'simulated'}
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = pyl.SweepCache(str(tmp_path / 'cache'), max_size=15)
+    for n, key in enumerate(['old', 'used', 'new']):
+        source = tmp_path / (key + '.fsp')
+        source.write_text(u'0123456789')
+        cache.store('generated', key, str(source))
+        os.utime(cache.path('generated', key), (n, n))
+
+    assert cache.fetch('generated', 'used', str(tmp_path / 'fetched.fsp'))
+    assert not cache.fetch('generated', 'missing', str(tmp_path / 'missing.fsp'))
+    cache.evict()
+
+    assert cached(cache.cache_dir, 'generated') == ['used.fsp']
+    assert cache.size() == 10
@@ -0,0 +1,92 @@
+from __future__ import division, print_function
+import json
+import os
+
+import pytest
+
+import pylumerical as pyl
+from pylumerical.costmodel import CostModel, MeshQuery, planjobs, HISTORY
+from conftest import SCRIPT, DEFAULTPARAMS
+
+
+def model(tmp_path, **kwargs):
+    return CostModel(str(tmp_path / HISTORY), **kwargs)
+
+
+def writefsp(location, fspname, **variables):
+    with open(os.path.join(location, fspname + '.fsp'), 'w') as fspfile:
+        fspfile.write(json.dumps(variables) + "\n")
+
+
+def test_runs_are_kept_in_the_history(tmp_path):
+    first = model(tmp_path)
+    first.record({'size': 1}, runtime=10, cores=2, maxrss=100)
+    with open(first.history, 'a') as historyfile:
+        historyfile.write('{"parameters": ')  # interrupted
+
+    runs = model(tmp_path).runs
+    assert len(runs) == 1
+    assert runs[0]['work'] == 20
+
+
+def test_predictions_follow_the_nearest_runs(tmp_path):
+    costs = model(tmp_path, neighbours=1)
+    assert costs.predict({'size': 1})['work'] is None
+
+    costs.record({'size': 1, 'shape': 'disc'}, runtime=10, cores=1, maxrss=100)
+    costs.record({'size': 5, 'shape': 'disc'}, runtime=50, cores=1, maxrss=500)
+
+    prediction = costs.predict({'size': 4.5, 'shape': 'disc'})
+    assert prediction['work'] == pytest.approx(50)
+    assert prediction['maxrss'] == pytest.approx(500)
+    assert model(tmp_path, neighbours=2).predict({'size': 3, 'shape': 'disc'})['work'] == \
+        pytest.approx(10 * 5 ** 0.5)
+
+
+def test_failed_layouts_bound_the_cores(tmp_path):
+    costs = model(tmp_path)
+    costs.record({'size': 1}, runtime=10, cores=2)
+    costs.record({'size': 1}, cores=8, nolayout=True)
+    assert costs.predict({'size': 1})['maxcores'] == 2
+
+
+def test_mesh_queries_scale_the_work(workingdir, monkeypatch):
+    monkeypatch.setenv('PYLUMERICAL_FAKE_COST', 'size')
+    writefsp(workingdir, 'small', size=1)
+    writefsp(workingdir, 'large', size=3)
+    assert MeshQuery(os.path.join(workingdir, 'large.fsp')) == {'memory': 300, 'cells': 3e6}
+
+    costs = CostModel(os.path.join(workingdir, HISTORY), mesh_query=True)
+    costs.record({'size': 1}, runtime=10, cores=1, cells=1e6)
+    prediction = costs.predict({'size': 1}, os.path.join(workingdir, 'large.fsp'))
+    assert prediction['work'] == pytest.approx(30)
+    assert prediction['maxrss'] == 300
+
+
+def test_longest_jobs_start_first_with_more_cores(tmp_path):
+    costs = model(tmp_path, neighbours=1)
+    costs.record({'size': 1}, runtime=10, cores=1)
+    costs.record({'size': 3}, runtime=30, cores=1)
+    parameters = {'short': {'size': 1}, 'long': {'size': 3}}
+
+    order, jobcores, predictions = planjobs(costs, ['short', 'long'], parameters,
+                                            str(tmp_path), cores=8, jobs=2)
+    assert order == ['long', 'short']
+    assert jobcores == {'long': 6, 'short': 2}
+
+
+def test_jobs_without_a_prediction_share_the_cores(tmp_path):
+    order, jobcores, predictions = planjobs(model(tmp_path), ['a', 'b'], {}, str(tmp_path),
+                                            cores=8, jobs=2)
+    assert jobcores == {'a': 4, 'b': 4}
+    assert predictions['a']['work'] is None
+
+
+def test_costed_sweeps_record_their_runs(workingdir):
+    fsploc = pyl.ParameterSweepInput(workingdir, 'costed', [('MarginXY', [1e-7, 2e-7])],
+                                     DEFAULTPARAMS, SCRIPT)[0]
+    results = pyl.ExecuteFSPfiles(fsploc, cores=4, jobs=2, cost_model=True)
+
+    assert all(result['returncode'] == 0 for result in results)
+    runs = CostModel(os.path.join(workingdir, 'costed', HISTORY)).runs
+    assert sorted(run['parameters']['MarginXY'] for run in runs) == [1e-7, 2e-7]
@@ -0,0 +1,81 @@
+from __future__ import division, print_function
+import os
+import numpy as np
+import pytest
+
+import pylumerical as pyl
+from pylumerical.pylumerical import _Deduplicate
+from pylumerical.sweep import canonical, lsftogenerate, PRECISION
+from conftest import SCRIPT, PROCESSING, SCRIPTPARAMS, DEFAULTPARAMS
+
+
+def test_floats_differing_in_their_last_bits_are_one_point():
+    assert canonical(2e-7 * (1 + 1e-15)) == canonical(2e-7)
+    assert canonical(0.1e-6 * 3) == 3e-7
+    assert canonical(3) == 3 and isinstance(canonical(np.int64(3)), int)
+
+    name, parameters = lsftogenerate({'MarginXY': 0.1e-6 * 3}, DEFAULTPARAMS, PRECISION)
+    assert name == 'MarginXY=3e-07' and parameters['MarginXY'] == 3e-7
+
+
+def test_duplicates_are_simulated_once(workingdir):
+    newparams = [('MarginXY', [1e-7, 2e-7, 2e-7 * (1 + 1e-15), 0.1e-6 * 3])]
+    fsploc, outputloc = pyl.ParameterSweepInput(workingdir, 'dedup', newparams,
+                                                DEFAULTPARAMS, SCRIPT)
+
+    assert sorted(fn for fn in os.listdir(fsploc) if fn.endswith('.fsp')) == \
+        ['MarginXY=1e-07.fsp', 'MarginXY=2e-07.fsp', 'MarginXY=3e-07.fsp']
+
+
+def test_aliases_share_the_outputs_of_their_run(workingdir):
+    newparams = [('MarginXY', [1e-7, 2e-7])]
+    with pyl.Tracer() as tracer:
+        pyl.RunSweep(workingdir, 'alias', newparams, DEFAULTPARAMS, SCRIPT, PROCESSING,
+                     SCRIPTPARAMS, jobs=2)
+        fsploc, outputloc = pyl.RunSweep(workingdir, 'alias', newparams + [('N01', [0, 1])],
+                                         DEFAULTPARAMS, SCRIPT, PROCESSING, SCRIPTPARAMS,
+                                         jobs=2)
+    assert tracer.summary()['simulate']['count'] == 4  # N01=0 is the default
+
+    runs = pyl.QueryRuns(outputloc)
+    runs = runs[runs['alias_of'].notnull()]
+    aliases = dict(zip(runs['name'], runs['alias_of']))
+    assert aliases == {'MarginXY=1e-07_N01=0': 'MarginXY=1e-07',
+                       'MarginXY=2e-07_N01=0': 'MarginXY=2e-07'}
+
+    data = pyl.LoadSweep(outputloc)
+    assert len(data) == 6
+    for quantity in data.quantities:
+        assert np.array_equal(data[quantity][data.names.index('MarginXY=1e-07_N01=0')],
+                              data[quantity][data.names.index('MarginXY=1e-07')])
+
+
+def test_points_are_not_aliased_onto_failed_runs(workingdir, monkeypatch):
+    monkeypatch.setenv('PYLUMERICAL_FAKE_ERROR', 'MarginXY=5e-07.fsp')
+    with pytest.raises(ValueError):
+        pyl.ParameterSweepInput(workingdir, 'failed', [('MarginXY', [5e-7])], DEFAULTPARAMS,
+                                SCRIPT)
+
+    monkeypatch.delenv('PYLUMERICAL_FAKE_ERROR')
+    fsploc, outputloc = pyl.ParameterSweepInput(workingdir, 'failed',
+                                                [('MarginXY', [5e-7]), ('N01', [0])],
+                                                DEFAULTPARAMS, SCRIPT)
+
+    assert os.path.exists(os.path.join(fsploc, 'MarginXY=5e-07_N01=0.fsp'))
+    runs = pyl.SweepManifest(os.path.dirname(fsploc)).runs(aliases=True)
+    assert dict((run['name'], (run['status'], run['alias_of'])) for run in runs) == \
+        {'MarginXY=5e-07_N01=0': ('generated', None)}  # the same run ID, so it replaces it
+
+
+def test_pending_points_of_earlier_chunks_are_aliased(tmp_path):
+    manifest = pyl.SweepManifest(str(tmp_path))
+    kept = {}
+    first = _Deduplicate(manifest, [['a', {'x': 1}]], ['x'], kept=kept)
+    second = _Deduplicate(manifest, [['b', {'x': 1}]], ['x'], kept=kept)
+
+    assert (first, second) == ([['a', {'x': 1}]], [])
+    runs = manifest.runs(aliases=True)
+    assert dict((run['name'], run['alias_of']) for run in runs) == {'a': None, 'b': 'a'}
+
+    # a pending run of another sweep may never be generated
+    assert _Deduplicate(manifest, [['c', {'x': 1}]], ['x']) == [['c', {'x': 1}]]
@@ -0,0 +1,86 @@
+from __future__ import division, print_function
+import os
+import threading
+
+import pylumerical as pyl
+from pylumerical.executors import SSHExecutor, LocalHost, HostPool
+from conftest import SCRIPT, DEFAULTPARAMS
+
+NEWPARAMS = [('MarginXY', [1e-7, 2e-7, 3e-7, 4e-7])]
+
+
+def generate(workingdir):
+    fsploc = pyl.ParameterSweepInput(workingdir, 'executors', NEWPARAMS, DEFAULTPARAMS,
+                                     SCRIPT)[0]
+    return fsploc, sorted(fn[:-len('.fsp')] for fn in os.listdir(fsploc) if fn.endswith('.fsp'))
+
+
+def test_simulated_files_are_pulled_back(workingdir):
+    fsploc, fspnames = generate(workingdir)
+    host = LocalHost(os.path.join(workingdir, 'host'), cores=2)
+    remote = os.path.join(host.remotedir(fsploc), fspnames[0] + '.fsp')
+
+    host.run(fsploc, fspnames[:1])
+    assert host.transfers == 2
+    assert os.stat(os.path.join(fsploc, fspnames[0] + '.fsp')).st_mtime == \
+        os.stat(remote).st_mtime
+
+    host.run(fsploc, fspnames[:1])  # unchanged locally so only the result comes back
+    assert host.transfers == 3
+
+
+def test_jobs_are_spread_over_hosts(workingdir):
+    fsploc, fspnames = generate(workingdir)
+    hosts = [LocalHost(os.path.join(workingdir, name), cores=2) for name in ('a', 'b')]
+
+    results = pyl.ExecuteFSPfiles(fsploc, hosts=hosts, cores_per_job=1)
+
+    assert sorted(result['fsp'] for result in results) == fspnames
+    assert all(result['returncode'] == 0 for result in results)
+    assert all(host.transfers > 0 for host in hosts)
+
+
+def test_the_emptiest_host_is_chosen_first():
+    pool = HostPool([LocalHost('a', cores=8), LocalHost('b', cores=4)], cores_per_job=2)
+    assert len(pool) == 6
+
+    taken = [pool.acquire() for i in range(3)]
+    assert [(i, cores) for i, executor, cores in taken] == [(0, 2), (1, 2), (0, 2)]
+
+    for i, executor, cores in taken:
+        pool.release(i)
+    assert pool.free == pool.slots
+
+
+def test_a_full_pool_waits_for_a_release():
+    pool = HostPool([LocalHost('a', cores=4)])
+    i, executor, cores = pool.acquire()
+    assert cores == 4
+
+    acquired = []
+    waiting = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiting.start()
+    waiting.join(0.2)
+    assert not acquired
+
+    pool.release(i)
+    waiting.join()
+    assert acquired
+
+
+def test_ssh_commands_run_in_the_remote_directory():
+    host = SSHExecutor('node', cores=4, remoteloc='work', nice=10, ssh_options='-p 2222')
+    remotedir = host.remotedir('/sweeps/fsp')
+    assert remotedir.startswith('work' + os.sep)
+    assert host.remotedir('/sweeps/fsp') == remotedir != host.remotedir('/sweeps/other')
+
+    command = host.command('/sweeps/fsp', ['a'])
+    assert command.startswith("ssh -o ControlMaster=auto")
+    assert "-p 2222 node" in command
+    assert "cd " + remotedir in command
+    assert "nice -n 10 fdtd-run-local.sh -n 4 ./a.fsp" in command
+
+
+def test_shared_hosts_use_the_local_directory():
+    host = SSHExecutor('node', shared=True)
+    assert host.remotedir('/sweeps/fsp') == '/sweeps/fsp'
@@ -0,0 +1,58 @@
+from __future__ import division, print_function
+import threading
+
+import pytest
+
+from pylumerical.pipeline import Stage, RunPipeline
+
+
+def passon(job):
+    return [job]
+
+
+def test_every_job_passes_every_stage():
+    finished = []
+    lock = threading.Lock()
+
+    def last(job):
+        with lock:
+            finished.append(job)
+        return []
+
+    failures = RunPipeline([Stage('first', passon, 3), Stage('second', passon, 2),
+                            Stage('last', last, 2)], range(20))
+
+    assert sorted(finished) == list(range(20))
+    assert failures == {'first': [], 'second': [], 'last': []}
+
+
+def test_failed_jobs_go_no_further():
+    def odd(job):
+        if job % 2:
+            raise ValueError(job)
+        return [job]
+
+    failures = RunPipeline([Stage('odd', odd, 2), Stage('last', lambda job: [])], range(6))
+    assert sorted(job for job, err in failures['odd']) == [1, 3, 5]
+
+
+def test_throttle_errors_reach_the_caller():
+    def throttle(busy):
+        if throttle.calls == 3:
+            raise IOError("no space")
+        throttle.calls += 1
+    throttle.calls = 0
+
+    with pytest.raises(IOError):
+        RunPipeline([Stage('first', passon, 4), Stage('last', lambda job: [], 2)],
+                    range(100), throttle=throttle)
+
+
+def test_job_errors_reach_the_caller():
+    def jobs():
+        for job in range(10):
+            yield job
+        raise ValueError("unreadable sweep point")
+
+    with pytest.raises(ValueError):
+        RunPipeline([Stage('first', passon, 4), Stage('last', lambda job: [], 2)], jobs())
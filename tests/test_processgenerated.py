@@ -0,0 +1,60 @@
+from __future__ import division, print_function
+import os
+
+import pylumerical as pyl
+from conftest import SCRIPT, PROCESSING, SCRIPTPARAMS, DEFAULTPARAMS
+
+NEWPARAMS = [('MarginXY', [1e-7, 2e-7, 3e-7])]
+
+
+def generate(workingdir):
+    return pyl.ParameterSweepInput(workingdir, 'process', NEWPARAMS, DEFAULTPARAMS, SCRIPT)
+
+
+def process(fsploc, outputloc, **kwargs):
+    return pyl.ProcessGenerated(fsploc, outputloc, PROCESSING[0], PROCESSING[1], SCRIPTPARAMS,
+                                **kwargs)
+
+
+def test_files_simulated_elsewhere_are_processed(workingdir):
+    fsploc, outputloc = generate(workingdir)  # runs are left 'generated'
+
+    results = process(fsploc, outputloc)
+    assert [result['returncode'] for result in results] == [0, 0, 0]
+    assert len(pyl.LoadSweep(outputloc)) == 3
+
+
+def test_failed_and_missing_files_are_skipped(workingdir, capsys):
+    fsploc, outputloc = generate(workingdir)
+    pyl.SweepManifest(os.path.dirname(fsploc)).setstatus(['MarginXY=2e-07'], 'failed')
+
+    results = process(fsploc, outputloc, fspnames=['MarginXY=1e-07', 'MarginXY=2e-07',
+                                                   'MarginXY=4e-07'])
+    assert [result['fsp'] for result in results] == ['MarginXY=1e-07.fsp']
+    assert 'MarginXY=2e-07.fsp, MarginXY=4e-07.fsp' in capsys.readouterr().out
+
+    runs = pyl.QueryRuns(outputloc)
+    assert dict(zip(runs['name'], runs['status']))['MarginXY=2e-07'] == 'failed'
+
+
+def test_batches_process_several_files_per_launch(workingdir):
+    fsploc, outputloc = generate(workingdir)
+
+    with pyl.Tracer() as tracer:
+        results = process(fsploc, outputloc, batch_size=2)
+    assert sorted(result['fsp'] for result in results) == \
+        ['MarginXY=1e-07.fsp', 'MarginXY=2e-07.fsp', 'MarginXY=3e-07.fsp']
+    assert all(result['returncode'] == 0 for result in results)
+    assert tracer.summary()['process batch']['count'] == 2
+    assert len(pyl.LoadSweep(outputloc)) == 3
+
+
+def test_a_failure_within_a_batch_relaunches_the_rest(workingdir, monkeypatch):
+    fsploc, outputloc = generate(workingdir)
+    monkeypatch.setenv('PYLUMERICAL_FAKE_ERROR', 'MarginXY=2e-07')
+
+    with pyl.Tracer() as tracer:
+        results = process(fsploc, outputloc, batch_size=3)
+    assert dict((result['fsp'], result['returncode'] == 0) for result in results) == \
+        {'MarginXY=1e-07.fsp': True, 'MarginXY=2e-07.fsp': False, 'MarginXY=3e-07.fsp': True}
+    assert tracer.summary()['process batch']['count'] == 2
@@ -0,0 +1,82 @@
+from __future__ import division, print_function
+import os
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+import pylumerical as pyl
+from pylumerical import fakeengine
+from pylumerical.processingoutput import readmat, readnum2str, CACHE
+from conftest import SCRIPT, PROCESSING, SCRIPTPARAMS, DEFAULTPARAMS
+
+
+def writemat(tmp_path, name='farfield', compressed=False):
+    fn = str(tmp_path / (name + '.mat'))
+    data = fakeengine._matfile(fn, name)
+    if compressed:
+        packed = zlib.compress(data[128:])
+        data = data[:128] + struct.pack('<II', 15, len(packed)) + packed
+    with open(fn, 'wb') as matfile:
+        matfile.write(data)
+    return fn
+
+
+def expected(fn):
+    return np.array(fakeengine._values(fn))
+
+
+def test_matrices_are_memory_mapped(tmp_path):
+    fn = writemat(tmp_path)
+    matrix = readmat(fn)
+
+    assert isinstance(matrix.base, np.memmap)
+    assert not matrix.flags.writeable
+    np.testing.assert_array_equal(matrix, expected(fn))
+
+
+def test_compressed_matrices_are_read_into_memory(tmp_path):
+    fn = writemat(tmp_path, compressed=True)
+    matrix = readmat(fn)
+
+    assert not isinstance(matrix.base, np.memmap)
+    np.testing.assert_array_equal(matrix, expected(fn))
+
+
+def test_matrices_are_found_by_name(tmp_path):
+    fn = writemat(tmp_path, 'Er')
+    assert readmat(fn, 'Er').shape == (10, 10)
+    with pytest.raises(ValueError):
+        readmat(fn, 'Ez')
+
+
+def test_hdf5_mat_files_are_refused(tmp_path):
+    fn = str(tmp_path / 'v73.mat')
+    with open(fn, 'wb') as matfile:
+        matfile.write(b'MATLAB 7.3 MAT-file'.ljust(128, b' '))
+    with pytest.raises(ValueError):
+        readmat(fn)
+
+
+def test_mapped_sweeps_match_loaded_ones(workingdir):
+    fsploc, outputloc = pyl.RunSweep(workingdir, 'mapped', [('MarginXY', [1e-7, 2e-7])],
+                                     DEFAULTPARAMS, SCRIPT, PROCESSING, SCRIPTPARAMS,
+                                     binary=True)
+    assert all(fn.endswith('.mat') for fn in os.listdir(outputloc) if '.fsp' in fn)
+
+    loaded = pyl.LoadSweep(outputloc, cache=False)
+    mapped = pyl.LoadSweep(outputloc, mmap=True)
+    assert mapped.names == loaded.names
+    for quantity, matrices in mapped.quantities.items():
+        assert matrices.dtype == object
+        assert all(isinstance(matrix.base, np.memmap) for matrix in matrices)
+        np.testing.assert_array_equal(np.stack(matrices), loaded[quantity])
+    assert not os.path.exists(os.path.join(outputloc, CACHE))
+
+
+def test_num2str_matrices_match_their_mat_files(tmp_path):
+    fn = str(tmp_path / 'farfield.csv')
+    with open(fn, 'w') as csvfile:
+        csvfile.write(fakeengine._matrix(fn))
+    np.testing.assert_array_equal(readnum2str(fn), readmat(writemat(tmp_path)))
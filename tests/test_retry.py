@@ -0,0 +1,94 @@
+from __future__ import division, print_function
+import threading
+import time
+
+import pylumerical as pyl
+from pylumerical.retry import (RetryPolicy, RetryQueue, LicencePool, LicenceUnavailable,
+                               NoProcessorLayout, LumericalError, classifyoutput,
+                               INVALID, NOLAYOUT, FLEXNET)
+from conftest import SCRIPT, DEFAULTPARAMS
+
+QUICK = RetryPolicy(max_attempts=3, delay=0.01, jitter=0)
+
+
+def test_backoff_doubles_up_to_its_limit():
+    policy = RetryPolicy(delay=10, max_delay=60, jitter=0)
+    assert [policy.backoff(attempt) for attempt in range(1, 6)] == [10, 20, 40, 60, 60]
+    assert 7.5 <= RetryPolicy(delay=10, jitter=0.25).backoff(1) <= 12.5
+
+
+def test_policies_take_the_launcher_keywords():
+    policy = RetryPolicy.fromkwargs({'TimeDelay': 3, 'MaxAttempts': 4})
+    assert (policy.delay, policy.max_attempts) == (3, 4)
+
+
+def test_known_failures_are_classified():
+    assert classifyoutput(b"Error: no such file") == INVALID
+    assert classifyoutput(NOLAYOUT + " for 8 processes") == NOLAYOUT
+    assert classifyoutput(FLEXNET) == FLEXNET
+    assert classifyoutput("100% complete") is None
+
+
+def test_jobs_waiting_for_a_licence_let_others_run():
+    finished = []
+
+    def work(job):
+        if job == 'busy' and finished.count('attempt') < 2:
+            finished.append('attempt')
+            raise LicenceUnavailable(FLEXNET)
+        finished.append(job)
+        return job
+
+    results = RetryQueue(1, policy=QUICK).run(work, ['busy', 'a', 'b'])
+
+    assert results == [('busy', 'busy', None), ('a', 'a', None), ('b', 'b', None)]
+    assert finished.index('a') < finished.index('busy')
+
+
+def test_licence_retries_give_up():
+    def work(job):
+        raise LicenceUnavailable(FLEXNET)
+
+    [(job, result, err)] = RetryQueue(2, policy=QUICK).run(work, ['a'])
+    assert isinstance(err, LumericalError)
+    assert "maximum number of attempts" in str(err)
+
+
+def test_no_layout_runs_again_on_one_core():
+    calls = []
+
+    def work(job, cores=4):
+        calls.append(cores)
+        if cores > 1:
+            raise NoProcessorLayout(NOLAYOUT)
+        return cores
+
+    assert RetryQueue(1).run(work, ['a']) == [('a', 1, None)]
+    assert calls == [4, 1]
+
+
+def test_licence_pools_bound_concurrent_jobs():
+    lock = threading.Lock()
+    running, most = [0], [0]
+
+    def work(job):
+        with lock:
+            running[0] += 1
+            most[0] = max(most[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    RetryQueue(4, licences=LicencePool(2)).run(work, range(8))
+    assert most[0] == 2
+
+
+def test_exhausted_licences_fail_the_sweep_files(workingdir, monkeypatch):
+    fsploc = pyl.ParameterSweepInput(workingdir, 'licences', [('MarginXY', [1e-7, 2e-7])],
+                                     DEFAULTPARAMS, SCRIPT)[0]
+    monkeypatch.setenv('PYLUMERICAL_FAKE_FLEXNET', '1')
+
+    results = pyl.ExecuteFSPfiles(fsploc, cores=2, jobs=2, TimeDelay=0.01, MaxAttempts=1)
+    assert len(results) == 2
+    assert all(result['returncode'] != 0 for result in results)
+    assert all("maximum number of attempts" in result['error'] for result in results)
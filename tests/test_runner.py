@@ -0,0 +1,49 @@
+from __future__ import division, print_function
+from subprocess import CalledProcessError
+import os
+import time
+
+import pytest
+
+from pylumerical.runner import RunCommand, parseprogress, lastusage
+
+
+def test_progress_lines_are_parsed():
+    assert parseprogress("50% complete. Max time remaining: 0 sec. Auto Shutoff: 1e-05") == \
+        {'percent': 50, 'shutoff': 1e-5}
+    assert parseprogress("12.5 % complete") == {'percent': 12.5, 'shutoff': None}
+    assert parseprogress("Simulation completed successfully") is None
+
+
+def test_engine_progress_reaches_the_callback(workingdir):
+    fsp = os.path.join(workingdir, 'a.fsp')
+    open(fsp, 'w').close()
+    events = []
+
+    RunCommand("fdtd-run-local.sh -n 1 " + fsp, progress=events.append)
+
+    assert [event['percent'] for event in events] == [50, 100]
+    assert events[-1]['shutoff'] == 1e-10
+    assert all(event['command'].startswith("fdtd-run-local.sh") for event in events)
+    assert set(lastusage()) == {'maxrss', 'cpu'}
+
+
+def test_a_reported_error_kills_the_command():
+    start = time.time()
+    stroutput = RunCommand("echo 'Error: invalid'; sleep 10; echo finished")
+
+    assert time.time() - start < 5
+    assert "Error: invalid" in stroutput
+    assert "finished" not in stroutput
+
+
+def test_errors_can_be_left_to_finish():
+    stroutput = RunCommand("echo 'Error: invalid'; echo finished", kill_on_error=False)
+    assert "finished" in stroutput
+
+
+def test_a_failed_command_raises():
+    with pytest.raises(CalledProcessError) as raised:
+        RunCommand("echo partial; exit 3")
+    assert raised.value.returncode == 3
+    assert raised.value.output == "partial\n"
@@ -0,0 +1,72 @@
+from __future__ import division, print_function
+import os
+
+import pylumerical as pyl
+from conftest import SCRIPT, PROCESSING, SCRIPTPARAMS, DEFAULTPARAMS
+
+NEWPARAMS = [('MarginXY', [1e-7, 2e-7, 3e-7])]
+
+
+def runsweep(workingdir, newparams=NEWPARAMS, **kwargs):
+    with pyl.Tracer() as tracer:
+        fsploc, outputloc = pyl.RunSweep(workingdir, 'sweep', newparams, DEFAULTPARAMS, SCRIPT,
+                                         PROCESSING, SCRIPTPARAMS, jobs=2, **kwargs)
+    simulated = tracer.summary().get('simulate', {}).get('count', 0)
+    return fsploc, outputloc, simulated
+
+
+def statuses(outputloc):
+    runs = pyl.QueryRuns(outputloc)
+    return dict(zip(runs['name'], runs['status']))
+
+
+def test_every_point_is_processed(workingdir):
+    fsploc, outputloc, simulated = runsweep(workingdir)
+
+    assert simulated == 3
+    assert set(statuses(outputloc).values()) == {'processed'}
+    data = pyl.LoadSweep(outputloc)
+    assert sorted(data.names) == ['MarginXY=1e-07', 'MarginXY=2e-07', 'MarginXY=3e-07']
+
+
+def test_batches_relaunch_after_a_failed_point(workingdir, monkeypatch):
+    monkeypatch.setenv('PYLUMERICAL_FAKE_ERROR', 'MarginXY=2e-07.fsp')
+    fsploc, outputloc, simulated = runsweep(workingdir, batch_size=3)
+
+    assert statuses(outputloc) == {'MarginXY=1e-07': 'processed',
+                                   'MarginXY=2e-07': 'failed',
+                                   'MarginXY=3e-07': 'processed'}
+
+
+def test_resume_only_runs_what_is_left(workingdir, monkeypatch):
+    monkeypatch.setenv('PYLUMERICAL_FAKE_ERROR', 'MarginXY=2e-07.fsp')
+    runsweep(workingdir)
+
+    monkeypatch.delenv('PYLUMERICAL_FAKE_ERROR')
+    fsploc, outputloc, simulated = runsweep(workingdir)
+    assert simulated == 1  # the failed point
+    assert set(statuses(outputloc).values()) == {'processed'}
+
+    fsploc, outputloc, simulated = runsweep(workingdir)
+    assert simulated == 0
+
+
+def test_queries_matching_no_run_keep_their_columns(workingdir):
+    fsploc, outputloc, simulated = runsweep(workingdir)
+    runs = pyl.QueryRuns(outputloc, status='failed')
+
+    assert len(runs) == 0
+    assert list(runs.columns) == ['run_id', 'name', 'status', 'alias_of']
+    assert statuses(outputloc) != {}
+
+
+def test_delete_existing_files_starts_afresh(workingdir):
+    fsploc, outputloc, simulated = runsweep(workingdir, storage=pyl.StoragePolicy())
+    pyl.SweepAggregator(outputloc).update()
+
+    fsploc, outputloc = pyl.ParameterSweepInput(workingdir, 'sweep', NEWPARAMS, DEFAULTPARAMS,
+                                                SCRIPT, delete_existing_files=True)
+
+    assert set(statuses(outputloc).values()) == {'generated'}
+    assert os.listdir(outputloc) == []
+    assert not os.path.exists(os.path.join(workingdir, 'sweep', '.storage'))
@@ -0,0 +1,78 @@
+from __future__ import division, print_function
+import os
+import pytest
+
+import pylumerical as pyl
+from pylumerical.sweep import LatinHypercubeSweep, SobolSweep, refinesweep
+from conftest import SCRIPT, DEFAULTPARAMS
+
+NEWPARAMS = [('MarginXY', (1e-7, 3e-7)), ('N01', (0, 7))]
+
+
+def points(sweep):
+    return [parameters for name, parameters in sweep]
+
+
+@pytest.mark.parametrize('sampler', [LatinHypercubeSweep, SobolSweep])
+def test_a_seed_fixes_the_sample(sampler):
+    first = points(sampler(NEWPARAMS, DEFAULTPARAMS, 8, seed=1))
+    assert first == points(sampler(NEWPARAMS, DEFAULTPARAMS, 8, seed=1))
+    assert first != points(sampler(NEWPARAMS, DEFAULTPARAMS, 8, seed=2))
+
+
+@pytest.mark.parametrize('sampler', [LatinHypercubeSweep, SobolSweep])
+def test_every_stratum_is_sampled_once(sampler):
+    sample = points(sampler(NEWPARAMS, DEFAULTPARAMS, 8, seed=3))
+    assert sorted(point['N01'] for point in sample) == list(range(8))
+    assert sorted(int((point['MarginXY'] - 1e-7) / 2e-7 * 8) for point in sample) == \
+        list(range(8))
+
+
+def test_sobol_is_the_sobol_sequence_without_a_seed():
+    sweep = SobolSweep([('a', (0., 1.)), ('b', (0., 1.))], {}, 4)
+    assert points(sweep) == [{'a': 0, 'b': 0}, {'a': 0.5, 'b': 0.5},
+                             {'a': 0.75, 'b': 0.25}, {'a': 0.25, 'b': 0.75}]
+
+
+def test_sobol_slices_keep_the_seed():
+    sweep = SobolSweep(NEWPARAMS, DEFAULTPARAMS, 16, seed=4)
+    assert list(sweep[3:9]) == list(sweep)[3:9]
+    assert sorted(sum((list(sweep.shard(i, 3)) for i in range(3)), [])) == sorted(sweep)
+
+
+def test_sampled_sweeps_are_repeatable(workingdir):
+    fsplocs = [pyl.ParameterSweepInput(workingdir, keyword, NEWPARAMS, DEFAULTPARAMS, SCRIPT,
+                                       sampler='sobol', samples=4, seed=5)[0]
+               for keyword in ('first', 'second')]
+    assert sorted(os.listdir(fsplocs[0])) == sorted(os.listdir(fsplocs[1]))
+
+
+def test_the_grid_takes_no_seed(workingdir):
+    with pytest.raises(ValueError):
+        pyl.ParameterSweepInput(workingdir, 'grid', [('MarginXY', [1e-7])], DEFAULTPARAMS,
+                                SCRIPT, seed=1)
+
+
+@pytest.mark.parametrize('sampler', [LatinHypercubeSweep, SobolSweep])
+def test_sampled_points_are_refined(sampler):
+    sample = points(sampler([('x', (0., 1.)), ('y', (0., 1.))], {}, 16, seed=6))
+    refined = refinesweep(sample, [point['x'] ** 2 + point['y'] for point in sample], 4)
+    assert len(refined) == 4
+    assert all(0 < point['x'] < 1 and 0 < point['y'] < 1 for point in refined)
+    assert not any(point in sample for point in refined)
+
+
+@pytest.mark.parametrize('sampler', ['lhs', 'sobol'])
+def test_samplers_need_samples(workingdir, sampler):
+    with pytest.raises(ValueError):
+        pyl.ParameterSweepInput(workingdir, 'nosamples', NEWPARAMS, DEFAULTPARAMS, SCRIPT,
+                                sampler=sampler)
+
+
+def test_readme_describes_the_sample(workingdir):
+    pyl.ParameterSweepInput(workingdir, 'readme', NEWPARAMS, DEFAULTPARAMS, SCRIPT,
+                            sampler='lhs', samples=4, seed=7)
+    with open(os.path.join(workingdir, 'readme', 'README')) as readme:
+        details = readme.read()
+    assert "MarginXY sampled from 1e-07 to 3e-07 (4 samples)" in details
+    assert "steps" not in details
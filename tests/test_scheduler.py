@@ -0,0 +1,89 @@
+from __future__ import division, print_function
+from subprocess import CalledProcessError
+import os
+
+from pylumerical.scheduler import ScheduleFSPfiles, readstate, STATE, LOGS
+
+FSPNAMES = ['a', 'b', 'c']
+
+
+def fsploc(tmp_path):
+    for fspname in FSPNAMES:
+        (tmp_path / (fspname + '.fsp')).write_text(u'fsp')
+    return str(tmp_path)
+
+
+class Engine(object):
+    '''
+    Job recording the files it ran, failing those in _failing_
+    '''
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.ran = []
+
+    def __call__(self, fspname, **overrides):
+        self.ran.append(fspname)
+        if fspname in self.failing:
+            raise CalledProcessError(1, 'engine', output="Error: " + fspname)
+        return "ran " + fspname
+
+
+def journal(location):
+    with open(os.path.join(location, STATE), 'r') as state:
+        return state.readlines()
+
+
+def test_every_job_is_journalled(tmp_path):
+    location = fsploc(tmp_path)
+    results = ScheduleFSPfiles(location, Engine(failing=['b']), jobs=2)
+
+    assert [result['returncode'] for result in results] == [0, 1, 0]
+    state = readstate(location)
+    assert sorted(state) == FSPNAMES
+    assert state['b']['error'] is not None
+    with open(state['a']['log'], 'r') as log:
+        assert log.read() == "ran a"
+    assert sorted(os.listdir(os.path.join(location, LOGS))) == ['a.log', 'b.log', 'c.log']
+
+
+def test_resume_runs_failed_and_changed_files(tmp_path):
+    location = fsploc(tmp_path)
+    ScheduleFSPfiles(location, Engine(failing=['b']), jobs=2)
+
+    (tmp_path / 'c.fsp').write_text(u'changed')
+    os.utime(str(tmp_path / 'c.fsp'), (0, 0))
+    engine = Engine()
+    results = ScheduleFSPfiles(location, engine, jobs=2)
+
+    assert sorted(engine.ran) == ['b', 'c']
+    assert all(result['returncode'] == 0 for result in results)
+
+    engine = Engine()
+    ScheduleFSPfiles(location, engine)
+    assert engine.ran == []
+
+    ScheduleFSPfiles(location, engine, resume=False)
+    assert sorted(engine.ran) == FSPNAMES
+
+
+def test_the_journal_is_compacted(tmp_path):
+    location = fsploc(tmp_path)
+    for attempt in range(3):
+        ScheduleFSPfiles(location, Engine(), resume=False)
+    assert len(journal(location)) == len(FSPNAMES)
+
+    os.remove(os.path.join(location, 'a.fsp'))
+    ScheduleFSPfiles(location, Engine(), resume=False)
+    assert sorted(readstate(location)) == ['b', 'c']
+
+
+def test_an_interrupted_record_is_ignored(tmp_path):
+    location = fsploc(tmp_path)
+    ScheduleFSPfiles(location, Engine())
+    with open(os.path.join(location, STATE), 'a') as state:
+        state.write('{"fsp": "a", "returncode": 1')
+
+    engine = Engine()
+    ScheduleFSPfiles(location, engine)
+    assert engine.ran == []
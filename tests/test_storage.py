@@ -0,0 +1,40 @@
+from __future__ import division, print_function
+import errno
+import os
+
+import pytest
+
+import pylumerical as pyl
+from pylumerical.retry import RetryQueue
+from conftest import SCRIPT, PROCESSING, SCRIPTPARAMS, DEFAULTPARAMS
+
+NEWPARAMS = [('MarginXY', [i * 1e-8 for i in range(1, 9)])]
+
+
+def runsweep(workingdir, **kwargs):
+    return pyl.RunSweep(workingdir, 'storage', NEWPARAMS, DEFAULTPARAMS, SCRIPT, PROCESSING,
+                        SCRIPTPARAMS, jobs=2, **kwargs)
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_a_sweep_over_budget_raises(workingdir, workers):
+    with pytest.raises(EnvironmentError) as raised:
+        runsweep(workingdir, max_workers=workers, storage=pyl.StoragePolicy(max_bytes=1))
+    assert raised.value.errno == errno.ENOSPC
+
+
+def test_processed_fsp_files_are_deleted(workingdir):
+    fsploc, outputloc = runsweep(workingdir, max_workers=2, delete_fsp=True)
+
+    assert not [fn for fn in os.listdir(fsploc) if fn.endswith('.fsp')]
+    assert len(pyl.LoadSweep(outputloc)) == len(NEWPARAMS[0][1])
+
+
+def test_job_source_errors_reach_the_caller():
+    def jobs():
+        yield 1
+        yield 2
+        raise IOError(errno.ENOSPC, "full")
+
+    with pytest.raises(IOError):
+        RetryQueue(4).run(lambda job: job, jobs())
@@ -0,0 +1,65 @@
+from __future__ import division, print_function
+import json
+import os
+
+import pytest
+
+import pylumerical as pyl
+from pylumerical.tracing import span, count, TIMINGS
+from conftest import SCRIPT, PROCESSING, SCRIPTPARAMS, DEFAULTPARAMS
+
+
+def test_nothing_is_recorded_without_a_tracer():
+    tracer = pyl.Tracer()
+    with span('outside'):
+        count('outside')
+    assert tracer.events == [] and tracer.counters == {}
+
+
+def test_spans_and_counters_are_summarised():
+    with pyl.Tracer() as tracer:
+        for n in range(3):
+            with span('stage', job=n):
+                pass
+        count('retries', 2)
+        with pytest.raises(ValueError):
+            with span('broken'):
+                raise ValueError("broken")
+
+    summary = tracer.summary()
+    assert summary['stage']['count'] == 3
+    assert summary['stage']['mean'] == pytest.approx(summary['stage']['total'] / 3)
+    assert tracer.events[-1]['args'] == {'error': 'ValueError'}
+    assert tracer.counters == {'retries': 2}
+    assert "retries" in tracer.table().splitlines()[-1]
+
+
+def test_traces_are_saved(tmp_path):
+    with pyl.Tracer() as tracer:
+        with span('stage', job='a'):
+            count('retries')
+
+    tracer.save(str(tmp_path / 'trace.json'))
+    with open(str(tmp_path / 'trace.json')) as jsonfile:
+        saved = json.load(jsonfile)
+    assert [event['name'] for event in saved['events']] == ['stage']
+    assert saved['counters'] == {'retries': 1}
+
+    tracer.chrome(str(tmp_path / 'chrome.json'))
+    with open(str(tmp_path / 'chrome.json')) as jsonfile:
+        chrome = json.load(jsonfile)
+    assert [event['ph'] for event in chrome['traceEvents']] == ['X', 'M']
+    assert chrome['traceEvents'][0]['args'] == {'job': 'a'}
+
+
+def test_sweeps_write_their_timings(workingdir):
+    with pyl.Tracer() as tracer:
+        fsploc, outputloc = pyl.RunSweep(workingdir, 'traced', [('MarginXY', [1e-7, 2e-7])],
+                                         DEFAULTPARAMS, SCRIPT, PROCESSING, SCRIPTPARAMS)
+
+    summary = tracer.summary()
+    assert summary['simulate']['count'] == 2
+    assert summary['RunSweep']['count'] == 1
+    assert 'maxrss' in summary['engine']
+    with open(os.path.join(workingdir, 'traced', TIMINGS)) as timings:
+        assert "RunSweep" in timings.read()